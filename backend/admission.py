@@ -0,0 +1,98 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM capacity exceeded ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Caps concurrent LLM calls with a bounded FIFO wait queue.
+
+    Up to ``max_concurrency`` calls run at once and up to ``max_queue`` more
+    wait for a slot for at most ``queue_timeout`` seconds. Anything beyond
+    that is rejected immediately with AdmissionRejected, carrying a
+    Retry-After estimate based on how long slots are currently held.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 observe_wait: Optional[Callable[[float], None]] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._observe_wait = observe_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_seconds = 1.0
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * self._hold_seconds))
+
+    @asynccontextmanager
+    async def slot(self):
+        queued_at = time.perf_counter()
+        if self._semaphore.locked() or self.waiting:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("queue full", self.retry_after())
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise AdmissionRejected("queue timeout", self.retry_after())
+            finally:
+                self.waiting -= 1
+        else:
+            # A free slot is taken without suspending
+            await self._semaphore.acquire()
+
+        admitted_at = time.perf_counter()
+        if self._observe_wait is not None:
+            self._observe_wait(admitted_at - queued_at)
+        self.admitted += 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - admitted_at)
+
+    def has_spare_capacity(self) -> bool:
+        return not self._semaphore.locked() and not self.waiting
+
+    async def try_acquire(self) -> Optional[Callable[[], None]]:
+        # A slot for optional extra work (hedged requests), taken only when
+        # one is free right now so it never queues ahead of real callers.
+        # Returns the function releasing it, or None when no slot is free
+        if not self.has_spare_capacity():
+            return None
+        # A free slot is taken without suspending
+        await self._semaphore.acquire()
+        self.active += 1
+
+        def release():
+            self.active -= 1
+            self._semaphore.release()
+        return release
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields kept for each archived message; _id, session_id, metadata and the
+# idempotency key only matter while a session is live
+ARCHIVED_MESSAGE_FIELDS = ("id", "message_type", "content", "urgency_level", "next_questions", "timestamp")
+
+def trim_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: message[field] for field in ARCHIVED_MESSAGE_FIELDS if message.get(field) is not None}
+
+async def load_archived_messages(db, session_id: str) -> List[Dict[str, Any]]:
+    archive = await db.message_archives.find_one({"session_id": session_id}, {"_id": 0, "messages": 1})
+    if not archive:
+        return []
+    # A run interrupted between the archive write and marking the hot
+    # messages can push a message twice; keep the first copy
+    seen = set()
+    messages = []
+    for message in archive["messages"]:
+        if message["id"] not in seen:
+            seen.add(message["id"])
+            messages.append(dict(message, session_id=session_id))
+    return messages
+
+class SessionArchiver:
+    """Moves messages of closed or idle sessions into one compact document
+    per session in message_archives.
+
+    Messages are appended to the archive first, then stamped with archived_at
+    in the hot collection, where a TTL index removes them after a grace
+    period. Sessions keep archived/archived_count, so readers know when to
+    look in the archive and new messages in a resumed session are archived
+    incrementally on a later run. Candidates are taken longest-idle first. A
+    session with nothing left to archive (its messages already expired, or a
+    counter ahead of the stored messages) has archived_count raised to its
+    message_count, so it is not picked again and cannot fill every batch.
+    """
+
+    def __init__(self, db, idle_after: timedelta, interval: float, batch_size: int = 100,
+                 on_archived: Optional[Callable[[str], None]] = None):
+        self._db = db
+        self.idle_after = idle_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self._on_archived = on_archived
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self.run_once()
+                if archived:
+                    logger.info(f"Archived messages of {archived} sessions")
+            except Exception as e:
+                logger.error(f"Session archival failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        cutoff = datetime.utcnow() - self.idle_after
+        sessions = await self._db.chat_sessions.find(
+            {
+                "$or": [{"status": "closed"}, {"last_message_at": {"$lt": cutoff}}],
+                "message_count": {"$type": "number"},
+                "$expr": {"$gt": ["$message_count", {"$ifNull": ["$archived_count", 0]}]}
+            },
+            {"session_id": 1, "message_count": 1}
+        ).sort("last_message_at", 1).limit(self.batch_size).to_list(length=self.batch_size)
+
+        for session in sessions:
+            await self.archive_session(session["session_id"], session["message_count"])
+        return len(sessions)
+
+    async def archive_session(self, session_id: str, message_count: Optional[int] = None) -> int:
+        messages = await self._db.messages.find(
+            {"session_id": session_id, "archived_at": {"$exists": False}}
+        ).sort([("timestamp", 1), ("id", 1)]).to_list(length=None)
+        if not messages:
+            if message_count is not None:
+                await self._db.chat_sessions.update_one(
+                    {"session_id": session_id}, {"$max": {"archived_count": message_count}}
+                )
+            return 0
+
+        now = datetime.utcnow()
+        await self._db.message_archives.update_one(
+            {"session_id": session_id},
+            {
+                "$push": {"messages": {"$each": [trim_message(message) for message in messages]}},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        )
+        ids = [message["id"] for message in messages]
+        # session_id keeps the update on the session_timestamp_id index
+        await self._db.messages.update_many(
+            {"session_id": session_id, "id": {"$in": ids}}, {"$set": {"archived_at": now}}
+        )
+        await self._db.chat_sessions.update_one(
+            {"session_id": session_id},
+            {"$set": {"archived": True, "archived_at": now}, "$inc": {"archived_count": len(messages)}}
+        )
+        if self._on_archived is not None:
+            self._on_archived(session_id)
+        return len(messages)
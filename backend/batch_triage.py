@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Offline bulk triage of intake texts through the send_message pipeline.
+
+Reads NDJSON records such as
+
+    {"id": "clinic-0001", "message": "Ho la febbre da due giorni", "profile": {"eta": "31-50", "language": "it"}}
+
+and runs each one through the same context building, LLM call,
+classification and persistence as /api/chat/message, in-process and with
+bounded parallelism. A record may carry an existing "session_id"; otherwise
+a session (and its profile, when given) is created for it. Results are
+streamed as NDJSON in completion order. Lines that are not a record, and
+records still refused as overloaded after --max-wait seconds of retrying,
+are reported as {"id": ..., "error": ...} results without stopping the run.
+With --checkpoint, the ids of finished records are appended to a file and
+skipped on the next run, so an interrupted import can be resumed.
+
+    python batch_triage.py intake.ndjson --output results.ndjson --checkpoint intake.done --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from fastapi import HTTPException
+
+import server
+
+async def triage_record(record, max_wait: float = 300.0):
+    session_id = record.get("session_id")
+    if not session_id:
+        session_id = (await server.create_session())["session_id"]
+        if record.get("profile"):
+            await server.create_or_update_profile(session_id, server.ProfileUpdateRequest(**record["profile"]))
+
+    # The record id doubles as idempotency key, so a record with a session_id
+    # retried after a crash before its checkpoint does not get a second turn.
+    # Templated fallback replies are refused: an import waits out short LLM
+    # outages, up to max_wait seconds per record.
+    waited = 0
+    while True:
+        try:
+            result = await server.run_chat_turn(
+                session_id, record["message"], f"batch-{record['id']}", allow_fallback=False
+            )
+            break
+        except HTTPException as e:
+            delay = int((e.headers or {}).get("Retry-After", "1"))
+            if e.status_code not in (429, 503) or waited + delay > max_wait:
+                raise
+            await asyncio.sleep(delay)
+            waited += delay
+
+    return {
+        "id": record["id"],
+        "session_id": session_id,
+        "response": result["response"],
+        "urgency_level": result["urgency_level"],
+        "next_questions": result["next_questions"]
+    }
+
+def read_records(path, done):
+    # (line number, record, None) for each record still to do, and
+    # (line number, None, reason) for lines that are not a record
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Line {line_number} is not valid JSON: {e}"
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get("message"), str):
+                yield line_number, None, f"Line {line_number} has no \"message\" text"
+                continue
+            record.setdefault("id", str(line_number))
+            record["id"] = str(record["id"])
+            if record["id"] not in done:
+                yield line_number, record, None
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+async def run(args):
+    checkpoint = Path(args.checkpoint) if args.checkpoint else None
+    done = set(checkpoint.read_text().split()) if checkpoint and checkpoint.exists() else set()
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    checkpoint_file = open(checkpoint, "a", encoding="utf-8") if checkpoint else None
+    # Bounded so a large input is read no faster than it is processed
+    queue = asyncio.Queue(args.concurrency * 2)
+    stats = {"ok": 0, "error": 0}
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line_number, record, invalid = item
+            if invalid is not None:
+                result = {"id": str(line_number), "error": invalid}
+                stats["error"] += 1
+            else:
+                try:
+                    result = await triage_record(record, args.max_wait)
+                    stats["ok"] += 1
+                except Exception as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    result = {"id": record["id"], "error": detail}
+                    stats["error"] += 1
+
+            output.write(json.dumps(result, default=str, ensure_ascii=False) + "\n")
+            output.flush()
+            if checkpoint_file and "error" not in result:
+                checkpoint_file.write(record["id"] + "\n")
+                checkpoint_file.flush()
+
+    await server.app.router.startup()
+    started = time.perf_counter()
+    try:
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        for item in read_records(args.input, done):
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        # Flushes write-behind batches before exiting
+        await server.app.router.shutdown()
+        if output is not sys.stdout:
+            output.close()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    elapsed = time.perf_counter() - started
+    processed = stats["ok"] + stats["error"]
+    print(
+        f"Processed {processed} records ({stats['ok']} ok, {stats['error']} failed, {len(done)} skipped) "
+        f"in {elapsed:.1f}s, {processed / elapsed if elapsed else 0:.1f} records/s",
+        file=sys.stderr
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk triage of NDJSON intake texts")
+    parser.add_argument("input", help="NDJSON file, or - for stdin")
+    parser.add_argument("--output", help="append NDJSON results to this file instead of stdout")
+    parser.add_argument("--checkpoint", help="file of finished record ids, used to resume")
+    parser.add_argument("--concurrency", type=int, default=16, help="records processed in parallel")
+    parser.add_argument("--max-wait", type=float, default=300.0,
+                        help="seconds a record may wait out 429/503 responses before it is reported as failed")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import json
+from datetime import datetime
+from typing import Any
+from bson import json_util
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+def _default(obj: Any) -> Any:
+    # Same relaxed Extended JSON shapes json_util.dumps produces, e.g.
+    # {"$oid": "..."} and {"$date": "...Z"}, without walking the whole document
+    return json_util.default(obj, json_options=json_util.DEFAULT_JSON_OPTIONS)
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bson(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps_bson(content: Any) -> bytes:
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def bson_date(value: datetime) -> str:
+    return _default(value)["$date"]
+
+class BSONResponse(JSONResponse):
+    # Encodes Mongo documents straight to bytes in one pass; return it from a
+    # route so FastAPI skips jsonable_encoder
+    def render(self, content: Any) -> bytes:
+        return dumps_bson(content)
@@ -0,0 +1,127 @@
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it only gzip is offered
+    brotli = None
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    # Accept-Encoding as {coding: q}; codings with q=0 are refused
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class CompressionMiddleware:
+    """ASGI middleware compressing response bodies with the best coding the
+    client accepts: brotli when the brotli package is installed, else gzip.
+
+    Bodies smaller than minimum_size that arrive in a single message are sent
+    as they are. Streamed bodies are compressed chunk by chunk as they pass
+    through. Responses that already carry a Content-Encoding, event streams
+    (whose chunks must reach the client as they are produced) and bodiless
+    statuses are left alone. All of them get Vary: Accept-Encoding, so a
+    shared cache never hands one client's coding to another.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 enabled: bool = True):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+
+    def negotiate(self, header: str) -> Optional[str]:
+        accepted = accepted_encodings(header)
+        offered = (["br"] if brotli is not None else []) + ["gzip"]
+        best = max(offered, key=lambda coding: accepted.get(coding, accepted.get("*", 0.0)))
+        return best if accepted.get(best, accepted.get("*", 0.0)) > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        # No acceptable coding still goes through send_compressed: the body is
+        # sent as it is, but caches must learn that it varies on Accept-Encoding
+        coding = self.negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Held back until the first body message tells whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                response_headers = dict(start.get("headers", []))
+                skip = (
+                    coding is None
+                    or b"content-encoding" in response_headers
+                    or response_headers.get(b"content-type", b"").startswith(b"text/event-stream")
+                    or start["status"] in (204, 304)
+                    or (not more_body and len(body) < self.minimum_size)
+                )
+                if not skip:
+                    compressor = _Brotli(self.brotli_quality) if coding == "br" else _Gzip(self.gzip_level)
+                    start["headers"] = [
+                        (name, value) for name, value in start.get("headers", []) if name != b"content-length"
+                    ] + [(b"content-encoding", coding.encode())]
+                if b"vary" not in response_headers:
+                    start["headers"] = list(start.get("headers", [])) + [(b"vary", b"Accept-Encoding")]
+                await send(start)
+                start = None
+
+            if compressor is None:
+                await send(message)
+                return
+            body = compressor.compress(body)
+            if not more_body:
+                body += compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+        if start is not None:
+            # A response without any body message
+            await send(start)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+class DocumentCache:
+    """LRU cache with a TTL for Mongo documents keyed by session_id.
+
+    Misses are single-flight: concurrent lookups of the same key share one
+    loader call. Missing documents (None) are cached as well. Callers get a
+    shallow copy, so mutating a returned document never alters the cache.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._stale: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1]) if entry[1] is not None else None
+
+        self.misses += 1
+        pending = self._loading.get(key)
+        if pending is not None:
+            doc = await asyncio.shield(pending)
+            return dict(doc) if doc is not None else None
+
+        pending = asyncio.get_running_loop().create_future()
+        self._loading[key] = pending
+        try:
+            doc = await loader()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                pending.cancel()
+            else:
+                pending.set_exception(e)
+                pending.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        finally:
+            self._loading.pop(key, None)
+            # A put()/invalidate() that raced with this read wins over its result
+            stale = key in self._stale
+            self._stale.discard(key)
+
+        if not stale:
+            self._store(key, doc)
+        pending.set_result(doc)
+        return dict(doc) if doc is not None else None
+
+    def _store(self, key: str, doc: Optional[Dict[str, Any]]):
+        self._entries[key] = (time.monotonic() + self.ttl, doc)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, doc: Optional[Dict[str, Any]]):
+        # Write-through after a successful database write
+        if self.enabled:
+            self._store(key, dict(doc) if doc is not None else None)
+            if key in self._loading:
+                self._stale.add(key)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+        if key in self._loading:
+            self._stale.add(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
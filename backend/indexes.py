@@ -0,0 +1,65 @@
+import logging
+import os
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the hot queries in server.py, keyed by collection name
+INDEXES = {
+    "messages": [
+        # find({"session_id"}).sort("timestamp") in both directions and the
+        # (timestamp, id) keyset pagination of /chat/history
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="session_timestamp_id"),
+        # Idempotent chat turns: one user and one assistant message per key
+        IndexModel(
+            [("session_id", ASCENDING), ("idempotency_key", ASCENDING), ("message_type", ASCENDING)],
+            name="session_idempotency_key",
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}}
+        ),
+        # Archived messages are dropped from the hot collection after a grace period
+        IndexModel(
+            [("archived_at", ASCENDING)],
+            name="archived_at_ttl",
+            expireAfterSeconds=int(os.environ.get('ARCHIVE_MESSAGE_TTL_SECONDS', '86400'))
+        ),
+    ],
+    # Bucket storage mode: the open bucket of a session and its newest buckets
+    "message_buckets": [
+        IndexModel([("session_id", ASCENDING), ("count", ASCENDING)], name="session_count"),
+        IndexModel([("session_id", ASCENDING), ("last_timestamp", ASCENDING)], name="session_last_timestamp"),
+        # Idempotent chat turns: a key is stored in at most one bucket of a session
+        IndexModel(
+            [("session_id", ASCENDING), ("idempotency_keys", ASCENDING)],
+            name="session_idempotency_keys",
+            unique=True,
+            partialFilterExpression={"idempotency_keys": {"$exists": True}}
+        ),
+    ],
+    "message_archives": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "chat_sessions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        # Archiver candidates, longest-idle first: one index per $or branch,
+        # both in last_message_at order so the branches merge without a sort
+        IndexModel([("last_message_at", ASCENDING)], name="last_message_at"),
+        IndexModel([("status", ASCENDING), ("last_message_at", ASCENDING)], name="status_last_message_at"),
+    ],
+    "user_profiles": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+}
+
+async def ensure_indexes(db):
+    # create_indexes is a no-op for indexes that already exist with the same
+    # spec, so this is safe to run on every startup
+    for collection, models in INDEXES.items():
+        try:
+            created = await db[collection].create_indexes(models)
+            logger.info(f"Indexes ensured on {collection}: {', '.join(created)}")
+        except OperationFailure as e:
+            # e.g. duplicate session_id documents blocking a unique index;
+            # keep serving and let an operator clean up the data
+            logger.error(f"Could not ensure indexes on {collection}: {str(e)}")
@@ -0,0 +1,64 @@
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class LlmClientPool:
+    """Reuses configured chat clients across requests.
+
+    Clients are built by ``factory(session_id, system_message, tier)`` and
+    kept per system message and model tier. A checked-out client is used by one request at a time;
+    before each checkout its instance state is reset to what it was right
+    after configuration and the session id is applied on top, so no
+    conversation state leaks between sessions while anything the client
+    holds (HTTP connections, provider config) is kept.
+    """
+
+    def __init__(self, factory: Callable[[str, str, Optional[str]], Any], max_idle: int = 32):
+        self._factory = factory
+        self._max_idle = max_idle
+        self._idle: Dict[Tuple[str, Optional[str]], List[Any]] = defaultdict(list)
+        self._pristine: Dict[int, Dict[str, Any]] = {}
+        self.created = 0
+        self.reused = 0
+
+    def _overlay(self, chat: Any, session_id: str):
+        state = self._pristine[id(chat)]
+        chat.__dict__.update({
+            key: value.copy() if isinstance(value, (list, dict, set)) else value
+            for key, value in state.items()
+        })
+        chat.session_id = session_id
+
+    @asynccontextmanager
+    async def session_client(self, session_id: str, system_message: str, tier: Optional[str] = None):
+        idle = self._idle[(system_message, tier)]
+        if idle:
+            chat = idle.pop()
+            self._overlay(chat, session_id)
+            self.reused += 1
+        else:
+            chat = self._factory(session_id, system_message, tier)
+            self._pristine[id(chat)] = {
+                key: value.copy() if isinstance(value, (list, dict, set)) else value
+                for key, value in vars(chat).items()
+            }
+            self.created += 1
+
+        try:
+            yield chat
+        finally:
+            if len(idle) < self._max_idle:
+                idle.append(chat)
+            else:
+                del self._pristine[id(chat)]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "idle": sum(len(idle) for idle in self._idle.values())
+        }
+
+    def close(self):
+        self._idle.clear()
+        self._pristine.clear()
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pymongo import DESCENDING, UpdateOne
+
+def _order(message: Dict[str, Any]) -> Tuple[datetime, str]:
+    return message["timestamp"], message["id"]
+
+class MessageBuckets:
+    """Bucket-pattern storage for chat messages.
+
+    A session's messages are appended with $push to the session's open bucket
+    in message_buckets until it holds bucket_size messages; the next append
+    upserts a new bucket. Buckets carry their message count and first/last
+    timestamps, so the recent context of a chat turn or a page of history is
+    usually one or two document reads instead of a sort over many small
+    documents. A turn is never split across buckets, so a bucket may end up
+    slightly over bucket_size. An append never matches a bucket that already
+    holds one of its idempotency keys, so a duplicate turn fails on the
+    unique session_idempotency_keys index instead of being pushed again.
+    """
+
+    def __init__(self, db, bucket_size: int = 50):
+        self._db = db
+        self.bucket_size = bucket_size
+
+    def append_op(self, session_id: str, messages: List[Dict[str, Any]]) -> UpdateOne:
+        stored = [{key: value for key, value in message.items() if key != "session_id"} for message in messages]
+        timestamps = [message["timestamp"] for message in messages]
+        update = {
+            "$push": {"messages": {"$each": stored}},
+            "$inc": {"count": len(stored)},
+            "$min": {"first_timestamp": min(timestamps)},
+            "$max": {"last_timestamp": max(timestamps)}
+        }
+        query = {"session_id": session_id, "count": {"$lt": self.bucket_size}}
+        keys = sorted({message["idempotency_key"] for message in messages if message.get("idempotency_key")})
+        if keys:
+            update["$addToSet"] = {"idempotency_keys": {"$each": keys}}
+            query["idempotency_keys"] = {"$nin": keys}
+        return UpdateOne(query, update, upsert=True)
+
+    async def _newest(self, session_id: str, query: Dict[str, Any], wanted: int,
+                      keep: Callable[[Dict[str, Any]], bool] = lambda message: True) -> List[Dict[str, Any]]:
+        # Walk buckets newest-first until enough messages are collected, then
+        # order them exactly; messages come back newest-first
+        query = dict(query, session_id=session_id)
+        cursor = self._db.message_buckets.find(query, {"_id": 0, "messages": 1}).sort("last_timestamp", DESCENDING)
+        cursor = cursor.batch_size(wanted // self.bucket_size + 2)
+        messages = []
+        async for bucket in cursor:
+            messages.extend(message for message in bucket["messages"] if keep(message))
+            if len(messages) >= wanted:
+                break
+        messages.sort(key=_order, reverse=True)
+        for message in messages:
+            message["session_id"] = session_id
+        return messages[:wanted]
+
+    async def recent(self, session_id: str, limit: int) -> List[Dict[str, Any]]:
+        messages = await self._newest(session_id, {}, limit)
+        messages.reverse()
+        return messages
+
+    async def page(self, session_id: str, limit: int,
+                   before: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        # Same contract as the keyset query on messages: up to limit messages
+        # older than the cursor, newest-first
+        if before is None:
+            return await self._newest(session_id, {}, limit)
+        return await self._newest(
+            session_id, {"first_timestamp": {"$lte": before[0]}}, limit, lambda message: _order(message) < before
+        )
+
+    async def since(self, session_id: str, after: Optional[datetime]) -> List[Dict[str, Any]]:
+        query = {"session_id": session_id}
+        if after is not None:
+            query["last_timestamp"] = {"$gt": after}
+        messages = []
+        async for bucket in self._db.message_buckets.find(query, {"_id": 0, "messages": 1}):
+            messages.extend(
+                dict(message, session_id=session_id) for message in bucket["messages"]
+                if after is None or message["timestamp"] > after
+            )
+        messages.sort(key=_order)
+        return messages
+
+    async def find_turn(self, session_id: str, idempotency_key: str) -> List[Dict[str, Any]]:
+        # The user message and reply stored under an idempotency key
+        bucket = await self._db.message_buckets.find_one(
+            {"session_id": session_id, "idempotency_keys": idempotency_key}, {"_id": 0, "messages": 1}
+        )
+        if not bucket:
+            return []
+        return [
+            dict(message, session_id=session_id) for message in bucket["messages"]
+            if message.get("idempotency_key") == idempotency_key
+        ]
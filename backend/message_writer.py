@@ -0,0 +1,253 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+class DuplicateTurn(Exception):
+    # The session already holds a turn stored under the same idempotency key
+    pass
+
+class WriteFailed(Exception):
+    pass
+
+# A queued turn: its messages, session id, session counter update and the
+# future of a caller waiting for the flush (None when nobody waits)
+Turn = Tuple[List[Dict[str, Any]], str, Dict[str, Any], Optional["asyncio.Future"]]
+
+class _Outcome(NamedTuple):
+    landed: List[Turn]      # every message stored
+    duplicates: List[Turn]  # already stored under their idempotency key by another writer
+    retry: List[Turn]       # messages still to insert after a transient error
+    dead: List[Turn]        # outcome unknown and unsafe to retry
+    error: str
+
+def _own_duplicate(error: Dict[str, Any]) -> bool:
+    # A duplicate _id is a document this writer inserted in an earlier attempt
+    return error.get("keyPattern") == {"_id": 1} or " index: _id_ " in error.get("errmsg", "")
+
+class MessageWriter:
+    """Persists chat messages together with their session counter update.
+
+    In direct mode every call is one ordered bulk_write on messages followed,
+    once it succeeded, by one update on the session. With write_behind enabled
+    the call only enqueues; a background task coalesces whatever is queued
+    into a single insert_many on messages and a single bulk_write on
+    chat_sessions. write(wait=True) returns only once its turn is flushed, as
+    in a group commit. Both modes raise DuplicateTurn when the idempotency key
+    of the turn is already stored, and the session is then left untouched.
+    The queue is bounded, so producers wait instead of growing memory when
+    Mongo falls behind, and close() flushes everything still queued. When a
+    MessageBuckets store is given, messages are appended to its buckets
+    instead of being inserted as one document each. on_flushed is called
+    with each session id of a flushed batch, since the session document a
+    caller read after write() may predate the flush.
+
+    A flush inserts unordered, so one failing message does not keep the
+    rest of the batch out, and applies a turn's counter update only once all
+    of its messages are stored. Turns already stored under their idempotency
+    key by another writer get no second update. Messages that failed for
+    any other reason are retried max_retries times with backoff and then,
+    with their counter update, written to message_dead_letters.
+    """
+
+    def __init__(self, db, write_behind: bool = False, max_queue: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 0.02, buckets=None,
+                 on_flushed: Optional[Callable[[str], None]] = None, max_retries: int = 3,
+                 retry_delay: float = 0.1):
+        self._db = db
+        self._buckets = buckets
+        self._on_flushed = on_flushed
+        self.write_behind = write_behind
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: "asyncio.Queue[Optional[Turn]]" = asyncio.Queue(max_queue)
+        self._flusher: Optional[asyncio.Task] = None
+        self.duplicates = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        if self.write_behind and self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def write(self, session_id: str, messages: List[Dict[str, Any]], session_update: Dict[str, Any],
+                    wait: bool = False):
+        if self._flusher is not None:
+            flushed = asyncio.get_running_loop().create_future() if wait else None
+            await self._queue.put((messages, session_id, session_update, flushed))
+            if flushed is not None:
+                await flushed
+            return
+
+        try:
+            if self._buckets is not None:
+                await self._db.message_buckets.bulk_write([self._buckets.append_op(session_id, messages)])
+            else:
+                await self._db.messages.bulk_write([InsertOne(message) for message in messages], ordered=True)
+        except BulkWriteError as e:
+            if all(error.get("code") == DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise DuplicateTurn(str(e)) from e
+            raise
+        # Counted only once the messages are in
+        await self._db.chat_sessions.update_one({"session_id": session_id}, session_update)
+
+    async def insert(self, session_id: str, messages: List[Dict[str, Any]]):
+        # Messages only, written right away, for callers that create the
+        # session document with its counters already set
+        if self._buckets is not None:
+            await self._db.message_buckets.bulk_write([self._buckets.append_op(session_id, messages)])
+        else:
+            await self._db.messages.insert_many(messages, ordered=True)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Linger briefly so concurrent requests land in the same batch
+            await asyncio.sleep(self._flush_interval)
+            while len(batch) < self._batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Turn]):
+        pending, error = batch, ""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retried += len(pending)
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            outcome = await self._insert(pending)
+            await self._apply_counters(outcome.landed)
+            if outcome.duplicates:
+                self.duplicates += len(outcome.duplicates)
+                logger.warning(f"Write-behind flush skipped {len(outcome.duplicates)} turns already stored by another writer")
+            if outcome.dead:
+                await self._dead_letter(outcome.dead, outcome.error)
+            pending, error = outcome.retry, outcome.error
+            if not pending:
+                break
+        else:
+            await self._dead_letter(pending, error)
+
+        if self._on_flushed is not None:
+            for session_id in {session_id for _, session_id, _, _ in batch}:
+                self._on_flushed(session_id)
+        # Waiting callers resume only once the caches are invalidated
+        for _, _, _, flushed in batch:
+            if flushed is not None and not flushed.done():
+                flushed.set_result(None)
+
+    async def _insert(self, turns: List[Turn]) -> _Outcome:
+        if self._buckets is not None:
+            # One append per turn; a failed append changed nothing
+            owners = list(range(len(turns)))
+            write = self._db.message_buckets.bulk_write(
+                [self._buckets.append_op(session_id, messages) for messages, session_id, _, _ in turns], ordered=False
+            )
+        else:
+            owners = [index for index, (messages, _, _, _) in enumerate(turns) for _ in messages]
+            write = self._db.messages.insert_many(
+                [message for messages, _, _, _ in turns for message in messages], ordered=False
+            )
+
+        try:
+            await write
+            return _Outcome(turns, [], [], [], "")
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            error = str(e)
+        except Exception as e:
+            # Unknown how much landed. Inserted messages keep the _id they were
+            # given, so documents are safe to insert again; bucket appends are not
+            if self._buckets is not None:
+                return _Outcome([], [], [], turns, str(e))
+            return _Outcome([], [], turns, [], str(e))
+
+        failed: Dict[int, List[int]] = {}
+        duplicated = set()
+        for write_error in write_errors:
+            turn = owners[write_error["index"]]
+            if write_error.get("code") == DUPLICATE_KEY:
+                # Bucket appends are never retried after an unknown outcome,
+                # so their duplicates are always another writer's turn
+                if self._buckets is None and _own_duplicate(write_error):
+                    continue
+                duplicated.add(turn)
+            else:
+                # Position of the failed message within its turn
+                failed.setdefault(turn, []).append(write_error["index"] - owners.index(turn))
+
+        landed, duplicates, retry = [], [], []
+        for index, (messages, session_id, update, flushed) in enumerate(turns):
+            if index in duplicated:
+                duplicates.append(turns[index])
+                if flushed is not None:
+                    flushed.set_exception(DuplicateTurn(error))
+            elif index in failed:
+                retry.append(([messages[position] for position in failed[index]], session_id, update, flushed))
+            else:
+                landed.append(turns[index])
+        return _Outcome(landed, duplicates, retry, [], error)
+
+    async def _apply_counters(self, turns: List[Turn]):
+        if not turns:
+            return
+        try:
+            await self._db.chat_sessions.bulk_write(
+                [UpdateOne({"session_id": session_id}, update) for _, session_id, update, _ in turns], ordered=False
+            )
+        except Exception as e:
+            # The messages are stored, so waiting callers still succeed; keep
+            # the counter updates for replay
+            await self._dead_letter([([], session_id, update, None) for _, session_id, update, _ in turns], str(e))
+
+    async def _dead_letter(self, turns: List[Turn], error: str):
+        self.dead_lettered += len(turns)
+        logger.error(f"Write-behind gave up on {len(turns)} turns, moving them to message_dead_letters: {error}")
+        now = datetime.utcnow()
+        try:
+            await self._db.message_dead_letters.insert_many([
+                {
+                    "session_id": session_id,
+                    "messages": [{key: value for key, value in message.items() if key != "_id"} for message in messages],
+                    # Field names cannot start with "$"
+                    "session_update": {operator.lstrip("$"): fields for operator, fields in update.items()},
+                    "error": error,
+                    "failed_at": now
+                }
+                for messages, session_id, update, _ in turns
+            ])
+        except Exception as e:
+            logger.error(
+                f"Could not dead-letter turns of sessions {sorted({session_id for _, session_id, _, _ in turns})}: {str(e)}"
+            )
+        for _, _, _, flushed in turns:
+            if flushed is not None and not flushed.done():
+                flushed.set_exception(WriteFailed(error))
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        # The sentinel is queued behind pending writes, so they are all flushed first
+        await self._queue.put(None)
+        await self._flusher
+        self._flusher = None
@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Dict, NamedTuple, Optional
+
+class ModelTier(NamedTuple):
+    name: str
+    provider: str
+    model: str
+    max_tokens: int
+
+class ModelRouter:
+    """Picks the model tier of a chat turn from cheap features of the turn.
+
+    Opening turns, turns whose keyword urgency is above "low" and messages
+    longer than fast_max_chars go to the full tier; short low-urgency
+    follow-ups go to the fast tier. fast_max_chars adapts to the latency
+    observed over both tiers: while the recent p95 is above target_p95 it
+    grows (more turns take the fast tier), and while the p95 is well below
+    target it shrinks back, within [min_chars, max_chars]. The urgency and
+    opening-turn rules never adapt.
+    """
+
+    def __init__(self, fast: ModelTier, full: ModelTier, target_p95: float, fast_max_chars: int = 120,
+                 min_chars: int = 40, max_chars: int = 600, window: int = 200, adapt_every: int = 20,
+                 enabled: bool = True):
+        self.tiers = {fast.name: fast, full.name: full}
+        self.fast = fast
+        self.full = full
+        self.target_p95 = target_p95
+        self.fast_max_chars = fast_max_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.adapt_every = adapt_every
+        self.enabled = enabled
+        self._latencies = {name: deque(maxlen=window) for name in self.tiers}
+        self._recent = deque(maxlen=window)
+        self._observed = 0
+        self.routed = {name: 0 for name in self.tiers}
+
+    def route(self, text: str, urgency: str, turn_count: int) -> ModelTier:
+        tier = self.full
+        if self.enabled and turn_count > 0 and urgency == "low" and len(text) <= self.fast_max_chars:
+            tier = self.fast
+        self.routed[tier.name] += 1
+        return tier
+
+    def observe(self, tier: str, latency: float):
+        self._latencies[tier].append(latency)
+        self._recent.append(latency)
+        self._observed += 1
+        if self.enabled and self._observed % self.adapt_every == 0:
+            self._adapt()
+
+    def _adapt(self):
+        p95 = self._p95(self._recent)
+        if p95 is None:
+            return
+        if p95 > self.target_p95:
+            self.fast_max_chars = min(self.max_chars, int(self.fast_max_chars * 1.25) + 1)
+        elif p95 < 0.8 * self.target_p95:
+            self.fast_max_chars = max(self.min_chars, int(self.fast_max_chars * 0.8))
+
+    @staticmethod
+    def _p95(latencies) -> Optional[float]:
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"fast_max_chars": self.fast_max_chars, "target_p95_seconds": self.target_p95}
+        for name in self.tiers:
+            stats[f"{name}_routed"] = self.routed[name]
+            stats[f"{name}_p95_seconds"] = self._p95(self._latencies[name]) or 0.0
+        return stats
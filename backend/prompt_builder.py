@@ -0,0 +1,137 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+
+# Labels used to render the context block, per language
+TEMPLATES = {
+    "it": {
+        "profile": "Profilo utente: Età: {eta}, Genere: {genere}",
+        "unspecified": "Non specificato",
+        "main_symptom": "Sintomo principale: {value}",
+        "known_conditions": "Condizioni note: {value}",
+        "summary": "Riassunto conversazione precedente: {value}",
+        "recent": "\nConversazione recente:\n{value}",
+        "user": "Utente",
+        "assistant": "Assistente",
+        "message": "{context}\n\nNuovo messaggio utente: {value}",
+        "summary_prompt": """Sei un assistente che riassume conversazioni sanitarie tra un utente e MedAgent.
+Aggiorna il riassunto esistente con i nuovi messaggi in massimo 120 parole:
+- sintomi riferiti, durata, intensità e loro evoluzione
+- farmaci assunti, condizioni note e altre informazioni cliniche rilevanti
+- livello di urgenza emerso e consigli già dati
+Non aggiungere diagnosi o informazioni non presenti nella conversazione.""",
+        "existing_summary": "Riassunto esistente:\n{value}",
+        "new_messages": "Nuovi messaggi:\n{value}"
+    },
+    "en": {
+        "profile": "User profile: Age: {eta}, Gender: {genere}",
+        "unspecified": "Not specified",
+        "main_symptom": "Main symptom: {value}",
+        "known_conditions": "Known conditions: {value}",
+        "summary": "Summary of the earlier conversation: {value}",
+        "recent": "\nRecent conversation:\n{value}",
+        "user": "User",
+        "assistant": "Assistant",
+        "message": "{context}\n\nNew user message: {value}",
+        "summary_prompt": """You summarize healthcare conversations between a user and MedAgent.
+Update the existing summary with the new messages in at most 120 words:
+- reported symptoms, their duration, intensity and evolution
+- medications taken, known conditions and other relevant clinical information
+- urgency level that emerged and advice already given
+Do not add diagnoses or information not present in the conversation.""",
+        "existing_summary": "Existing summary:\n{value}",
+        "new_messages": "New messages:\n{value}"
+    }
+}
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for Latin-script text; deterministic
+    # and cheap enough to run on every candidate line
+    return math.ceil(len(text) / 4)
+
+class BuiltPrompt(BaseModel):
+    prompt: str
+    context: str
+    prompt_tokens: int
+    history_messages: int
+    history_dropped: int
+
+class PromptBuilder:
+    def __init__(self, token_budget: int, templates: Dict[str, Dict[str, str]] = TEMPLATES, default_language: str = "it"):
+        self.token_budget = token_budget
+        self.templates = templates
+        self.default_language = default_language
+
+    def _template(self, language: Optional[str]) -> Dict[str, str]:
+        return self.templates.get(language) or self.templates[self.default_language]
+
+    def format_message(self, message: Dict[str, Any], language: Optional[str] = None) -> str:
+        template = self._template(language)
+        speaker = template["user"] if message["message_type"] == "user" else template["assistant"]
+        return f"{speaker}: {message['content']}"
+
+    def format_transcript(self, messages: List[Dict[str, Any]], language: Optional[str] = None) -> str:
+        return "\n".join(self.format_message(message, language) for message in messages)
+
+    def build_summary(
+        self, messages: List[Dict[str, Any]], existing: Optional[str] = None, language: Optional[str] = None
+    ) -> Tuple[str, str]:
+        # System prompt and request folding messages into the rolling summary
+        template = self._template(language)
+        request = "\n\n".join(filter(None, [
+            template["existing_summary"].format(value=existing) if existing else None,
+            template["new_messages"].format(value=self.format_transcript(messages, language))
+        ]))
+        return template["summary_prompt"], request
+
+    def build(
+        self,
+        user_message: str,
+        history: List[Dict[str, Any]],
+        profile: Optional[Dict[str, Any]] = None,
+        summary: Optional[str] = None,
+        language: Optional[str] = None,
+        reserved_tokens: int = 0
+    ) -> BuiltPrompt:
+        template = self._template(language)
+
+        context_parts = []
+        if profile:
+            context_parts.append(template["profile"].format(
+                eta=profile.get('eta') or template["unspecified"],
+                genere=profile.get('genere') or template["unspecified"]
+            ))
+            if profile.get('sintomo_principale'):
+                context_parts.append(template["main_symptom"].format(value=profile['sintomo_principale']))
+            if profile.get('condizioni_note'):
+                context_parts.append(template["known_conditions"].format(value=', '.join(profile['condizioni_note'])))
+        if summary:
+            context_parts.append(template["summary"].format(value=summary))
+
+        # Profile, summary, the new message and the fixed labels always go in;
+        # history fills what is left of the budget, newest message first
+        fixed = template["message"].format(
+            context="\n".join(context_parts + [template["recent"].format(value="")]),
+            value=user_message
+        )
+        remaining = self.token_budget - reserved_tokens - estimate_tokens(fixed)
+
+        lines = []
+        for message in reversed(history):
+            line = self.format_message(message, language)
+            cost = estimate_tokens(line + "\n")
+            if cost > remaining:
+                break
+            lines.append(line)
+            remaining -= cost
+        lines.reverse()
+
+        context = "\n".join(context_parts + [template["recent"].format(value="\n".join(lines))])
+        prompt = template["message"].format(context=context, value=user_message)
+        return BuiltPrompt(
+            prompt=prompt,
+            context=context,
+            prompt_tokens=estimate_tokens(prompt) + reserved_tokens,
+            history_messages=len(lines),
+            history_dropped=len(history) - len(lines)
+        )
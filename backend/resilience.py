@@ -0,0 +1,170 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+class LlmUnavailable(Exception):
+    # reason is one of "circuit_open", "timeout" or "error"
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"LLM unavailable ({reason}){': ' + detail if detail else ''}")
+        self.reason = reason
+
+class CircuitOpen(LlmUnavailable):
+    def __init__(self, retry_after: int):
+        super().__init__("circuit_open", f"retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failed calls and rejects
+    calls for reset_timeout seconds. Then one probe call at a time is let
+    through (at most one per reset_timeout); its success closes the circuit
+    and its failure opens it again."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probe_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_at = None
+        if self.state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.reset_timeout):
+            # A probe that never reported back (e.g. cancelled) does not block later ones
+            self._probe_at = now
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.reset_timeout - (time.monotonic() - self._opened_at)))
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+class ResilientCaller:
+    """Runs LLM calls with a deadline per attempt, optional hedging and a
+    circuit breaker.
+
+    With hedging enabled, a second attempt is started when the first has not
+    answered after the recent p95 latency (never sooner than hedge_min_delay),
+    or right away when the first fails; whichever answers first wins and the
+    other is cancelled. A hedge runs only when acquire_hedge grants it
+    capacity of its own, which is released as soon as the hedge finishes. A
+    call fails only when every attempt failed, and each failed call counts
+    once towards opening the circuit. Callers run check() first, before
+    waiting for any other resource.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, attempt_timeout: float = 30.0, hedging: bool = False,
+                 hedge_min_delay: float = 1.0, window: int = 200, min_samples: int = 20):
+        self.breaker = breaker
+        self.attempt_timeout = attempt_timeout
+        self.hedging = hedging
+        self.hedge_min_delay = hedge_min_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self.hedged = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    def hedge_delay(self) -> float:
+        if len(self._latencies) < self.min_samples:
+            return max(self.hedge_min_delay, self.attempt_timeout / 2)
+        latencies = sorted(self._latencies)
+        return max(self.hedge_min_delay, latencies[int(0.95 * (len(latencies) - 1))])
+
+    def check(self):
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpen(self.breaker.retry_after())
+
+    def succeeded(self, latency: float):
+        self.breaker.record_success()
+        self._latencies.append(latency)
+
+    def failed(self):
+        self.failures += 1
+        self.breaker.record_failure()
+
+    async def _attempt(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await asyncio.wait_for(attempt(), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def call(self, attempt: Callable[[], Awaitable[T]],
+                   acquire_hedge: Optional[Callable[[], Awaitable[Optional[Callable[[], None]]]]] = None) -> T:
+        started = time.perf_counter()
+        primary = asyncio.create_task(self._attempt(attempt))
+        tasks = {primary}
+        hedge_at = started + self.hedge_delay() if self.hedging else None
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                timeout = max(0.0, hedge_at - time.perf_counter()) if hedge_at is not None else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        self.succeeded(time.perf_counter() - started)
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+
+                # Hedge when the first attempt is slow, or has already failed
+                if hedge_at is not None and (not done or not tasks):
+                    hedge_at = None
+                    release = await acquire_hedge() if acquire_hedge is not None else (lambda: None)
+                    if release is None:
+                        self.hedges_skipped += 1
+                        continue
+                    self.hedged += 1
+                    hedge = asyncio.create_task(self._attempt(attempt))
+                    hedge.add_done_callback(lambda task: release())
+                    tasks.add(hedge)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.failed()
+        if isinstance(error, asyncio.TimeoutError):
+            raise LlmUnavailable("timeout", f"no reply within {self.attempt_timeout}s") from error
+        raise LlmUnavailable("error", str(error)) from error
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "circuit_open": int(self.breaker.state != "closed"),
+            "circuit_opened": self.breaker.opened,
+            "short_circuited": self.short_circuited,
+            "hedged": self.hedged,
+            "hedges_skipped": self.hedges_skipped,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "failures": self.failures
+        }
@@ -0,0 +1,177 @@
+import re
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, without it only exact matches are served
+    np = None
+
+# Words that flip the meaning of an otherwise near-identical message
+NEGATIONS = frozenset({"non", "no", "nessun", "nessuna", "nessuno", "senza", "mai", "not", "never", "without", "none", "dont", "don"})
+
+def normalize_text(text: str) -> str:
+    # Case, accents, punctuation and spacing do not change the question
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def polarity(text: str) -> Tuple[frozenset, frozenset]:
+    # Negations and numbers of a normalized text; near matches must agree on
+    # both, since "non ho la febbre" or "da 20 giorni" are a few n-grams away
+    words = text.split()
+    return frozenset(word for word in words if word in NEGATIONS), frozenset(word for word in words if word.isdigit())
+
+class CachedReply(NamedTuple):
+    response: str
+    match: str  # "exact" or "near"
+    similarity: float
+    saved_seconds: float
+
+class _Entry(NamedTuple):
+    response: str
+    latency: float
+    expires: float
+
+class _Bucket:
+    """Normalized vectors of the cached texts that share a scope and a
+    polarity, as the first rows of a float32 matrix. The matrix grows by
+    doubling up to max_rows; a removed row is overwritten by the last one, so
+    additions and removals copy one row instead of restacking the matrix."""
+
+    def __init__(self, dimensions: int, max_rows: int):
+        self.max_rows = max_rows
+        self.matrix = np.empty((min(8, max_rows), dimensions), dtype=np.float32)
+        self.texts: List[str] = []
+        self.rows: Dict[str, int] = {}
+
+    def add(self, text: str, vector):
+        if len(self.texts) == len(self.matrix):
+            grown = np.empty((min(2 * len(self.matrix), self.max_rows), self.matrix.shape[1]), dtype=np.float32)
+            grown[:len(self.matrix)] = self.matrix
+            self.matrix = grown
+        self.rows[text] = len(self.texts)
+        self.matrix[len(self.texts)] = vector
+        self.texts.append(text)
+
+    def remove(self, text: str):
+        row = self.rows.pop(text)
+        last = self.texts.pop()
+        if last != text:
+            self.matrix[row] = self.matrix[len(self.texts)]
+            self.texts[row] = last
+            self.rows[last] = row
+
+    def best(self, vector) -> Tuple[str, float]:
+        similarities = self.matrix[:len(self.texts)] @ vector
+        index = int(np.argmax(similarities))
+        return self.texts[index], float(similarities[index])
+
+class ResponseCache:
+    """LLM replies keyed by a compatibility scope plus the normalized user text.
+
+    The scope carries everything besides the text that shapes the prompt
+    (language, profile fields, ...); entries are never matched across scopes.
+    Within a scope, a miss on the exact text falls back to the most similar
+    cached text by cosine similarity of hashed character n-gram vectors,
+    served only at or above similarity_threshold and only among texts with
+    the same negations and numbers. Entries expire after ttl seconds and the
+    least recently used are evicted beyond max_size. A 1024-dimension
+    vector is 4 KB per entry; short messages have far fewer n-grams than
+    that, so more dimensions buy few fewer collisions.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: float = 3600.0, similarity_threshold: float = 0.9,
+                 ngram: int = 3, dimensions: int = 1024, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.ngram = ngram
+        self.dimensions = dimensions
+        self.enabled = enabled
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # Near-duplicate candidates per (scope, polarity)
+        self._buckets: Dict[Tuple[str, Tuple[frozenset, frozenset]], _Bucket] = {}
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @property
+    def near_duplicates(self) -> bool:
+        return np is not None and self.similarity_threshold < 1.0
+
+    def _vector(self, text: str):
+        padded = f" {text} "
+        counts = np.zeros(self.dimensions, dtype=np.float32)
+        for i in range(max(1, len(padded) - self.ngram + 1)):
+            counts[zlib.crc32(padded[i:i + self.ngram].encode()) % self.dimensions] += 1.0
+        norm = np.linalg.norm(counts)
+        return counts / norm if norm else counts
+
+    def get(self, scope: str, text: str) -> Optional[CachedReply]:
+        if not self.enabled:
+            return None
+        text = normalize_text(text)
+        now = time.monotonic()
+
+        entry = self._entries.get((scope, text))
+        if entry is not None and entry.expires > now:
+            self._entries.move_to_end((scope, text))
+            self.exact_hits += 1
+            return CachedReply(entry.response, "exact", 1.0, entry.latency)
+        if entry is not None:
+            self._remove((scope, text))
+
+        bucket = self._buckets.get((scope, polarity(text))) if self.near_duplicates else None
+        if bucket is not None:
+            best, similarity = bucket.best(self._vector(text))
+            if similarity >= self.similarity_threshold:
+                key = (scope, best)
+                entry = self._entries[key]
+                if entry.expires > now:
+                    self._entries.move_to_end(key)
+                    self.near_hits += 1
+                    return CachedReply(entry.response, "near", similarity, entry.latency)
+                self._remove(key)
+
+        self.misses += 1
+        return None
+
+    def put(self, scope: str, text: str, response: str, latency: float):
+        if not self.enabled:
+            return
+        key = (scope, normalize_text(text))
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(response, latency, time.monotonic() + self.ttl)
+        if self.near_duplicates:
+            bucket_key = (scope, polarity(key[1]))
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                # One over max_size: put adds before it evicts
+                bucket = self._buckets[bucket_key] = _Bucket(self.dimensions, self.max_size + 1)
+            bucket.add(key[1], self._vector(key[1]))
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, str]):
+        del self._entries[key]
+        scope, text = key
+        bucket_key = (scope, polarity(text))
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            return
+        bucket.remove(text)
+        if not bucket.texts:
+            del self._buckets[bucket_key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses
+        }
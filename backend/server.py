@@ -1,29 +1,294 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import time
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import json
-from bson import ObjectId, json_util
+import base64
+import hashlib
+from indexes import ensure_indexes
+from bson_json import BSONResponse, bson_date, dumps_bson
+from llm_pool import LlmClientPool
+from triage import TriageEngine
+from message_writer import DuplicateTurn, MessageWriter
+from compression import CompressionMiddleware
+from message_buckets import MessageBuckets
+from document_cache import DocumentCache
+from prompt_builder import PromptBuilder, estimate_tokens
+from metrics import Registry, MetricsMiddleware, MongoCommandTimer, SIZE_BUCKETS
+from admission import AdmissionController, AdmissionRejected
+from archiver import SessionArchiver, load_archived_messages
+from response_cache import ResponseCache, normalize_text
+from resilience import CircuitBreaker, CircuitOpen, LlmUnavailable, ResilientCaller
+from model_router import ModelRouter, ModelTier
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Prometheus metrics, served at /api/metrics
+metrics = Registry()
+HTTP_LATENCY = metrics.histogram(
+    "medagent_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = metrics.gauge("medagent_http_requests_in_flight", "HTTP requests currently being served")
+MONGO_LATENCY = metrics.histogram(
+    "medagent_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command", "outcome")
+)
+LLM_LATENCY = metrics.histogram("medagent_llm_call_duration_seconds", "LLM call latency", ("operation", "outcome"))
+LLM_PROMPT_TOKENS = metrics.histogram(
+    "medagent_llm_prompt_tokens", "Estimated prompt size of LLM calls in tokens", ("operation",), SIZE_BUCKETS
+)
+LLM_RESPONSE_CHARS = metrics.histogram(
+    "medagent_llm_response_chars", "Size of LLM replies in characters", ("operation",), SIZE_BUCKETS
+)
+LLM_IN_FLIGHT = metrics.gauge("medagent_llm_calls_in_flight", "LLM calls currently running", ("operation",))
+LLM_QUEUE_WAIT = metrics.histogram("medagent_llm_queue_wait_seconds", "Time LLM calls waited for an admission slot")
+RESPONSE_CACHE_LOOKUPS = metrics.counter(
+    "medagent_llm_response_cache_lookups_total", "Reply cache lookups of cacheable chat turns", ("result",)
+)
+RESPONSE_CACHE_SAVED = metrics.counter(
+    "medagent_llm_response_cache_saved_seconds_total", "LLM latency avoided by reply cache hits"
+)
+LLM_FALLBACKS = metrics.counter(
+    "medagent_llm_fallback_replies_total", "Templated replies sent instead of an LLM reply", ("reason",)
+)
+WS_CONNECTIONS = metrics.gauge("medagent_websocket_connections", "Open chat WebSocket connections")
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandTimer(MONGO_LATENCY)])
 db = client[os.environ['DB_NAME']]
 
+# Message layout: "documents" (one document per message) or "buckets"
+# (messages appended into per-session bucket documents). Both rely on a
+# unique index from indexes.py to store an idempotent turn only once
+MESSAGE_STORAGE = os.environ.get('MESSAGE_STORAGE', 'documents')
+message_buckets = (
+    MessageBuckets(db, int(os.environ.get('MESSAGE_BUCKET_SIZE', '50'))) if MESSAGE_STORAGE == 'buckets' else None
+)
+
+# In-process caches for chat_sessions and user_profiles documents, keyed by session_id.
+# Disable them when several workers write to the same sessions.
+CACHE_ENABLED = os.environ.get('SESSION_CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_MAX_SIZE = int(os.environ.get('SESSION_CACHE_MAX_SIZE', '10000'))
+CACHE_TTL_SECONDS = float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '60'))
+session_cache = DocumentCache(CACHE_MAX_SIZE, CACHE_TTL_SECONDS, CACHE_ENABLED)
+profile_cache = DocumentCache(CACHE_MAX_SIZE, CACHE_TTL_SECONDS, CACHE_ENABLED)
+
+# Message persistence, optionally batched in the background across requests
+message_writer = MessageWriter(
+    db,
+    write_behind=os.environ.get('MESSAGE_WRITE_BEHIND', 'false').lower() == 'true',
+    max_queue=int(os.environ.get('MESSAGE_WRITE_BEHIND_QUEUE', '10000')),
+    buckets=message_buckets,
+    on_flushed=session_cache.invalidate
+)
+
+# Background archival of closed or idle sessions into message_archives
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'true').lower() == 'true'
+session_archiver = SessionArchiver(
+    db,
+    idle_after=timedelta(hours=float(os.environ.get('ARCHIVE_IDLE_HOURS', '24'))),
+    interval=float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '300')),
+    on_archived=session_cache.invalidate
+)
+
+def load_session(session_id: str):
+    return session_cache.get(session_id, lambda: db.chat_sessions.find_one({"session_id": session_id}))
+
+def load_profile(session_id: str):
+    return profile_cache.get(session_id, lambda: db.user_profiles.find_one({"session_id": session_id}))
+
 # Gemini API Setup
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+# Chat turns are routed between a fast and a full model configuration; with
+# routing disabled every turn uses the full one
+model_router = ModelRouter(
+    fast=ModelTier(
+        "fast", "gemini",
+        os.environ.get('LLM_FAST_MODEL', 'gemini-2.0-flash-lite'),
+        int(os.environ.get('LLM_FAST_MAX_TOKENS', '600'))
+    ),
+    full=ModelTier(
+        "full", "gemini",
+        os.environ.get('LLM_FULL_MODEL', 'gemini-2.0-flash'),
+        int(os.environ.get('LLM_FULL_MAX_TOKENS', '1500'))
+    ),
+    target_p95=float(os.environ.get('MODEL_ROUTING_TARGET_P95_SECONDS', '4')),
+    fast_max_chars=int(os.environ.get('MODEL_ROUTING_FAST_MAX_CHARS', '120')),
+    enabled=os.environ.get('MODEL_ROUTING_ENABLED', 'false').lower() == 'true'
+)
+
+# Gemini chat clients are configured once and reused across requests
+def create_llm_chat(session_id: str, system_message: str, tier: Optional[str] = None):
+    config = model_router.tiers.get(tier, model_router.full)
+    return LlmChat(
+        api_key=GEMINI_API_KEY,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model(config.provider, config.model).with_max_tokens(config.max_tokens)
+
+llm_pool = LlmClientPool(create_llm_chat, max_idle=int(os.environ.get('LLM_POOL_MAX_IDLE', '32')))
+
+# Replies to opening turns, reused for the same or a near-identical first
+# message from a compatible profile
+response_cache = ResponseCache(
+    max_size=int(os.environ.get('RESPONSE_CACHE_MAX_SIZE', '5000')),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600')),
+    similarity_threshold=float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.9')),
+    enabled=os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+)
+
+# Admission control for LLM calls: a concurrency cap plus a bounded wait queue,
+# beyond which requests get a 429 with Retry-After instead of piling up
+llm_admission = AdmissionController(
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '16')),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', '64')),
+    queue_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '10')),
+    observe_wait=LLM_QUEUE_WAIT.observe
+)
+
+# Deadline per LLM attempt, optional hedging and a circuit breaker; turns
+# the LLM cannot answer get a templated reply (see fallback_reply)
+llm_resilience = ResilientCaller(
+    CircuitBreaker(
+        failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURES', '5')),
+        reset_timeout=float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+    ),
+    attempt_timeout=float(os.environ.get('LLM_ATTEMPT_TIMEOUT_SECONDS', '30')),
+    hedging=os.environ.get('LLM_HEDGING', 'false').lower() == 'true',
+    hedge_min_delay=float(os.environ.get('LLM_HEDGE_MIN_DELAY_SECONDS', '1'))
+)
+
+def observe_llm_call(operation: str, started: float, outcome: str, prompt_tokens: int, response: Optional[str] = None):
+    LLM_LATENCY.observe(time.perf_counter() - started, operation, outcome)
+    LLM_PROMPT_TOKENS.observe(prompt_tokens, operation)
+    if response is not None:
+        LLM_RESPONSE_CHARS.observe(len(response), operation)
+
+async def llm_attempt(operation: str, session_id: str, system_message: str, prompt: str, prompt_tokens: int,
+                      tier: Optional[str] = None) -> str:
+    # One provider request; a hedged call runs two of these concurrently
+    started = time.perf_counter()
+    LLM_IN_FLIGHT.inc(operation)
+    try:
+        async with llm_pool.session_client(session_id, system_message, tier) as chat:
+            response = await chat.send_message(UserMessage(text=prompt))
+    except asyncio.CancelledError:
+        # Timed out, or lost a hedge race
+        observe_llm_call(operation, started, "cancelled", prompt_tokens)
+        raise
+    except Exception:
+        observe_llm_call(operation, started, "error", prompt_tokens)
+        raise
+    finally:
+        LLM_IN_FLIGHT.dec(operation)
+    observe_llm_call(operation, started, "ok", prompt_tokens, response)
+    if tier is not None:
+        model_router.observe(tier, time.perf_counter() - started)
+    return response
+
+async def call_llm(operation: str, session_id: str, system_message: str, prompt: str, prompt_tokens: int,
+                   tier: Optional[str] = None) -> str:
+    # Fail fast while the circuit is open, before queueing for a slot
+    llm_resilience.check()
+    async with llm_admission.slot():
+        # A hedge holds a second slot, and only one that is free right away
+        return await llm_resilience.call(
+            lambda: llm_attempt(operation, session_id, system_message, prompt, prompt_tokens, tier),
+            acquire_hedge=llm_admission.try_acquire
+        )
+
+def cache_samples():
+    for name, cache in (("sessions", session_cache), ("profiles", profile_cache)):
+        stats = cache.stats()
+        for key in ("hits", "misses", "size"):
+            yield (name, key), stats[key]
+
+def llm_admission_samples():
+    for key, value in llm_admission.stats().items():
+        yield (key,), value
+
+def llm_pool_samples():
+    for key, value in llm_pool.stats().items():
+        yield (key,), value
+
+metrics.callback_gauge("medagent_cache", "Session/profile cache statistics", ("cache", "stat"), cache_samples)
+metrics.callback_gauge("medagent_llm_admission", "LLM admission controller state and totals", ("stat",), llm_admission_samples)
+metrics.callback_gauge(
+    "medagent_llm_resilience", "LLM circuit breaker state, hedging and failure totals", ("stat",),
+    lambda: [((key,), value) for key, value in llm_resilience.stats().items()]
+)
+metrics.callback_gauge(
+    "medagent_llm_router", "Model routing thresholds, routed turns and latency per tier", ("stat",),
+    lambda: [((key,), value) for key, value in model_router.stats().items()]
+)
+metrics.callback_gauge("medagent_llm_pool", "LLM client pool statistics", ("stat",), llm_pool_samples)
+metrics.callback_gauge(
+    "medagent_llm_response_cache_entries", "Replies held by the reply cache", (),
+    lambda: [((), response_cache.stats()["size"])]
+)
+metrics.callback_gauge(
+    "medagent_write_behind_queue_depth", "Chat turns waiting for the write-behind flusher", (),
+    lambda: [((), message_writer.pending())]
+)
+
+# Opening message of a conversation, per language; "symptom" is used when the
+# profile names a main symptom, "profile" when it gives at least an age
+WELCOME_TEMPLATES = {
+    "it": {
+        "default": "Ciao! Sono MedAgent, il tuo assistente sanitario digitale. Come posso aiutarti oggi?",
+        "profile": "Ciao! Sono MedAgent, il tuo assistente sanitario digitale. Sono qui per aiutarti con le tue domande sulla salute. Cosa ti preoccupa oggi?",
+        "symptom": "Ciao! Ho visto che hai menzionato '{sintomo}'. Sono qui per aiutarti a capire meglio come stai. Puoi raccontarmi di più su quello che stai vivendo?"
+    },
+    "en": {
+        "default": "Hello! I'm MedAgent, your digital health assistant. How can I help you today?",
+        "profile": "Hello! I'm MedAgent, your digital health assistant. I'm here to help you with your health questions. What's concerning you today?",
+        "symptom": "Hello! I saw you mentioned '{sintomo}'. I'm here to help you better understand how you're feeling. Can you tell me more about what you're experiencing?"
+    }
+}
+
+WELCOME_QUESTIONS = {
+    "it": [
+        "Puoi descrivermi il sintomo che ti preoccupa?",
+        "Da quando hai notato questo problema?",
+        "C'è qualcos'altro che ti fa stare male?"
+    ],
+    "en": [
+        "Can you describe the symptom that's worrying you?",
+        "When did you first notice this problem?",
+        "Is there anything else that's making you feel unwell?"
+    ]
+}
+
+# Sent instead of an LLM reply when the LLM is unavailable, per language and
+# keyword urgency of the user's message; the follow-up questions come from
+# the triage rules as for any other reply
+FALLBACK_REPLIES = {
+    "it": {
+        "low": "Al momento non riesco a elaborare una risposta completa. Intanto puoi aiutarmi a capire meglio come stai rispondendo alle domande qui sotto; riprova tra qualche minuto. Ricorda che non sostituisco il parere di un medico.",
+        "medium": "Al momento non riesco a elaborare una risposta completa. I sintomi che descrivi meritano attenzione: se non migliorano o peggiorano, contatta il tuo medico. Ricorda che non sostituisco il parere di un medico.",
+        "high": "Al momento non riesco a elaborare una risposta completa. I sintomi che descrivi potrebbero richiedere assistenza urgente: chiama subito il 118 o recati al pronto soccorso più vicino."
+    },
+    "en": {
+        "low": "I can't put together a full answer right now. Meanwhile, you can help me understand how you feel by answering the questions below; please try again in a few minutes. Remember that I don't replace a doctor's advice.",
+        "medium": "I can't put together a full answer right now. The symptoms you describe deserve attention: if they don't improve or get worse, contact your doctor. Remember that I don't replace a doctor's advice.",
+        "high": "I can't put together a full answer right now. The symptoms you describe may need urgent care: call emergency services immediately or go to the nearest emergency room."
+    }
+}
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -78,9 +343,17 @@ class ChatSession(BaseModel):
     start_time: datetime = Field(default_factory=datetime.utcnow)
     end_time: Optional[datetime] = None
     message_count: int = 0
+    user_count: int = 0
+    assistant_count: int = 0
+    max_urgency_rank: int = 0
+    last_message_at: Optional[datetime] = None
     current_urgency_level: str = "low"
     status: str = "active"  # active, completed, closed
     context_summary: Optional[str] = None
+    summarized_count: int = 0
+    summarized_until: Optional[datetime] = None
+    archived: bool = False
+    archived_count: int = 0
 
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -90,11 +363,13 @@ class Message(BaseModel):
     urgency_level: Optional[str] = None
     next_questions: List[str] = []
     metadata: Dict[str, Any] = {}
+    idempotency_key: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class ChatRequest(BaseModel):
     session_id: str
     message: str
+    idempotency_key: Optional[str] = None  # Also accepted as the Idempotency-Key header
 
 class ProfileUpdateRequest(BaseModel):
     eta: Optional[str] = None
@@ -112,6 +387,10 @@ class ProfileUpdateRequest(BaseModel):
 async def root():
     return {"message": "MedAgent API is running", "version": "1.0.0"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @api_router.get("/health")
 async def health_check():
     try:
@@ -125,6 +404,11 @@ async def health_check():
             "status": "healthy",
             "database": "connected",
             "ai_service": ai_status,
+            "cache": {
+                "sessions": session_cache.stats(),
+                "profiles": profile_cache.stats(),
+                "responses": response_cache.stats()
+            },
             "timestamp": datetime.utcnow()
         }
     except Exception as e:
@@ -134,34 +418,28 @@ async def health_check():
 async def create_session():
     session_id = str(uuid.uuid4())
     
-    session = ChatSession(session_id=session_id)
-    await db.chat_sessions.insert_one(session.dict())
+    session = ChatSession(session_id=session_id).dict()
+    await db.chat_sessions.insert_one(session)
+    session_cache.put(session_id, session)
     
     return {"session_id": session_id, "status": "created"}
 
 @api_router.get("/chat/session/{session_id}")
 async def get_session(session_id: str):
-    session = await db.chat_sessions.find_one({"session_id": session_id})
+    # Session and profile (if exists) are independent reads, run them concurrently
+    session, profile = await asyncio.gather(load_session(session_id), load_profile(session_id))
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get profile if exists
-    profile = await db.user_profiles.find_one({"session_id": session_id})
-    
-    # Convert MongoDB objects to JSON serializable format
-    session = json.loads(json_util.dumps(session))
-    if profile:
-        profile = json.loads(json_util.dumps(profile))
-    
-    return {
+    return BSONResponse({
         "session": session,
         "profile": profile
-    }
+    })
 
 @api_router.post("/chat/profile/{session_id}")
 async def create_or_update_profile(session_id: str, profile_data: ProfileUpdateRequest):
     # Check if profile exists
-    existing_profile = await db.user_profiles.find_one({"session_id": session_id})
+    existing_profile = await load_profile(session_id)
     
     if existing_profile:
         # Update existing profile
@@ -174,265 +452,909 @@ async def create_or_update_profile(session_id: str, profile_data: ProfileUpdateR
         )
         
         updated_profile = await db.user_profiles.find_one({"session_id": session_id})
-        # Convert MongoDB object to JSON serializable format
-        updated_profile = json.loads(json_util.dumps(updated_profile))
-        return {"status": "updated", "profile": updated_profile}
+        profile_cache.put(session_id, updated_profile)
+        return BSONResponse({"status": "updated", "profile": updated_profile})
     else:
         # Create new profile
         profile = UserProfile(session_id=session_id, **profile_data.dict(exclude_unset=True))
-        await db.user_profiles.insert_one(profile.dict())
+        profile_doc = profile.dict()
+        await db.user_profiles.insert_one(profile_doc)
+        profile_cache.put(session_id, profile_doc)
         
         # Update session with profile ID
         await db.chat_sessions.update_one(
             {"session_id": session_id},
             {"$set": {"user_profile_id": profile.id}}
         )
+        session_cache.invalidate(session_id)
         
-        return {"status": "created", "profile": profile.dict()}
+        return BSONResponse({"status": "created", "profile": profile.dict()})
 
 @api_router.get("/chat/profile/{session_id}")
 async def get_profile(session_id: str):
-    profile = await db.user_profiles.find_one({"session_id": session_id})
-    if not profile:
-        return {"profile": None}
-    
-    # Convert MongoDB object to JSON serializable format
-    profile = json.loads(json_util.dumps(profile))
-    
-    return {"profile": profile}
+    profile = await load_profile(session_id)
+    return BSONResponse({"profile": profile})
 
 @api_router.post("/chat/welcome/{session_id}")
 async def generate_welcome_message(session_id: str):
     # Get user profile
-    profile = await db.user_profiles.find_one({"session_id": session_id})
+    session, profile = await asyncio.gather(load_session(session_id), load_profile(session_id))
+    if session and session_counters_missing(session):
+        await backfill_session_counters(session)
+    
+    message = welcome_message(session_id, profile)
+    await message_writer.write(session_id, [message.dict()], session_counters_update([message]))
+    session_cache.invalidate(session_id)
+    
+    return {
+        "message": message.content,
+        "next_questions": message.next_questions,
+        "urgency_level": "low"
+    }
+
+@api_router.post("/chat/bootstrap")
+async def bootstrap_session(profile_data: ProfileUpdateRequest):
+    # Session, profile and welcome message in one request: the three documents
+    # are built up front (the session already carrying the welcome's counters)
+    # and inserted concurrently, in one round of writes
+    session_id = str(uuid.uuid4())
+    profile = UserProfile(session_id=session_id, **profile_data.dict(exclude_unset=True)).dict()
+    message = welcome_message(session_id, profile)
+    
+    session = ChatSession(session_id=session_id, user_profile_id=profile["id"]).dict()
+    counters = session_counters_update([message])
+    for key, value in counters["$inc"].items():
+        session[key] = session.get(key, 0) + value
+    session.update(counters["$set"])
+    session.update(counters.get("$max", {}))
+    
+    await asyncio.gather(
+        db.chat_sessions.insert_one(session),
+        db.user_profiles.insert_one(profile),
+        message_writer.insert(session_id, [message.dict()])
+    )
+    session_cache.put(session_id, session)
+    profile_cache.put(session_id, profile)
     
-    # Get language from profile, default to Italian
-    language = profile.get('language', 'it') if profile else 'it'
+    return BSONResponse({
+        "session_id": session_id,
+        "session": session,
+        "profile": profile,
+        "welcome": {
+            "message": message.content,
+            "next_questions": message.next_questions,
+            "urgency_level": "low"
+        }
+    })
+
+# Urgency and follow-up keyword rules, compiled once per language
+triage = TriageEngine.from_file(Path(os.environ.get('TRIAGE_RULES_PATH', ROOT_DIR / 'triage_rules.json')))
+
+# Numeric rank of each urgency level, so the session can keep the maximum with $max
+URGENCY_RANK = {"low": 1, "medium": 2, "high": 3}
+URGENCY_BY_RANK = {rank: level for level, rank in URGENCY_RANK.items()}
+
+# Size of the text chunks emitted by the streaming endpoints when the LLM client
+# can only return the full reply at once
+STREAM_CHUNK_CHARS = int(os.environ.get('STREAM_CHUNK_CHARS', '48'))
+
+# Messages sent verbatim in the prompt (including the new user message); older
+# ones are folded into ChatSession.context_summary once SUMMARY_EVERY_MESSAGES
+# of them have accumulated, with the summary prompt of the session language
+CONTEXT_RECENT_MESSAGES = int(os.environ.get('CONTEXT_RECENT_MESSAGES', '4'))
+SUMMARY_EVERY_MESSAGES = int(os.environ.get('SUMMARY_EVERY_MESSAGES', '8'))
+
+# Token budget for the whole prompt, system prompt included; recent history is
+# dropped oldest-first to stay within it
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '1200'))
+prompt_builder = PromptBuilder(PROMPT_TOKEN_BUDGET)
+SYSTEM_PROMPT_TOKENS = {language: estimate_tokens(prompt) for language, prompt in SYSTEM_PROMPTS.items()}
+
+# Upper bound for the page size accepted by /chat/history
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '500'))
+
+def welcome_message(session_id: str, profile: Optional[Dict[str, Any]]) -> Message:
+    language = profile.get('language') if profile else None
+    if language not in WELCOME_TEMPLATES:
+        language = "it"  # Default to Italian
+    templates = WELCOME_TEMPLATES[language]
     
-    if not profile:
-        welcome_msg = {
-            'it': "Ciao! Sono MedAgent, il tuo assistente sanitario digitale. Come posso aiutarti oggi?",
-            'en': "Hello! I'm MedAgent, your digital health assistant. How can I help you today?"
-        }[language]
+    # Personalized welcome based on profile
+    if profile and profile.get('sintomo_principale'):
+        content = templates["symptom"].format(sintomo=profile['sintomo_principale'])
+    elif profile and profile.get('eta'):
+        content = templates["profile"]
     else:
-        # Personalized welcome based on profile
-        eta = profile.get('eta', '')
-        sintomo = profile.get('sintomo_principale', '')
-        
-        if sintomo:
-            welcome_msg = {
-                'it': f"Ciao! Ho visto che hai menzionato '{sintomo}'. Sono qui per aiutarti a capire meglio come stai. Puoi raccontarmi di più su quello che stai vivendo?",
-                'en': f"Hello! I saw you mentioned '{sintomo}'. I'm here to help you better understand how you're feeling. Can you tell me more about what you're experiencing?"
-            }[language]
-        elif eta:
-            welcome_msg = {
-                'it': f"Ciao! Sono MedAgent, il tuo assistente sanitario digitale. Sono qui per aiutarti con le tue domande sulla salute. Cosa ti preoccupa oggi?",
-                'en': f"Hello! I'm MedAgent, your digital health assistant. I'm here to help you with your health questions. What's concerning you today?"
-            }[language]
-        else:
-            welcome_msg = {
-                'it': "Ciao! Sono MedAgent, il tuo assistente sanitario digitale. Come posso aiutarti oggi?",
-                'en': "Hello! I'm MedAgent, your digital health assistant. How can I help you today?"
-            }[language]
-    
-    # Generate next questions based on language
-    next_questions = {
-        'it': [
-            "Puoi descrivermi il sintomo che ti preoccupa?",
-            "Da quando hai notato questo problema?",
-            "C'è qualcos'altro che ti fa stare male?"
-        ],
-        'en': [
-            "Can you describe the symptom that's worrying you?",
-            "When did you first notice this problem?",
-            "Is there anything else that's making you feel unwell?"
-        ]
-    }[language]
+        content = templates["default"]
     
-    # Save welcome message
-    message = Message(
+    return Message(
         session_id=session_id,
         message_type="assistant",
-        content=welcome_msg,
-        next_questions=next_questions
+        content=content,
+        next_questions=WELCOME_QUESTIONS[language]
     )
+
+def session_counters_update(messages: List[Message]) -> Dict[str, Any]:
+    # Running aggregates kept on the session so the summary never scans messages
+    inc = {"message_count": len(messages)}
+    for message in messages:
+        inc[f"{message.message_type}_count"] = inc.get(f"{message.message_type}_count", 0) + 1
+    update = {
+        "$inc": inc,
+        "$set": {"last_message_at": max(message.timestamp for message in messages)}
+    }
+    ranks = [URGENCY_RANK[message.urgency_level] for message in messages if message.urgency_level]
+    if ranks:
+        update["$max"] = {"max_urgency_rank": max(ranks)}
+    return update
+
+def session_counters_missing(session: Dict[str, Any]) -> bool:
+    # The oldest sessions stored message_count as an update document
+    # ({"$inc": 1}), later ones a number without the per-type counters
+    return not isinstance(session.get("message_count"), (int, float)) or any(
+        field not in session for field in ("user_count", "assistant_count", "max_urgency_rank")
+    )
+
+async def backfill_session_counters(session: Dict[str, Any]) -> Dict[str, Any]:
+    # Sessions created before the counters existed are aggregated once, before
+    # anything $inc's them: $inc fails on a non-numeric message_count, and a
+    # counter created by the first new write would hide the older messages
+    stats = await db.messages.aggregate([
+        {"$match": {"session_id": session["session_id"]}},
+        {"$group": {
+            "_id": None,
+            "user_count": {"$sum": {"$cond": [{"$eq": ["$message_type", "user"]}, 1, 0]}},
+            "assistant_count": {"$sum": {"$cond": [{"$eq": ["$message_type", "assistant"]}, 1, 0]}},
+            "max_urgency_rank": {"$max": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$urgency_level", level]}, "then": rank}
+                    for level, rank in URGENCY_RANK.items()
+                ],
+                "default": 0
+            }}},
+            "last_message_at": {"$max": "$timestamp"}
+        }}
+    ]).to_list(length=1)
     
-    await db.messages.insert_one(message.dict())
+    counters = {"user_count": 0, "assistant_count": 0, "max_urgency_rank": 0, "last_message_at": None}
+    if stats:
+        counters.update({key: stats[0][key] for key in counters})
+    counters["message_count"] = counters["user_count"] + counters["assistant_count"]
     
-    return {
-        "message": welcome_msg,
-        "next_questions": next_questions,
-        "urgency_level": "low"
-    }
+    await db.chat_sessions.update_one({"session_id": session["session_id"]}, {"$set": counters})
+    session.update(counters)
+    session_cache.put(session["session_id"], session)
+    return session
 
-@api_router.post("/chat/message")
-async def send_message(request: ChatRequest):
+class ChatTurn(BaseModel):
+    session_id: str
+    user_message: Message
+    prompt: str
+    context: str
+    language: str = "it"
+    idempotency_key: Optional[str] = None
+    prompt_tokens: int = 0
+    history_dropped: int = 0
+    summary_used: bool = False
+    summary_due: bool = False
+    response_cache_scope: Optional[str] = None
+    response_cache_match: Optional[str] = None
+    fallback: Optional[str] = None
+    model_tier: str = "full"
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+summaries_in_progress = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def refresh_context_summary(session_id: str, language: str = "it"):
+    # Fold every message older than the recent window into context_summary
+    if session_id in summaries_in_progress:
+        return
+    summaries_in_progress.add(session_id)
     try:
-        session_id = request.session_id
-        user_message = request.message
-        
-        # Save user message
-        user_msg = Message(
-            session_id=session_id,
-            message_type="user",
-            content=user_message
-        )
-        await db.messages.insert_one(user_msg.dict())
-        
-        # Get conversation history (last 6 messages for context)
-        history = await db.messages.find(
-            {"session_id": session_id}
-        ).sort("timestamp", -1).limit(6).to_list(length=None)
-        
-        history.reverse()  # Chronological order
+        session = await db.chat_sessions.find_one({"session_id": session_id})
+        if not session:
+            return
         
-        # Get user profile for context
-        profile = await db.user_profiles.find_one({"session_id": session_id})
-        
-        # Build context for AI
-        context_parts = []
-        if profile:
-            context_parts.append(f"Profilo utente: Età: {profile.get('eta', 'Non specificato')}, Genere: {profile.get('genere', 'Non specificato')}")
-            if profile.get('sintomo_principale'):
-                context_parts.append(f"Sintomo principale: {profile['sintomo_principale']}")
-            if profile.get('condizioni_note'):
-                context_parts.append(f"Condizioni note: {', '.join(profile['condizioni_note'])}")
-        
-        conversation_context = "\n".join([
-            f"{'Utente' if msg['message_type'] == 'user' else 'Assistente'}: {msg['content']}"
-            for msg in history[-4:]  # Last 4 messages for context
-        ])
-        
-        context = "\n".join(filter(None, context_parts + [f"\nConversazione recente:\n{conversation_context}"]))
-        
-        # Initialize Gemini chat
-        chat = LlmChat(
-            api_key=GEMINI_API_KEY,
-            session_id=session_id,
-            system_message=SYSTEM_PROMPTS["it"]  # Default to Italian
-        ).with_model("gemini", "gemini-2.0-flash").with_max_tokens(1500)
-        
-        # Create user message with context
-        full_message = f"{context}\n\nNuovo messaggio utente: {user_message}"
-        user_msg_obj = UserMessage(text=full_message)
-        
-        # Get AI response
-        ai_response = await chat.send_message(user_msg_obj)
-        
-        # Determine urgency level based on keywords
-        urgency_keywords = {
-            "high": ["dolore toracico", "difficoltà respiratorie", "perdita coscienza", "emorragia", "trauma", "avvelenamento", "118"],
-            "medium": ["febbre alta", "dolore intenso", "vomito persistente", "difficoltà", "preoccupante"],
-            "low": ["lieve", "normale", "comune", "non preoccupante"]
-        }
-        
-        urgency_level = "low"
-        response_lower = ai_response.lower()
-        
-        for level, keywords in urgency_keywords.items():
-            if any(keyword in response_lower for keyword in keywords):
-                urgency_level = level
-                break
-        
-        # Generate follow-up questions based on response
-        if "dolore" in user_message.lower():
-            next_questions = [
-                "Il dolore è costante o intermittente?",
-                "Su una scala da 1 a 10, quanto è intenso?",
-                "Hai preso qualche farmaco per il dolore?"
-            ]
-        elif "febbre" in user_message.lower():
-            next_questions = [
-                "Hai misurato la temperatura?",
-                "Da quanto tempo hai la febbre?",
-                "Hai altri sintomi come mal di testa o debolezza?"
-            ]
+        if message_buckets is not None:
+            messages = await message_buckets.since(session_id, session.get("summarized_until"))
         else:
-            next_questions = [
-                "Puoi dirmi di più su questo sintomo?",
-                "È la prima volta che ti succede?",
-                "C'è qualcos'altro che ti preoccupa?"
-            ]
+            query = {"session_id": session_id}
+            if session.get("summarized_until"):
+                query["timestamp"] = {"$gt": session["summarized_until"]}
+            messages = await db.messages.find(
+                query, {"_id": 0, "message_type": 1, "content": 1, "timestamp": 1}
+            ).sort("timestamp", 1).to_list(length=None)
         
-        # Save AI response
-        ai_msg = Message(
-            session_id=session_id,
-            message_type="assistant",
-            content=ai_response,
-            urgency_level=urgency_level,
-            next_questions=next_questions,
-            metadata={"context_used": bool(context)}
-        )
+        older = messages[:-(CONTEXT_RECENT_MESSAGES - 1)] if CONTEXT_RECENT_MESSAGES > 1 else messages
+        if not older:
+            return
         
-        await db.messages.insert_one(ai_msg.dict())
+        summary_prompt, summary_request = prompt_builder.build_summary(older, session.get("context_summary"), language)
+        summary = await call_llm("summary", session_id, summary_prompt, summary_request, estimate_tokens(summary_request))
         
-        # Update session
         await db.chat_sessions.update_one(
             {"session_id": session_id},
             {
-                "$set": {
-                    "current_urgency_level": urgency_level,
-                    "message_count": {"$inc": 1}
-                }
+                "$set": {"context_summary": summary, "summarized_until": older[-1]["timestamp"]},
+                "$inc": {"summarized_count": len(older)}
             }
         )
-        
-        return {
-            "response": ai_response,
-            "urgency_level": urgency_level,
-            "next_questions": next_questions,
-            "timestamp": datetime.utcnow()
+        session_cache.invalidate(session_id)
+    except Exception as e:
+        logging.error(f"Error summarizing session {session_id}: {str(e)}")
+    finally:
+        summaries_in_progress.discard(session_id)
+
+async def load_chat_context(session_id: str):
+    # Get the recent conversation history, the session (for its rolling summary)
+    # and the user profile concurrently
+    if message_buckets is not None:
+        recent = message_buckets.recent(session_id, CONTEXT_RECENT_MESSAGES - 1)
+    else:
+        recent = db.messages.find({"session_id": session_id}).sort("timestamp", -1).limit(CONTEXT_RECENT_MESSAGES - 1).to_list(length=None)
+    history, session, profile = await asyncio.gather(recent, load_session(session_id), load_profile(session_id))
+    
+    if message_buckets is None:
+        history.reverse()  # Chronological order
+    
+    if session and session_counters_missing(session):
+        session = await backfill_session_counters(session)
+    
+    # A resumed archived session may have its recent messages only in the archive
+    if session and session.get("archived") and len(history) < CONTEXT_RECENT_MESSAGES - 1:
+        archived_messages = await load_archived_messages(db, session_id)
+        known = {message["id"] for message in history}
+        history = [message for message in archived_messages if message["id"] not in known] + history
+        history = history[-(CONTEXT_RECENT_MESSAGES - 1):]
+    
+    return history, session, profile
+
+def build_chat_turn(session_id: str, user_message: str, history: List[Dict[str, Any]],
+                    session: Optional[Dict[str, Any]], profile: Optional[Dict[str, Any]],
+                    idempotency_key: Optional[str] = None) -> ChatTurn:
+    # The user message is persisted together with the reply in complete_chat_turn
+    written = [message["timestamp"] for message in history[-1:]]
+    if session and session.get("last_message_at"):
+        written.append(session["last_message_at"])
+    user_msg = Message(
+        session_id=session_id,
+        message_type="user",
+        content=user_message,
+        idempotency_key=idempotency_key,
+        timestamp=next_message_timestamp(max(written, default=None))
+    )
+    
+    summary = session.get("context_summary") if session else None
+    summary_due = False
+    if session and isinstance(session.get("message_count"), int):
+        # Messages outside the recent window once this turn's two are written
+        unsummarized = session["message_count"] + 2 - session.get("summarized_count", 0) - (CONTEXT_RECENT_MESSAGES - 1)
+        summary_due = unsummarized >= SUMMARY_EVERY_MESSAGES
+    
+    language = profile.get('language') if profile else None
+    if language not in SYSTEM_PROMPTS:
+        language = "it"  # Default to Italian
+    
+    # Route on cheap features: length, keyword urgency and how far the conversation is
+    urgency = triage.urgency(user_message, language)
+    tier = model_router.route(user_message, urgency, session.get("user_count", 0) if session else 0)
+    
+    # Build context for AI within the token budget, counting the system prompt
+    built = prompt_builder.build(
+        user_message,
+        history,
+        profile=profile,
+        summary=summary,
+        language=language,
+        reserved_tokens=SYSTEM_PROMPT_TOKENS[language]
+    )
+    
+    return ChatTurn(
+        session_id=session_id,
+        user_message=user_msg,
+        prompt=built.prompt,
+        context=built.context,
+        language=language,
+        idempotency_key=idempotency_key,
+        prompt_tokens=built.prompt_tokens,
+        history_dropped=built.history_dropped,
+        summary_used=bool(summary),
+        summary_due=summary_due,
+        response_cache_scope=response_cache_scope(history, profile, summary, language, urgency),
+        model_tier=tier.name
+    )
+
+def response_cache_scope(history: List[Dict[str, Any]], profile: Optional[Dict[str, Any]],
+                         summary: Optional[str], language: str, urgency: str) -> Optional[str]:
+    # Only opening turns are cacheable: once earlier user messages or a summary
+    # are in the prompt, the reply depends on more than the profile and the text
+    if not response_cache.enabled or summary or any(message["message_type"] == "user" for message in history):
+        return None
+    
+    # Everything from the profile that reaches the prompt or the welcome
+    # message, plus the triage of the text so near matches never cross urgency levels
+    fields = [language, urgency]
+    if profile:
+        fields += [normalize_text(profile.get(field) or "") for field in ("eta", "genere", "sintomo_principale")]
+        fields.append(",".join(sorted(normalize_text(condition) for condition in profile.get("condizioni_note") or [])))
+    return "|".join(fields)
+
+async def prepare_chat_turn(session_id: str, user_message: str, idempotency_key: Optional[str] = None) -> ChatTurn:
+    history, session, profile = await load_chat_context(session_id)
+    return build_chat_turn(session_id, user_message, history, session, profile, idempotency_key)
+
+def fallback_reply(turn: ChatTurn, reason: str) -> str:
+    LLM_FALLBACKS.inc(reason)
+    turn.fallback = reason
+    return FALLBACK_REPLIES[turn.language][triage.urgency(turn.user_message.content, turn.language)]
+
+def next_message_timestamp(previous: Optional[datetime]) -> datetime:
+    # Mongo stores milliseconds, and history orders by (timestamp, id) with a
+    # random id: each message of a session is dated at least a millisecond
+    # after the one written before it, so neither a reply stored in its
+    # question's millisecond (cache hits, fallbacks) nor a quick next question
+    # stored in the reply's can sort ahead of it
+    now = datetime.utcnow()
+    if previous is None:
+        return now
+    stored = previous.replace(microsecond=previous.microsecond // 1000 * 1000)
+    return max(now, stored + timedelta(milliseconds=1))
+
+async def complete_chat_turn(turn: ChatTurn, ai_response: str):
+    # A templated reply says nothing about the symptoms, so classify the user's words instead
+    urgency_level = triage.urgency(turn.user_message.content if turn.fallback else ai_response, turn.language)
+    next_questions = triage.follow_ups(turn.user_message.content, turn.language)
+    
+    ai_msg = Message(
+        session_id=turn.session_id,
+        message_type="assistant",
+        content=ai_response,
+        urgency_level=urgency_level,
+        next_questions=next_questions,
+        idempotency_key=turn.idempotency_key,
+        timestamp=next_message_timestamp(turn.user_message.timestamp),
+        metadata={
+            "context_used": bool(turn.context),
+            "summary_used": turn.summary_used,
+            "prompt_tokens": turn.prompt_tokens,
+            "history_dropped": turn.history_dropped,
+            "response_cache": turn.response_cache_match,
+            "fallback": turn.fallback,
+            "model_tier": turn.model_tier
         }
+    )
+    
+    # Save both messages and update the session in one write. Keyed turns wait
+    # for a write-behind flush, so a duplicate is replayed instead of answered twice
+    update = session_counters_update([turn.user_message, ai_msg])
+    update["$set"]["current_urgency_level"] = urgency_level
+    await message_writer.write(
+        turn.session_id, [turn.user_message.dict(), ai_msg.dict()], update, wait=bool(turn.idempotency_key)
+    )
+    session_cache.invalidate(turn.session_id)
+    
+    # Fold older turns into the rolling summary without delaying the reply
+    if turn.summary_due:
+        run_in_background(refresh_context_summary(turn.session_id, turn.language))
+    
+    return {
+        "response": ai_response,
+        "urgency_level": urgency_level,
+        "next_questions": next_questions,
+        "timestamp": ai_msg.timestamp
+    }
+
+async def stream_reply(chat, user_msg_obj):
+    # Native token streaming when the client has it. LlmChat does not: its
+    # reply is only re-chunked once fully generated, so the event protocol
+    # stays the same but the first chunk comes no sooner than a plain reply
+    stream = getattr(chat, "stream_message", None)
+    if stream is not None:
+        async for chunk in stream(user_msg_obj):
+            if chunk:
+                yield chunk
+        return
+    
+    ai_response = await chat.send_message(user_msg_obj)
+    for i in range(0, len(ai_response), STREAM_CHUNK_CHARS):
+        yield ai_response[i:i + STREAM_CHUNK_CHARS]
+
+async def reply_llm_turn(turn: ChatTurn) -> str:
+    # A turn routed to the fast tier is retried once on the full tier before
+    # it falls back to a templated reply; metadata records the tier that answered
+    try:
+        return await call_llm(
+            "reply", turn.session_id, SYSTEM_PROMPTS[turn.language], turn.prompt, turn.prompt_tokens, turn.model_tier
+        )
+    except CircuitOpen:
+        raise
+    except LlmUnavailable as e:
+        if turn.model_tier == model_router.full.name:
+            raise
+        logging.warning(f"{turn.model_tier} tier failed ({e.reason}), retrying on the {model_router.full.name} tier")
+        turn.model_tier = model_router.full.name
+        return await call_llm(
+            "reply", turn.session_id, SYSTEM_PROMPTS[turn.language], turn.prompt, turn.prompt_tokens, turn.model_tier
+        )
+
+async def stream_llm_turn(turn: ChatTurn):
+    # Streams the reply to a prepared turn under admission control, with the
+    # same pooled client, metrics and circuit breaker as call_llm. Streams
+    # are not hedged; the attempt deadline bounds the wait for each chunk.
+    try:
+        llm_resilience.check()
+    except CircuitOpen as e:
+        yield fallback_reply(turn, e.reason)
+        return
+    
+    chunks = []
+    failure = None
+    async with llm_admission.slot():
+        started = time.perf_counter()
+        LLM_IN_FLIGHT.inc("stream")
+        try:
+            async with llm_pool.session_client(turn.session_id, SYSTEM_PROMPTS[turn.language], turn.model_tier) as chat:
+                replies = stream_reply(chat, UserMessage(text=turn.prompt))
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(replies.__anext__(), llm_resilience.attempt_timeout)
+                    except StopAsyncIteration:
+                        break
+                    chunks.append(chunk)
+                    yield chunk
+        except Exception as e:
+            observe_llm_call("stream", started, "error", turn.prompt_tokens)
+            llm_resilience.failed()
+            # Once part of the reply is out it cannot be replaced
+            if chunks:
+                raise
+            failure = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+        finally:
+            LLM_IN_FLIGHT.dec("stream")
+    
+    if failure:
+        if turn.model_tier != model_router.full.name:
+            # Nothing was streamed yet, so the full tier can still answer
+            logging.warning(f"{turn.model_tier} tier failed ({failure}), retrying on the {model_router.full.name} tier")
+            turn.model_tier = model_router.full.name
+            async for chunk in stream_llm_turn(turn):
+                yield chunk
+            return
+        yield fallback_reply(turn, failure)
+        return
+    llm_resilience.succeeded(time.perf_counter() - started)
+    model_router.observe(turn.model_tier, time.perf_counter() - started)
+    observe_llm_call("stream", started, "ok", turn.prompt_tokens, "".join(chunks))
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+async def run_chat_turn(session_id: str, user_message: str, idempotency_key: Optional[str] = None,
+                        allow_fallback: bool = True):
+    try:
+        turn = await prepare_chat_turn(session_id, user_message, idempotency_key)
+        
+        cached = response_cache.get(turn.response_cache_scope, user_message) if turn.response_cache_scope else None
+        if cached:
+            RESPONSE_CACHE_LOOKUPS.inc(cached.match)
+            RESPONSE_CACHE_SAVED.inc(amount=cached.saved_seconds)
+            turn.response_cache_match = cached.match
+            ai_response = cached.response
+        else:
+            # Get AI response
+            started = time.perf_counter()
+            try:
+                ai_response = await reply_llm_turn(turn)
+            except LlmUnavailable as e:
+                if not allow_fallback:
+                    raise
+                ai_response = fallback_reply(turn, e.reason)
+            else:
+                if turn.response_cache_scope:
+                    RESPONSE_CACHE_LOOKUPS.inc("miss")
+                    response_cache.put(turn.response_cache_scope, user_message, ai_response, time.perf_counter() - started)
+        
+        return await complete_chat_turn(turn, ai_response)
         
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except LlmUnavailable as e:
+        retry_after = e.retry_after if isinstance(e, CircuitOpen) else 1
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(retry_after)})
+    except DuplicateTurn as e:
+        # Another worker completed the same idempotent turn first
+        if idempotency_key:
+            stored = await find_idempotent_reply(session_id, idempotency_key, user_message)
+            if stored:
+                return stored
+        logging.error(f"Error in send_message: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
     except Exception as e:
         logging.error(f"Error in send_message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
+class IdempotencyKeyReused(Exception):
+    def __init__(self, idempotency_key: str):
+        super().__init__(f"Idempotency key {idempotency_key} was already used with a different message")
+
+async def find_idempotent_reply(session_id: str, idempotency_key: str, user_message: str) -> Optional[Dict[str, Any]]:
+    # The stored reply of the turn sent with this key. The key names that
+    # exact message: sending it with another one is a client error
+    if message_buckets is not None:
+        stored = await message_buckets.find_turn(session_id, idempotency_key)
+    else:
+        stored = await db.messages.find(
+            {"session_id": session_id, "idempotency_key": idempotency_key}, {"_id": 0}
+        ).to_list(length=2)
+    question = next((message for message in stored if message["message_type"] == "user"), None)
+    if question is not None and question["content"] != user_message:
+        raise IdempotencyKeyReused(idempotency_key)
+    reply = next((message for message in stored if message["message_type"] == "assistant"), None)
+    if not reply:
+        return None
+    return {
+        "response": reply["content"],
+        "urgency_level": reply.get("urgency_level"),
+        "next_questions": reply.get("next_questions", []),
+        "timestamp": reply["timestamp"]
+    }
+
+# Idempotent turns currently running in this process, keyed by (session_id, idempotency_key),
+# with the message each was started with
+inflight_turns: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+def inflight_turn(flight_key: Tuple[str, str], user_message: str) -> Optional[asyncio.Future]:
+    running = inflight_turns.get(flight_key)
+    if running is None:
+        return None
+    if running[0] != user_message:
+        raise IdempotencyKeyReused(flight_key[1])
+    return running[1]
+
+@api_router.post("/chat/message")
+async def send_message(request: ChatRequest, response: Response, idempotency_key: Optional[str] = Header(None)):
+    key = request.idempotency_key or idempotency_key
+    if not key:
+        return await run_chat_turn(request.session_id, request.message)
+    try:
+        return await run_idempotent_turn(request.session_id, request.message, key, response)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def run_idempotent_turn(session_id: str, user_message: str, key: str, response: Response):
+    # Retries and double submits share the running turn, or replay the stored reply
+    flight_key = (session_id, key)
+    pending = inflight_turn(flight_key, user_message)
+    if pending is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return await asyncio.shield(pending)
+    
+    stored = await find_idempotent_reply(session_id, key, user_message)
+    if stored:
+        response.headers["Idempotent-Replayed"] = "true"
+        return stored
+    
+    # Re-check: another request may have started the turn while we were reading
+    pending = inflight_turn(flight_key, user_message)
+    if pending is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return await asyncio.shield(pending)
+    
+    pending = asyncio.get_running_loop().create_future()
+    inflight_turns[flight_key] = (user_message, pending)
+    try:
+        result = await run_chat_turn(session_id, user_message, key)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            pending.cancel()
+        else:
+            pending.set_exception(e)
+            pending.exception()  # Mark as retrieved when nobody else was waiting
+        raise
+    finally:
+        inflight_turns.pop(flight_key, None)
+    pending.set_result(result)
+    return result
+
+@api_router.post("/chat/message/stream")
+async def send_message_stream(request: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    session_id = request.session_id
+    user_message = request.message
+    key = request.idempotency_key or idempotency_key
+    
+    async def event_stream():
+        try:
+            # A resent keyed turn gets its stored reply as a single done event
+            stored = await find_idempotent_reply(session_id, key, user_message) if key else None
+            if stored:
+                yield sse_event("done", dict(stored, replayed=True))
+                return
+            
+            turn = await prepare_chat_turn(session_id, user_message, key)
+            
+            chunks = []
+            async for chunk in stream_llm_turn(turn):
+                chunks.append(chunk)
+                yield sse_event("chunk", {"text": chunk})
+            
+            # Classify and persist the assistant message once the full text is known
+            result = await complete_chat_turn(turn, "".join(chunks))
+            del result["response"]
+            yield sse_event("done", result)
+        except AdmissionRejected as e:
+            # Headers are already sent, so report the 429 in the event stream
+            yield sse_event("error", {"status": 429, "detail": str(e), "retry_after": e.retry_after})
+        except IdempotencyKeyReused as e:
+            yield sse_event("error", {"status": 422, "detail": str(e)})
+        except DuplicateTurn as e:
+            # The same keyed turn was stored first by a concurrent request
+            stored = await find_idempotent_reply(session_id, key, user_message) if key else None
+            if stored:
+                yield sse_event("done", dict(stored, replayed=True))
+            else:
+                logging.error(f"Error in send_message_stream: {str(e)}")
+                yield sse_event("error", {"detail": f"Error processing message: {str(e)}"})
+        except Exception as e:
+            logging.error(f"Error in send_message_stream: {str(e)}")
+            yield sse_event("error", {"detail": f"Error processing message: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def send_ws_event(websocket: WebSocket, event: str, data: Optional[Dict[str, Any]] = None):
+    payload = dict(jsonable_encoder(data or {}), type=event)
+    await websocket.send_text(json.dumps(payload, ensure_ascii=False))
+
+async def replay_ws_turn(websocket: WebSocket, session_id: str, idempotency_key: str, user_message: str) -> bool:
+    # Answers a keyed turn that is already stored; False when there is none
+    try:
+        stored = await find_idempotent_reply(session_id, idempotency_key, user_message)
+    except IdempotencyKeyReused as e:
+        await send_ws_event(websocket, "error", {"status": 422, "detail": str(e)})
+        return True
+    if stored:
+        await send_ws_event(websocket, "done", dict(stored, replayed=True))
+    return stored is not None
+
+@api_router.websocket("/chat/ws/{session_id}")
+async def chat_websocket(websocket: WebSocket, session_id: str):
+    # One connection per open chat. Session, profile and recent context are
+    # loaded once and kept in memory between turns; turns sent through the
+    # HTTP endpoints meanwhile are not seen until the client reconnects.
+    history, session, profile = await load_chat_context(session_id)
+    await websocket.accept()
+    if not session:
+        await websocket.close(code=4404, reason="Session not found")
+        return
+    
+    # Private copy: counters are advanced locally instead of re-reading the session
+    session = dict(session)
+    reload_session = False
+    # "low" is the baseline the client starts from, so only rises above it are pushed
+    max_rank = max(session.get("max_urgency_rank") or 0, URGENCY_RANK["low"])
+    WS_CONNECTIONS.inc()
+    try:
+        while True:
+            try:
+                request = json.loads(await websocket.receive_text())
+                user_message = request["message"]
+                idempotency_key = request.get("idempotency_key")
+                if not isinstance(user_message, str) or not (idempotency_key is None or isinstance(idempotency_key, str)):
+                    raise TypeError("message and idempotency_key must be strings")
+            except (ValueError, KeyError, TypeError):
+                await send_ws_event(websocket, "error", {"status": 400, "detail": "Expected {\"message\": ...}"})
+                continue
+            
+            # Everything up to the stored reply is per turn: a failing turn gets
+            # an error event and the connection stays open for the next one
+            try:
+                if idempotency_key and await replay_ws_turn(websocket, session_id, idempotency_key, user_message):
+                    continue
+                
+                if reload_session:
+                    # Pick up the rolling summary written after the last turn
+                    session = dict(await load_session(session_id) or session)
+                    reload_session = False
+                
+                turn = build_chat_turn(session_id, user_message, history, session, profile, idempotency_key)
+                
+                # Push a provisional urgency from the user's own words before the reply streams
+                rank = URGENCY_RANK[triage.urgency(user_message, turn.language)]
+                if rank > max_rank:
+                    max_rank = rank
+                    await send_ws_event(websocket, "urgency", {"urgency_level": URGENCY_BY_RANK[rank], "source": "message"})
+                
+                chunks = []
+                async for chunk in stream_llm_turn(turn):
+                    chunks.append(chunk)
+                    await send_ws_event(websocket, "chunk", {"text": chunk})
+                result = await complete_chat_turn(turn, "".join(chunks))
+            except AdmissionRejected as e:
+                await send_ws_event(websocket, "error", {"status": 429, "detail": str(e), "retry_after": e.retry_after})
+                continue
+            except DuplicateTurn as e:
+                if not (idempotency_key and await replay_ws_turn(websocket, session_id, idempotency_key, user_message)):
+                    logging.error(f"Error in chat_websocket: {str(e)}")
+                    await send_ws_event(websocket, "error", {"status": 500, "detail": f"Error processing message: {str(e)}"})
+                continue
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logging.error(f"Error in chat_websocket: {str(e)}")
+                await send_ws_event(websocket, "error", {"status": 500, "detail": f"Error processing message: {str(e)}"})
+                continue
+            
+            rank = URGENCY_RANK[result["urgency_level"]]
+            if rank > max_rank:
+                max_rank = rank
+                await send_ws_event(websocket, "urgency", {"urgency_level": result["urgency_level"], "source": "reply"})
+            del result["response"]
+            await send_ws_event(websocket, "done", result)
+            
+            history.extend([
+                turn.user_message.dict(),
+                {"message_type": "assistant", "content": "".join(chunks), "timestamp": result["timestamp"]}
+            ])
+            del history[:max(0, len(history) - (CONTEXT_RECENT_MESSAGES - 1))]
+            session["message_count"] = session.get("message_count", 0) + 2
+            session["user_count"] = session.get("user_count", 0) + 1
+            session["last_message_at"] = result["timestamp"]
+            reload_session = turn.summary_due
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        # The socket itself failed; nothing more can be sent on it
+        logging.error(f"Error in chat_websocket: {str(e)}")
+    finally:
+        WS_CONNECTIONS.dec()
+
+def encode_history_cursor(message: Dict[str, Any]) -> str:
+    raw = f"{message['timestamp'].isoformat()}|{message['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+def http_validators(*parts: Any) -> Dict[str, str]:
+    # Weak ETag over the parts a representation is derived from (datetimes at
+    # Mongo's millisecond precision, so cached and reloaded documents agree).
+    # No Last-Modified: its one-second resolution would let If-Modified-Since
+    # answer 304 for a turn stored later in the same second
+    digest = hashlib.sha1("|".join(
+        bson_date(part) if isinstance(part, datetime) else str(part) for part in parts
+    ).encode()).hexdigest()[:20]
+    return {"ETag": f'W/"{digest}"', "Cache-Control": "private, no-cache"}
+
+def not_modified(request: Request, validators: Dict[str, str]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or validators["ETag"].removeprefix("W/") in tags
+
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    messages = await db.messages.find(
-        {"session_id": session_id}
-    ).sort("timestamp", 1).to_list(length=None)
+async def get_chat_history(
+    request: Request,
+    session_id: str,
+    limit: int = Query(100, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    session = await load_session(session_id)
+    archived = bool(session and session.get("archived"))
+    
+    # The session's message counters change with every stored turn, so an
+    # unchanged history is answered from them without reading any message.
+    # The page parameters are part of the tag: each page is its own
+    # representation. Sessions predating the counters get no validators.
+    validators = {}
+    if session and isinstance(session.get("message_count"), int):
+        requested_fields = ",".join(sorted({field.strip() for field in fields.split(",") if field.strip()})) if fields else None
+        validators = http_validators(
+            "history", session["message_count"], session.get("last_message_at"), archived,
+            limit, before, requested_fields
+        )
+        if not_modified(request, validators):
+            return Response(status_code=304, headers=validators)
+    
+    query = {"session_id": session_id}
+    cursor = None
+    if before:
+        cursor = decode_history_cursor(before)
+        timestamp, message_id = cursor
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": message_id}}
+        ]
+    if archived:
+        # Archived messages still in their TTL grace period are served from the archive
+        query["archived_at"] = {"$exists": False}
+    
+    # Project only the requested fields; id and timestamp are always needed for the cursor
+    projection = None
+    if fields:
+        projection = {"_id": 0}
+        projection.update({field.strip(): 1 for field in fields.split(",") if field.strip()})
+        projection.update({"id": 1, "timestamp": 1})
     
-    # Convert MongoDB objects to JSON serializable format
-    messages = json.loads(json_util.dumps(messages))
+    if message_buckets is not None:
+        page = await message_buckets.page(session_id, limit + 1, cursor)
+        if projection:
+            page = [{key: value for key, value in message.items() if key in projection} for message in page]
+    else:
+        # Walk the (session_id, timestamp, id) index newest-first and fetch one
+        # extra document to know whether an older page exists
+        page = await db.messages.find(query, projection).sort(
+            [("timestamp", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(length=limit + 1)
+    
+    # Older messages of an archived session continue in its archive document
+    if archived and len(page) <= limit:
+        older = [
+            message for message in await load_archived_messages(db, session_id)
+            if cursor is None or (message["timestamp"], message["id"]) < cursor
+        ]
+        older = older[-(limit + 1 - len(page)):]
+        older.reverse()
+        if projection:
+            older = [{key: value for key, value in message.items() if key in projection} for message in older]
+        page.extend(older)
     
-    return {"messages": messages}
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()  # Chronological order
+    next_before = encode_history_cursor(page[0]) if has_more else None
+    
+    async def body():
+        yield b'{"messages":['
+        for i, message in enumerate(page):
+            yield (b"," if i else b"") + dumps_bson(message)
+        yield b'],"has_more":' + dumps_bson(has_more) + b',"next_before":' + dumps_bson(next_before) + b'}'
+    
+    return StreamingResponse(body(), media_type="application/json", headers=validators)
 
 @api_router.get("/chat/summary/{session_id}")
-async def get_session_summary(session_id: str):
-    # Get session
-    session = await db.chat_sessions.find_one({"session_id": session_id})
+async def get_session_summary(request: Request, session_id: str):
+    # Get session and profile concurrently
+    session, profile = await asyncio.gather(load_session(session_id), load_profile(session_id))
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get profile
-    profile = await db.user_profiles.find_one({"session_id": session_id})
+    if session_counters_missing(session):
+        session = await backfill_session_counters(session)
     
-    # Get messages
-    messages = await db.messages.find(
-        {"session_id": session_id}
-    ).sort("timestamp", 1).to_list(length=None)
-    
-    # Convert MongoDB objects to JSON serializable format
-    session = json.loads(json_util.dumps(session))
-    if profile:
-        profile = json.loads(json_util.dumps(profile))
-    messages = json.loads(json_util.dumps(messages))
-    
-    # Count messages by type
-    user_messages = len([m for m in messages if m["message_type"] == "user"])
-    assistant_messages = len([m for m in messages if m["message_type"] == "assistant"])
+    profile_updated_at = profile.get("updated_at") if profile else None
+    validators = http_validators(
+        "summary", session["message_count"], session.get("last_message_at"), session["max_urgency_rank"],
+        session["status"], profile.get("id") if profile else None, profile_updated_at
+    )
+    if not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
     
-    # Get urgency levels mentioned
-    urgency_levels = [m.get("urgency_level") for m in messages if m.get("urgency_level")]
-    max_urgency = "high" if "high" in urgency_levels else "medium" if "medium" in urgency_levels else "low"
+    # Message counts and urgency come from the running aggregates on the session
+    user_messages = session["user_count"]
+    assistant_messages = session["assistant_count"]
+    max_urgency = URGENCY_BY_RANK.get(session["max_urgency_rank"], "low")
     
     # Calculate duration in minutes (using current time as reference)
-    start_time_str = session["start_time"]["$date"]
+    start_time_str = bson_date(session["start_time"])
     current_time = datetime.utcnow().isoformat()
     
-    return {
+    return BSONResponse({
         "session_info": {
             "session_id": session_id,
             "start_time": start_time_str,
@@ -440,7 +1362,7 @@ async def get_session_summary(session_id: str):
             "status": session["status"]
         },
         "conversation_stats": {
-            "total_messages": len(messages),
+            "total_messages": user_messages + assistant_messages,
             "user_messages": user_messages,
             "assistant_messages": assistant_messages,
             "max_urgency_level": max_urgency
@@ -450,7 +1372,7 @@ async def get_session_summary(session_id: str):
             "urgency_level": max_urgency,
             "next_steps": "Consulta il tuo medico se i sintomi persistono o peggiorano" if max_urgency != "low" else "Monitora i sintomi e cerca assistenza se necessario"
         }
-    }
+    }, headers=validators)
 
 @api_router.post("/chat/close/{session_id}")
 async def close_session(session_id: str):
@@ -463,12 +1385,25 @@ async def close_session(session_id: str):
             }
         }
     )
+    session_cache.invalidate(session_id)
     
     return {"status": "closed", "session_id": session_id}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Response bodies above the threshold are compressed with brotli or gzip,
+# whichever the client accepts (brotli only when the package is installed)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_BYTES', '1024')),
+    gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4')),
+    enabled=os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+)
+
+app.add_middleware(MetricsMiddleware, latency=HTTP_LATENCY, in_flight=HTTP_IN_FLIGHT)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -484,6 +1419,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_db_indexes():
+    await ensure_indexes(db)
+    message_writer.start()
+    # Buckets are already one compact document per run of messages
+    if ARCHIVE_ENABLED and message_buckets is None:
+        session_archiver.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await session_archiver.close()
+    await message_writer.close()
+    client.close()
+    llm_pool.close()
\ No newline at end of file
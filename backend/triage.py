@@ -0,0 +1,104 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+def _trie_regex(keywords) -> str:
+    # Factor shared prefixes so the regex engine walks each start position
+    # like a trie instead of trying every keyword in turn. Optional groups are
+    # greedy, so the longest keyword starting at a position is matched.
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+class _KeywordMatcher:
+    # Finds the best (lowest) priority among all keywords occurring anywhere in
+    # a text, overlapping occurrences included, in one pass over the text
+
+    def __init__(self, priorities: Dict[str, int]):
+        self._pattern = re.compile(f"(?=({_trie_regex(priorities)}))") if priorities else None
+        # Only the longest keyword is reported per start position, so fold in
+        # the priority of every shorter keyword that is a prefix of it
+        self._best = {
+            keyword: min(priorities[keyword[:i]] for i in range(1, len(keyword) + 1) if keyword[:i] in priorities)
+            for keyword in priorities
+        }
+
+    def best(self, text: str) -> Optional[int]:
+        if self._pattern is None:
+            return None
+        best = None
+        for match in self._pattern.finditer(text):
+            priority = self._best[match.group(1)]
+            if best is None or priority < best:
+                if priority == 0:
+                    return 0
+                best = priority
+        return best
+
+class _LanguageRules:
+    def __init__(self, spec: Dict[str, Any]):
+        # Urgency levels are listed from the most to the least urgent
+        self.levels = list(spec["urgency"])
+        self.default_urgency = spec.get("default_urgency", "low")
+        self.urgency = _KeywordMatcher(self._priorities(
+            (rank, keywords) for rank, keywords in enumerate(spec["urgency"].values())
+        ))
+
+        self.follow_ups = [rule["questions"] for rule in spec.get("follow_ups", [])]
+        self.default_follow_ups = spec.get("default_follow_ups", [])
+        self.follow_up = _KeywordMatcher(self._priorities(
+            (index, rule["keywords"]) for index, rule in enumerate(spec.get("follow_ups", []))
+        ))
+
+    @staticmethod
+    def _priorities(groups) -> Dict[str, int]:
+        priorities: Dict[str, int] = {}
+        for priority, keywords in groups:
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword and keyword not in priorities:
+                    priorities[keyword] = priority
+        return priorities
+
+class TriageEngine:
+    """Keyword rules for urgency and follow-up questions, compiled per language.
+
+    Urgency is the most urgent level with a keyword occurring in the text and
+    follow-ups come from the first rule with a matching keyword, the same
+    substring semantics as the original hard-coded checks.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, Any]], default_language: str = "it"):
+        self._rules = {language: _LanguageRules(spec) for language, spec in rules.items()}
+        self.default_language = default_language
+
+    @classmethod
+    def from_file(cls, path: Path, default_language: str = "it") -> "TriageEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), default_language)
+
+    def _language(self, language: Optional[str]) -> _LanguageRules:
+        return self._rules.get(language) or self._rules[self.default_language]
+
+    def urgency(self, text: str, language: Optional[str] = None) -> str:
+        rules = self._language(language)
+        rank = rules.urgency.best(text.lower())
+        return rules.levels[rank] if rank is not None else rules.default_urgency
+
+    def follow_ups(self, text: str, language: Optional[str] = None) -> List[str]:
+        rules = self._language(language)
+        index = rules.follow_up.best(text.lower())
+        return list(rules.follow_ups[index] if index is not None else rules.default_follow_ups)
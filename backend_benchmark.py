@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""Self-contained load test for the MedAgent backend.
+
+Runs server.app in-process against a local mongod (--mongo-url) or an
+in-memory stand-in (mongomock-motor, the default), with the Gemini client
+replaced by a stub of configurable latency and reply length. Simulated users
+go through the same flow as the React client (session, profile, welcome,
+messages, history, summary) and per-endpoint p50/p95/p99 latency and
+throughput are printed as JSON so runs can be compared across commits.
+A --legacy-flow-share of the users starts their chat the way clients did
+before /chat/bootstrap (session, profile, session read, welcome), so both
+flows can be measured side by side.
+
+    python backend_benchmark.py --users 200 --concurrency 50 --messages 4
+    python backend_benchmark.py --mongo-url mongodb://localhost:27017 --output bench.json
+    python backend_benchmark.py --message-storage buckets --messages 20
+    LLM_HEDGING=true python backend_benchmark.py --llm-slow-rate 0.05 --llm-error-rate 0.01
+    python backend_benchmark.py --micro
+    python backend_benchmark.py --websockets 5000
+    python backend_benchmark.py --growth 10000,100000,1000000,10000000 --mongo-url mongodb://localhost:27017
+    python backend_benchmark.py --mongo-latency-ms 5
+    python backend_benchmark.py --legacy-flow-share 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+SAMPLE_MESSAGES = [
+    "Ho la febbre da due giorni",
+    "Ho un forte mal di testa da stamattina",
+    "Sento un dolore al petto quando respiro",
+    "Ho la tosse e il naso chiuso",
+    "Mi fa male lo stomaco dopo i pasti",
+]
+
+class StubChat:
+    """Stands in for LlmChat: sleeps for the configured latency and replies
+    with a canned text of the configured length. A share of calls can be
+    made slow (tail latency) or fail (provider errors)."""
+
+    def __init__(self, session_id, system_message, latency, jitter, reply_chars,
+                 slow_rate=0.0, slow_latency=0.0, error_rate=0.0):
+        self.session_id = session_id
+        self.system_message = system_message
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_chars = reply_chars
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+
+    async def send_message(self, user_message):
+        if random.random() < self.error_rate:
+            await asyncio.sleep(self.latency / 2)
+            raise RuntimeError("stub provider error")
+        latency = self.slow_latency if random.random() < self.slow_rate else random.gauss(self.latency, self.jitter)
+        await asyncio.sleep(max(0.0, latency))
+        base = "Capisco, i sintomi che descrivi sembrano lievi e comuni. "
+        return (base * (self.reply_chars // len(base) + 1))[:self.reply_chars]
+
+class SlowCursor:
+    """Cursor whose results arrive one --mongo-latency-ms round trip late."""
+
+    def __init__(self, cursor, latency):
+        self._cursor = cursor
+        self._latency = latency
+        self._waited = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name == "to_list":
+            async def to_list(*args, **kwargs):
+                await asyncio.sleep(self._latency)
+                return await attr(*args, **kwargs)
+            return to_list
+        if callable(attr):
+            # sort, limit, skip, ... return the cursor itself
+            return lambda *args, **kwargs: SlowCursor(attr(*args, **kwargs), self._latency)
+        return attr
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._waited:
+            self._waited = True
+            await asyncio.sleep(self._latency)
+        return await self._cursor.__anext__()
+
+class SlowCollection:
+    """Collection whose every call takes one extra --mongo-latency-ms, as on a
+    mongod across the network; mongomock and a local mongod answer in
+    microseconds and hide the cost of sequential reads."""
+
+    def __init__(self, collection, latency):
+        self._collection = collection
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ("find", "aggregate"):
+            return lambda *args, **kwargs: SlowCursor(attr(*args, **kwargs), self._latency)
+        if not callable(attr):
+            return attr
+
+        async def delayed(*args, **kwargs):
+            await asyncio.sleep(self._latency)
+            return await attr(*args, **kwargs)
+        return delayed
+
+class SlowDatabase:
+    def __init__(self, db, latency):
+        self._db = db
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return SlowCollection(getattr(self._db, name), self._latency)
+
+    def __getitem__(self, name):
+        return SlowCollection(self._db[name], self._latency)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            endpoints[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3),
+                "throughput_rps": round(len(values) / elapsed, 2)
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            "endpoints": endpoints,
+            "total": {
+                "requests": total,
+                "errors": sum(self.errors.values()),
+                "elapsed_s": round(elapsed, 3),
+                "throughput_rps": round(total / elapsed, 2)
+            }
+        }
+
+async def simulate_user(client, recorder, messages, legacy_flow=False):
+    profile = {"eta": "31-50", "genere": "femmina", "sintomo_principale": random.choice(SAMPLE_MESSAGES), "language": "it"}
+    if legacy_flow:
+        # Four round trips, as before the bootstrap endpoint
+        response = await recorder.call(client, "POST /api/chat/session", "POST", "/api/chat/session")
+        session_id = response.json()["session_id"]
+        await recorder.call(
+            client, "POST /api/chat/profile/{session_id}", "POST", f"/api/chat/profile/{session_id}", json=profile
+        )
+        await recorder.call(client, "GET /api/chat/session/{session_id}", "GET", f"/api/chat/session/{session_id}")
+        await recorder.call(client, "POST /api/chat/welcome/{session_id}", "POST", f"/api/chat/welcome/{session_id}")
+    else:
+        # Session, profile and welcome message in one call, as the React client does
+        response = await recorder.call(client, "POST /api/chat/bootstrap", "POST", "/api/chat/bootstrap", json=profile)
+        session_id = response.json()["session_id"]
+
+    # Keyed like the React client's turns
+    for _ in range(messages):
+        await recorder.call(
+            client, "POST /api/chat/message", "POST", "/api/chat/message",
+            json={"session_id": session_id, "message": random.choice(SAMPLE_MESSAGES), "idempotency_key": str(uuid.uuid4())}
+        )
+
+    await recorder.call(client, "GET /api/chat/history/{session_id}", "GET", f"/api/chat/history/{session_id}")
+    await recorder.call(client, "GET /api/chat/summary/{session_id}", "GET", f"/api/chat/summary/{session_id}")
+
+def load_server(args):
+    # server.py reads its configuration at import time
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["MESSAGE_STORAGE"] = args.message_storage
+    import server
+    from llm_pool import LlmClientPool
+    from message_buckets import MessageBuckets
+    from message_writer import MessageWriter
+    from archiver import SessionArchiver
+
+    if not args.mongo_url:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("Install mongomock-motor or pass --mongo-url to benchmark against a real mongod")
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db_name]
+    if args.mongo_latency_ms:
+        server.db = SlowDatabase(server.db, args.mongo_latency_ms / 1000)
+    if not args.mongo_url or args.mongo_latency_ms:
+        # Rebuilt so they use the database above
+        if server.message_buckets is not None:
+            server.message_buckets = MessageBuckets(server.db, server.message_buckets.bucket_size)
+        server.message_writer = MessageWriter(
+            server.db, write_behind=server.message_writer.write_behind, buckets=server.message_buckets,
+            on_flushed=server.session_cache.invalidate
+        )
+        server.session_archiver = SessionArchiver(
+            server.db, server.session_archiver.idle_after, server.session_archiver.interval,
+            on_archived=server.session_cache.invalidate
+        )
+
+    server.llm_pool = LlmClientPool(
+        lambda session_id, system_message, tier: StubChat(
+            session_id, system_message, args.llm_latency_ms / 1000, args.llm_jitter_ms / 1000, args.reply_chars,
+            args.llm_slow_rate, args.llm_slow_ms / 1000, args.llm_error_rate
+        )
+    )
+    return server
+
+async def compare_reads(server, session_id, repeat):
+    # The session and profile point reads the chat handlers issue together,
+    # awaited one after the other and then gathered
+    async def sequential():
+        await server.db.chat_sessions.find_one({"session_id": session_id})
+        await server.db.user_profiles.find_one({"session_id": session_id})
+
+    async def concurrent():
+        await asyncio.gather(
+            server.db.chat_sessions.find_one({"session_id": session_id}),
+            server.db.user_profiles.find_one({"session_id": session_id})
+        )
+
+    timings = {}
+    for name, reads in (("sequential", sequential), ("concurrent", concurrent)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await reads()
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    return {
+        "sequential_ms": round(timings["sequential"], 3),
+        "concurrent_ms": round(timings["concurrent"], 3),
+        "speedup": round(timings["sequential"] / timings["concurrent"], 2)
+    }
+
+async def run_load(args):
+    import httpx
+    server = load_server(args)
+
+    await server.app.router.startup()
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded_user(client):
+        async with semaphore:
+            await simulate_user(client, recorder, args.messages, random.random() < args.legacy_flow_share)
+
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(bounded_user(client) for _ in range(args.users)))
+            elapsed = time.perf_counter() - start
+            if args.mongo_latency_ms:
+                session_id = (await client.post("/api/chat/session")).json()["session_id"]
+                reads = await compare_reads(server, session_id, args.micro_repeat)
+    finally:
+        if args.mongo_url:
+            await server.client.drop_database(args.db_name)
+        await server.app.router.shutdown()
+
+    result = recorder.report(elapsed)
+    result["llm_resilience"] = server.llm_resilience.stats()
+    if args.mongo_latency_ms:
+        result["session_and_profile_reads"] = reads
+    result["config"] = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "messages_per_user": args.messages,
+        "legacy_flow_share": args.legacy_flow_share,
+        "llm_latency_ms": args.llm_latency_ms,
+        "llm_jitter_ms": args.llm_jitter_ms,
+        "reply_chars": args.reply_chars,
+        "llm_slow_rate": args.llm_slow_rate,
+        "llm_slow_ms": args.llm_slow_ms,
+        "llm_error_rate": args.llm_error_rate,
+        "llm_hedging": server.llm_resilience.hedging,
+        "message_storage": args.message_storage,
+        "mongo": "mongod" if args.mongo_url else "mongomock",
+        "mongo_latency_ms": args.mongo_latency_ms
+    }
+    return result
+
+async def open_idle_websocket(app, path, accepted):
+    # Drives the ASGI app directly: no sockets, so the measured memory is the
+    # server side of the connection only
+    inbox = asyncio.Queue()
+    await inbox.put({"type": "websocket.connect"})
+
+    async def send(message):
+        if message["type"] in ("websocket.accept", "websocket.close") and not accepted.done():
+            accepted.set_result(message["type"])
+
+    scope = {
+        "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [], "subprotocols": [],
+        "server": ("benchmark", 80), "client": ("127.0.0.1", 0)
+    }
+    task = asyncio.create_task(app(scope, inbox.get, send))
+    return inbox, task
+
+async def run_websockets(args):
+    import httpx
+    server = load_server(args)
+
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            session_ids = [
+                (await client.post("/api/chat/session")).json()["session_id"] for _ in range(min(args.websockets, 100))
+            ]
+
+        # Warm up one connection so one-off imports and caches are not counted
+        accepted = asyncio.get_running_loop().create_future()
+        inbox, task = await open_idle_websocket(server.app, f"/api/chat/ws/{session_ids[0]}", accepted)
+        await accepted
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await task
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        connections = []
+        for i in range(args.websockets):
+            accepted = asyncio.get_running_loop().create_future()
+            connections.append((accepted,) + await open_idle_websocket(
+                server.app, f"/api/chat/ws/{session_ids[i % len(session_ids)]}", accepted
+            ))
+        outcomes = await asyncio.gather(*(accepted for accepted, _, _ in connections))
+        elapsed = time.perf_counter() - start
+        # Let every handler settle into its receive loop
+        await asyncio.sleep(0.1)
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        for _, inbox, _ in connections:
+            await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.gather(*(task for _, _, task in connections))
+    finally:
+        if args.mongo_url:
+            await server.client.drop_database(args.db_name)
+        await server.app.router.shutdown()
+
+    opened = outcomes.count("websocket.accept")
+    return {
+        "websockets": {
+            "connections": args.websockets,
+            "accepted": opened,
+            "open_s": round(elapsed, 3),
+            "held_bytes": held,
+            "bytes_per_connection": round(held / args.websockets),
+            "note": "Python heap of the app side only (tracemalloc); the ASGI server adds its own per-socket buffers"
+        },
+        "config": {"mongo": "mongod" if args.mongo_url else "mongomock", "message_storage": args.message_storage}
+    }
+
+def filler_documents(first_session, sessions, messages_per_session, started):
+    # Closed-out conversations of alternating user/assistant messages, with
+    # the session counters the handlers expect
+    from datetime import timedelta
+    session_docs, message_docs = [], []
+    for number in range(first_session, first_session + sessions):
+        session_id = f"growth-{number}"
+        timestamps = [started + timedelta(seconds=i) for i in range(messages_per_session)]
+        session_docs.append({
+            "id": str(uuid.uuid4()), "session_id": session_id, "start_time": started, "status": "active",
+            "message_count": messages_per_session, "user_count": (messages_per_session + 1) // 2,
+            "assistant_count": messages_per_session // 2, "max_urgency_rank": 1, "last_message_at": timestamps[-1],
+            "summarized_count": 0
+        })
+        message_docs += [
+            {
+                "id": str(uuid.uuid4()), "session_id": session_id, "message_type": ("user", "assistant")[i % 2],
+                "content": random.choice(SAMPLE_MESSAGES), "urgency_level": "low", "next_questions": [],
+                "metadata": {}, "idempotency_key": f"{session_id}-{i // 2}", "timestamp": timestamp
+            }
+            for i, timestamp in enumerate(timestamps)
+        ]
+    return session_docs, message_docs
+
+async def run_growth(args):
+    import httpx
+    from datetime import datetime
+    # Every lookup should reach Mongo, not the in-process caches
+    os.environ["SESSION_CACHE_ENABLED"] = "false"
+    server = load_server(args)
+    if not args.mongo_url:
+        print("mongomock does not use indexes; pass --mongo-url for meaningful growth numbers", file=sys.stderr)
+
+    sizes = sorted(int(size) for size in args.growth.split(","))
+    per_session = args.growth_messages_per_session
+    started = datetime.utcnow()
+    await server.app.router.startup()
+    steps = []
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            sessions = 0
+            for size in sizes:
+                # Grow the collections with the indexes in place, as in production
+                fill_started = time.perf_counter()
+                while sessions * per_session < size:
+                    batch = min(args.growth_batch // per_session, size // per_session - sessions) or 1
+                    session_docs, message_docs = filler_documents(sessions, batch, per_session, started)
+                    await asyncio.gather(
+                        server.db.chat_sessions.insert_many(session_docs, ordered=False),
+                        server.db.messages.insert_many(message_docs, ordered=False)
+                    )
+                    sessions += batch
+                fill_s = time.perf_counter() - fill_started
+
+                # Per-request latency of the hot reads on random existing sessions
+                recorder = Recorder()
+                sampled = [f"growth-{random.randrange(sessions)}" for _ in range(args.growth_samples)]
+                request_started = time.perf_counter()
+                for session_id in sampled:
+                    await recorder.call(client, "GET /api/chat/session/{session_id}", "GET", f"/api/chat/session/{session_id}")
+                    await recorder.call(
+                        client, "GET /api/chat/history/{session_id}", "GET", f"/api/chat/history/{session_id}",
+                        params={"limit": 20}
+                    )
+                    await recorder.call(client, "GET /api/chat/summary/{session_id}", "GET", f"/api/chat/summary/{session_id}")
+                    await recorder.call(
+                        client, "POST /api/chat/message", "POST", "/api/chat/message",
+                        json={"session_id": session_id, "message": random.choice(SAMPLE_MESSAGES), "idempotency_key": str(uuid.uuid4())}
+                    )
+                report = recorder.report(time.perf_counter() - request_started)
+                steps.append({
+                    "messages": await server.db.messages.count_documents({}),
+                    "sessions": sessions,
+                    "fill_s": round(fill_s, 1),
+                    "endpoints": {
+                        name: {key: stats[key] for key in ("count", "errors", "p50_ms", "p95_ms", "p99_ms")}
+                        for name, stats in report["endpoints"].items()
+                    }
+                })
+                print(f"{size} messages done", file=sys.stderr)
+    finally:
+        if args.mongo_url:
+            await server.client.drop_database(args.db_name)
+        await server.app.router.shutdown()
+
+    return {
+        "growth": steps,
+        "config": {
+            "samples": args.growth_samples,
+            "messages_per_session": per_session,
+            "llm_latency_ms": args.llm_latency_ms,
+            "message_storage": args.message_storage,
+            "mongo": "mongod" if args.mongo_url else "mongomock"
+        }
+    }
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def run_micro(args):
+    # Pure-CPU comparisons that do not need the app or a database
+    from datetime import datetime
+    from bson import ObjectId, json_util
+    from bson_json import dumps_bson, orjson
+    from triage import TriageEngine
+
+    session = [
+        {
+            "_id": ObjectId(), "id": str(uuid.uuid4()), "session_id": "bench", "message_type": "assistant",
+            "content": random.choice(SAMPLE_MESSAGES) * 20, "urgency_level": "low",
+            "next_questions": ["Da quanto tempo?", "Quanto è intenso?"], "metadata": {"context_used": True},
+            "timestamp": datetime.utcnow()
+        }
+        for _ in range(1000)
+    ]
+    roundtrip_ms = timed(lambda: json.dumps(json.loads(json_util.dumps({"messages": session}))).encode(), args.micro_repeat)
+    direct_ms = timed(lambda: dumps_bson({"messages": session}), args.micro_repeat)
+
+    triage = TriageEngine.from_file(BACKEND_DIR / "triage_rules.json")
+    alphabet = "abcdefghijklmnopqrstuvwxyz "
+    rules = {
+        "it": {
+            "urgency": {
+                level: ["".join(random.choices(alphabet, k=random.randint(6, 24))) for _ in range(args.micro_terms)]
+                for level in ("high", "medium", "low")
+            },
+            "follow_ups": [
+                {"keywords": ["".join(random.choices(alphabet, k=10))], "questions": ["?"]}
+                for _ in range(args.micro_terms // 10)
+            ]
+        }
+    }
+    large = TriageEngine(rules)
+    text = " ".join(random.choice(SAMPLE_MESSAGES) for _ in range(10))
+    default_ms = timed(lambda: (triage.urgency(text, "it"), triage.follow_ups(text, "it")), args.micro_repeat * 100)
+    large_ms = timed(lambda: (large.urgency(text, "it"), large.follow_ups(text, "it")), args.micro_repeat * 100)
+
+    return {
+        "bson_encoding_1k_messages": {
+            "json_library": "orjson" if orjson is not None else "json",
+            "json_util_roundtrip_ms": round(roundtrip_ms, 3),
+            "dumps_bson_ms": round(direct_ms, 3),
+            "speedup": round(roundtrip_ms / direct_ms, 2)
+        },
+        "triage": {
+            "text_chars": len(text),
+            "default_rules_msgs_per_s": round(1000 / default_ms),
+            "large_rules_terms": args.micro_terms * 3,
+            "large_rules_msgs_per_s": round(1000 / large_ms)
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="MedAgent backend benchmark")
+    parser.add_argument("--users", type=int, default=100, help="simulated conversations")
+    parser.add_argument("--concurrency", type=int, default=20, help="conversations in flight at once")
+    parser.add_argument("--messages", type=int, default=3, help="chat messages per conversation")
+    parser.add_argument("--legacy-flow-share", type=float, default=0.0,
+                        help="share of conversations started with the four-call flow instead of /chat/bootstrap")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--reply-chars", type=int, default=800)
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="share of LLM calls taking --llm-slow-ms")
+    parser.add_argument("--llm-slow-ms", type=float, default=5000.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of LLM calls failing")
+    parser.add_argument("--message-storage", choices=("documents", "buckets"), default="documents",
+                        help="message layout to benchmark; run once per layout to compare")
+    parser.add_argument("--mongo-url", help="benchmark against this mongod instead of mongomock")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.0,
+                        help="delay added to every Mongo call, standing in for a remote mongod")
+    parser.add_argument("--db-name", default=f"medagent_benchmark_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--micro", action="store_true", help="run the CPU micro-benchmarks instead")
+    parser.add_argument("--websockets", type=int, help="open this many idle chat WebSockets and report memory per connection")
+    parser.add_argument("--growth", help="comma-separated message collection sizes; report request latency at each")
+    parser.add_argument("--growth-samples", type=int, default=200, help="sessions sampled per growth step")
+    parser.add_argument("--growth-messages-per-session", type=int, default=20)
+    parser.add_argument("--growth-batch", type=int, default=20000, help="messages inserted per write while growing")
+    parser.add_argument("--micro-repeat", type=int, default=20)
+    parser.add_argument("--micro-terms", type=int, default=2000, help="keywords per urgency level")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.micro:
+        result = run_micro(args)
+    elif args.websockets:
+        result = asyncio.run(run_websockets(args))
+    elif args.growth:
+        result = asyncio.run(run_growth(args))
+    else:
+        result = asyncio.run(run_load(args))
+    report = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    print(report)
+
+if __name__ == "__main__":
+    main()
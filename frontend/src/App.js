@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
-import { BrowserRouter, Routes, Route, Link, useNavigate } from 'react-router-dom';
+import { BrowserRouter, Routes, Route, Link, useNavigate, useLocation } from 'react-router-dom';
 import axios from 'axios';
 import { useForm } from 'react-hook-form';
 import { zodResolver } from '@hookform/resolvers/zod';
@@ -28,6 +28,8 @@ import {
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+const URGENCY_RANK = { low: 0, medium: 1, high: 2 };
+
 // Validation schemas
 const profileSchema = z.object({
   eta: z.string().optional(),
@@ -489,15 +491,11 @@ const EvaluationPage = () => {
   const onSubmit = async (data) => {
     setIsSubmitting(true);
     try {
-      // Create session
-      const sessionResponse = await axios.post(`${API}/chat/session`);
-      const sessionId = sessionResponse.data.session_id;
-      
-      // Create profile
-      await axios.post(`${API}/chat/profile/${sessionId}`, data);
+      // Create session, profile and welcome message in one request
+      const response = await axios.post(`${API}/chat/bootstrap`, data);
       
-      // Navigate to chat
-      navigate(`/chat/${sessionId}`);
+      // Navigate to chat, handing over what the chat page would fetch again
+      navigate(`/chat/${response.data.session_id}`, { state: { bootstrap: response.data } });
     } catch (error) {
       console.error('Error creating session:', error);
       alert(language === 'it' ? 'Errore nella creazione della sessione. Riprova.' : 'Error creating session. Please try again.');
@@ -691,7 +689,10 @@ const ChatPage = () => {
   const [profile, setProfile] = useState(null);
   const [currentUrgencyLevel, setCurrentUrgencyLevel] = useState('low');
   const messagesEndRef = useRef(null);
+  const socketRef = useRef(null);
+  const pendingTurnRef = useRef(null);
   const navigate = useNavigate();
+  const location = useLocation();
   const { t } = useLanguage();
 
   const scrollToBottom = () => {
@@ -703,6 +704,17 @@ const ChatPage = () => {
   }, [messages]);
 
   useEffect(() => {
+    const showWelcome = (welcome) => {
+      setMessages([{
+        id: Date.now(),
+        type: 'assistant',
+        content: welcome.message,
+        urgency_level: welcome.urgency_level,
+        next_questions: welcome.next_questions,
+        timestamp: new Date()
+      }]);
+    };
+
     const loadSession = async () => {
       try {
         // Get session and profile
@@ -711,26 +723,92 @@ const ChatPage = () => {
         
         // Get welcome message
         const welcomeResponse = await axios.post(`${API}/chat/welcome/${sessionId}`);
-        
-        setMessages([{
-          id: Date.now(),
-          type: 'assistant',
-          content: welcomeResponse.data.message,
-          urgency_level: welcomeResponse.data.urgency_level,
-          next_questions: welcomeResponse.data.next_questions,
-          timestamp: new Date()
-        }]);
+        showWelcome(welcomeResponse.data);
         
       } catch (error) {
         console.error('Error loading session:', error);
       }
     };
 
-    if (sessionId) {
+    // Coming from the profile form, the bootstrap response already holds
+    // the profile and the welcome message
+    const bootstrap = location.state?.bootstrap;
+    if (bootstrap && bootstrap.session_id === sessionId) {
+      setProfile(bootstrap.profile);
+      showWelcome(bootstrap.welcome);
+    } else if (sessionId) {
       loadSession();
     }
   }, [sessionId]);
 
+  // One WebSocket per open chat: replies stream in and urgency changes are
+  // pushed; sendMessage falls back to HTTP while the socket is not open
+  useEffect(() => {
+    if (!sessionId) return;
+
+    const socket = new WebSocket(`${API.replace(/^http/, 'ws')}/chat/ws/${sessionId}`);
+    socket.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      const turn = pendingTurnRef.current;
+
+      if (data.type === 'urgency') {
+        setCurrentUrgencyLevel(data.urgency_level);
+      } else if (turn && data.type === 'chunk') {
+        setMessages(prev => prev.map(message =>
+          message.id === turn.assistantId ? { ...message, content: message.content + data.text } : message
+        ));
+      } else if (turn && data.type === 'done') {
+        setMessages(prev => prev.map(message =>
+          message.id === turn.assistantId ? {
+            ...message,
+            content: data.replayed ? data.response : message.content,
+            urgency_level: data.urgency_level,
+            next_questions: data.next_questions
+          } : message
+        ));
+        // The banner shows the highest level of the chat: the server pushes an
+        // urgency event whenever it rises, so a calmer reply must not lower it.
+        // A replayed turn gets no urgency event, hence the raise-only update
+        setCurrentUrgencyLevel(prev =>
+          (URGENCY_RANK[data.urgency_level] ?? 0) > (URGENCY_RANK[prev] ?? 0) ? data.urgency_level : prev
+        );
+        pendingTurnRef.current = null;
+        turn.resolve();
+      } else if (turn && data.type === 'error') {
+        pendingTurnRef.current = null;
+        turn.reject(new Error(data.detail));
+      }
+    };
+    socket.onclose = () => {
+      if (pendingTurnRef.current) {
+        pendingTurnRef.current.reject(new Error('Connection closed'));
+        pendingTurnRef.current = null;
+      }
+    };
+    socketRef.current = socket;
+
+    return () => {
+      socketRef.current = null;
+      socket.close();
+    };
+  }, [sessionId]);
+
+  const sendOverSocket = (socket, content, idempotencyKey, assistantId) => new Promise((resolve, reject) => {
+    setMessages(prev => [...prev, {
+      id: assistantId,
+      type: 'assistant',
+      content: '',
+      timestamp: new Date()
+    }]);
+    const fail = (error) => {
+      // Drop the partial reply; sendMessage shows the error message instead
+      setMessages(prev => prev.filter(message => message.id !== assistantId));
+      reject(error);
+    };
+    pendingTurnRef.current = { assistantId, resolve, reject: fail };
+    socket.send(JSON.stringify({ message: content, idempotency_key: idempotencyKey }));
+  });
+
   const sendMessage = async () => {
     if (!inputMessage.trim() || isLoading) return;
 
@@ -745,10 +823,21 @@ const ChatPage = () => {
     setInputMessage('');
     setIsLoading(true);
 
+    // Lets the backend drop duplicate submits and replay retried requests
+    const idempotencyKey = `${sessionId}-${userMessage.id}`;
+
     try {
+      const socket = socketRef.current;
+      if (socket && socket.readyState === WebSocket.OPEN) {
+        await sendOverSocket(socket, inputMessage, idempotencyKey, userMessage.id + 1);
+        setIsLoading(false);
+        return;
+      }
+
       const response = await axios.post(`${API}/chat/message`, {
         session_id: sessionId,
-        message: inputMessage
+        message: inputMessage,
+        idempotency_key: idempotencyKey
       });
 
       const assistantMessage = {
@@ -0,0 +1,146 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import types
+import uuid
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other by their plain names
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def mongo_url():
+    # Query plans need a real mongod; mongomock has no planner
+    url = os.environ.get("MONGO_TEST_URL")
+    if not url:
+        pytest.skip("set MONGO_TEST_URL to run tests against a real mongod")
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    try:
+        MongoClient(url, serverSelectionTimeoutMS=2000).admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"mongod at MONGO_TEST_URL is not reachable: {e}")
+    return url
+
+@pytest.fixture
+def mongo_db(mongo_url):
+    from pymongo import MongoClient
+    client = MongoClient(mongo_url)
+    name = f"medagent_test_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+class StubProvider:
+    """Stands in for the Gemini provider behind LlmChat.
+
+    Every client built by ``client`` opens one connection, as a real HTTP
+    client would. Calls sleep for ``latency`` seconds (or the next value of
+    ``latencies`` when set) and raise while ``failing`` is set, or for
+    clients of a model tier listed in ``failing_tiers``; calls,
+    connections and the peak number of concurrent calls are counted, and
+    every request is kept in ``requests`` with its system message (the pool
+    resets each client's own state between checkouts).
+    """
+
+    def __init__(self, latency: float = 0.0, reply: str = "Capisco, sono sintomi lievi e comuni."):
+        self.latency = latency
+        self.latencies = []
+        self.reply = reply
+        self.failing = False
+        self.failing_tiers = set()
+        self.connections = 0
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    def client(self, session_id, system_message, tier=None):
+        self.connections += 1
+        return StubChat(self, session_id, system_message, tier)
+
+class StubChat:
+    def __init__(self, provider, session_id, system_message, tier):
+        self.provider = provider
+        self.session_id = session_id
+        self.system_message = system_message
+        self.tier = tier
+        self.sent = []
+
+    async def send_message(self, user_message):
+        provider = self.provider
+        provider.calls += 1
+        provider.in_flight += 1
+        provider.max_in_flight = max(provider.max_in_flight, provider.in_flight)
+        self.sent.append(user_message.text)
+        provider.requests.append((self.system_message, user_message.text))
+        try:
+            await asyncio.sleep(provider.latencies.pop(0) if provider.latencies else provider.latency)
+            if provider.failing or self.tier in provider.failing_tiers:
+                raise RuntimeError("stub provider error")
+            return provider.reply
+        finally:
+            provider.in_flight -= 1
+
+def import_server():
+    # Never connected to: the backend fixture swaps in mongomock
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "medagent_test")
+    if "emergentintegrations" not in sys.modules and importlib.util.find_spec("emergentintegrations") is None:
+        # Only create_llm_chat needs the provider SDK, and the tests replace
+        # the pool's client factory with StubProvider.client
+        chat = types.ModuleType("emergentintegrations.llm.chat")
+        chat.LlmChat = None
+        chat.UserMessage = type("UserMessage", (), {"__init__": lambda self, text: setattr(self, "text", text)})
+        sys.modules["emergentintegrations"] = types.ModuleType("emergentintegrations")
+        sys.modules["emergentintegrations.llm"] = types.ModuleType("emergentintegrations.llm")
+        sys.modules["emergentintegrations.llm.chat"] = chat
+    import server
+    return server
+
+@pytest.fixture
+def llm():
+    return StubProvider()
+
+@pytest.fixture
+def backend(monkeypatch, llm):
+    """server with an in-memory database, fresh caches and LLM controls, and
+    the stub provider behind the client pool. Startup hooks do not run, so
+    writes are direct and no indexes are created."""
+    pytest.importorskip("mongomock_motor")
+    from mongomock_motor import AsyncMongoMockClient
+    from admission import AdmissionController
+    from document_cache import DocumentCache
+    from llm_pool import LlmClientPool
+    from message_writer import MessageWriter
+    from resilience import CircuitBreaker, ResilientCaller
+    from response_cache import ResponseCache
+
+    server = import_server()
+    db = AsyncMongoMockClient()[f"medagent_test_{uuid.uuid4().hex[:8]}"]
+    session_cache = DocumentCache()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "message_buckets", None)
+    monkeypatch.setattr(server, "session_cache", session_cache)
+    monkeypatch.setattr(server, "profile_cache", DocumentCache())
+    monkeypatch.setattr(server, "message_writer", MessageWriter(db, on_flushed=session_cache.invalidate))
+    monkeypatch.setattr(server, "llm_pool", LlmClientPool(llm.client))
+    monkeypatch.setattr(server, "llm_admission", AdmissionController(max_concurrency=4, max_queue=16, queue_timeout=5))
+    monkeypatch.setattr(server, "llm_resilience", ResilientCaller(CircuitBreaker(failure_threshold=3, reset_timeout=30), attempt_timeout=5))
+    monkeypatch.setattr(server, "response_cache", ResponseCache(enabled=False))
+    return server
+
+@pytest.fixture
+async def client(backend):
+    import httpx
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
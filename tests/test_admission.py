@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE = "Ho un leggero mal di gola"
+
+async def send(client, session_id):
+    return await client.post("/api/chat/message", json={"session_id": session_id, "message": MESSAGE})
+
+@pytest.fixture
+async def session_id(client):
+    return (await client.post("/api/chat/session")).json()["session_id"]
+
+async def test_a_full_queue_is_answered_429_with_retry_after(backend, client, llm, session_id, monkeypatch):
+    admission = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5)
+    monkeypatch.setattr(backend, "llm_admission", admission)
+    llm.latency = 0.2
+
+    responses = await asyncio.gather(*(send(client, session_id) for _ in range(3)))
+
+    assert sorted(response.status_code for response in responses) == [200, 429, 429]
+    for response in responses:
+        if response.status_code == 429:
+            assert int(response.headers["retry-after"]) >= 1
+            assert "queue full" in response.json()["detail"]
+    assert llm.calls == 1
+    assert admission.stats()["rejected"] == 2
+
+async def test_a_queue_timeout_is_answered_429(backend, client, llm, session_id, monkeypatch):
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    monkeypatch.setattr(backend, "llm_admission", admission)
+    llm.latency = 0.3
+
+    first, second = await asyncio.gather(send(client, session_id), send(client, session_id))
+
+    assert (first.status_code, second.status_code) == (200, 429)
+    assert "queue timeout" in second.json()["detail"] and "retry-after" in second.headers
+    assert admission.stats()["timed_out"] == 1
+
+async def test_a_failed_call_gives_its_slot_back(backend, client, llm, session_id, monkeypatch):
+    admission = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5)
+    monkeypatch.setattr(backend, "llm_admission", admission)
+    llm.failing = True
+
+    # The provider error is answered with the fallback reply
+    response = await send(client, session_id)
+    assert response.status_code == 200
+    assert admission.stats()["active"] == 0
+
+    llm.failing = False
+    response = await send(client, session_id)
+    assert response.status_code == 200
+    assert response.json()["response"] == llm.reply
+
+async def test_an_error_or_cancellation_never_leaks_a_slot():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+
+    with pytest.raises(RuntimeError):
+        async with admission.slot():
+            raise RuntimeError("provider error")
+    assert admission.has_spare_capacity()
+
+    held = asyncio.Event()
+    release = asyncio.Event()
+
+    async def hold():
+        async with admission.slot():
+            held.set()
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await held.wait()
+    waiter = asyncio.create_task(admission.slot().__aenter__())
+    await asyncio.sleep(0.01)
+    assert admission.stats()["waiting"] == 1
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    release.set()
+    await holder
+
+    assert admission.stats()["waiting"] == 0 and admission.stats()["active"] == 0
+    assert admission.has_spare_capacity()
+
+async def test_hedge_slots_are_only_taken_when_free():
+    admission = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5)
+
+    release = await admission.try_acquire()
+    assert release is not None
+    assert await admission.try_acquire() is None
+    with pytest.raises(AdmissionRejected):
+        async with admission.slot():
+            pass
+    release()
+    assert admission.has_spare_capacity()
@@ -0,0 +1,52 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from archiver import SessionArchiver, load_archived_messages
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()[f"test_{uuid.uuid4().hex}"]
+
+async def idle_session(db, idle_hours, stored_messages, message_count):
+    session_id = str(uuid.uuid4())
+    last = datetime.utcnow() - timedelta(hours=idle_hours)
+    await db.chat_sessions.insert_one({
+        "session_id": session_id, "status": "active", "message_count": message_count, "last_message_at": last
+    })
+    if stored_messages:
+        await db.messages.insert_many([
+            {"id": str(uuid.uuid4()), "session_id": session_id, "message_type": "user", "content": "...",
+             "timestamp": last - timedelta(minutes=i)}
+            for i in range(stored_messages)
+        ])
+    return session_id
+
+async def test_sessions_with_nothing_left_to_archive_do_not_stall_the_archiver(db):
+    # Counted messages that are no longer in the hot collection, inserted
+    # first so they would fill every unsorted batch
+    empty = [await idle_session(db, 10, 0, 4) for _ in range(2)]
+    waiting = await idle_session(db, 5, 3, 3)
+    archiver = SessionArchiver(db, idle_after=timedelta(hours=1), interval=60, batch_size=2)
+
+    assert await archiver.run_once() == 2
+    for session_id in empty:
+        session = await db.chat_sessions.find_one({"session_id": session_id})
+        assert session["archived_count"] == session["message_count"]
+
+    assert await archiver.run_once() == 1
+    assert len(await load_archived_messages(db, waiting)) == 3
+    assert await archiver.run_once() == 0
+
+async def test_longest_idle_sessions_are_archived_first(db):
+    recent = await idle_session(db, 2, 2, 2)
+    oldest = await idle_session(db, 48, 2, 2)
+    archiver = SessionArchiver(db, idle_after=timedelta(hours=1), interval=60, batch_size=1)
+
+    await archiver.run_once()
+    assert (await db.chat_sessions.find_one({"session_id": oldest})).get("archived")
+    assert not (await db.chat_sessions.find_one({"session_id": recent})).get("archived")
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+pytestmark = pytest.mark.anyio
+
+async def test_records_refused_for_longer_than_max_wait_fail(backend, llm, monkeypatch):
+    import batch_triage
+    waits = []
+
+    async def sleep(delay):
+        waits.append(delay)
+
+    monkeypatch.setattr(batch_triage.asyncio, "sleep", sleep)
+    llm.failing = True
+
+    with pytest.raises(HTTPException) as raised:
+        await batch_triage.triage_record({"id": "r1", "message": "Ho la febbre"}, max_wait=3)
+    assert raised.value.status_code == 503
+    assert sum(waits) <= 3 and waits
+
+async def test_records_wait_out_a_short_outage(backend, llm, monkeypatch):
+    import batch_triage
+    real_sleep = batch_triage.asyncio.sleep
+
+    async def sleep(delay):
+        llm.failing = False
+        await real_sleep(0)
+
+    monkeypatch.setattr(batch_triage.asyncio, "sleep", sleep)
+    llm.failing = True
+
+    result = await batch_triage.triage_record({"id": "r1", "message": "Ho la febbre"}, max_wait=3)
+    assert result["response"] == llm.reply
+
+def test_unreadable_lines_are_reported_without_stopping_the_run(tmp_path, backend):
+    import batch_triage
+    path = tmp_path / "intake.ndjson"
+    path.write_text("\n".join([
+        json.dumps({"id": "a", "message": "Ho la febbre"}),
+        '{"id": "b", "message": ',
+        json.dumps(["not", "a", "record"]),
+        json.dumps({"message": "Ho la tosse"}),
+        json.dumps({"id": "done", "message": "Ho mal di testa"})
+    ]) + "\n")
+
+    items = list(batch_triage.read_records(str(path), {"done"}))
+    assert [line_number for line_number, _, _ in items] == [1, 2, 3, 4]
+    (_, first, ok), (_, _, bad_json), (_, _, not_a_record), (_, last, ok_too) = items
+    assert first == {"id": "a", "message": "Ho la febbre"} and ok is None
+    assert last == {"id": "4", "message": "Ho la tosse"} and ok_too is None
+    assert "not valid JSON" in bad_json
+    assert "no \"message\"" in not_a_record
+
+def test_a_record_with_an_invalid_key_is_still_a_record(tmp_path, backend):
+    # Reasons travel apart from records, so no field name is reserved
+    import batch_triage
+    path = tmp_path / "intake.ndjson"
+    path.write_text(json.dumps({"id": "a", "message": "Ho la febbre", "invalid": False}) + "\n")
+
+    (_, record, invalid), = batch_triage.read_records(str(path), set())
+    assert invalid is None and record["invalid"] is False
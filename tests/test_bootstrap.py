@@ -0,0 +1,66 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+PROFILES = [
+    {"eta": "31-50", "genere": "F", "sintomo_principale": "mal di testa", "condizioni_note": ["asma"], "language": "it"},
+    {"eta": "18-30", "language": "en"},
+    {},
+]
+
+# Fields that differ between any two sessions
+GENERATED = {"_id", "id", "session_id", "user_profile_id", "start_time", "created_at", "updated_at", "timestamp", "last_message_at"}
+
+def comparable(document):
+    return {key: value for key, value in document.items() if key not in GENERATED}
+
+async def legacy_flow(client, profile):
+    # What the client did before /chat/bootstrap: four sequential requests
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    assert (await client.post(f"/api/chat/profile/{session_id}", json=profile)).status_code == 200
+    loaded = (await client.get(f"/api/chat/session/{session_id}")).json()
+    welcome = (await client.post(f"/api/chat/welcome/{session_id}")).json()
+    return session_id, loaded["profile"], welcome
+
+async def stored(backend, session_id):
+    session = await backend.db.chat_sessions.find_one({"session_id": session_id})
+    profile = await backend.db.user_profiles.find_one({"session_id": session_id})
+    messages = await backend.db.messages.find({"session_id": session_id}).to_list(None)
+    return session, profile, messages
+
+@pytest.mark.parametrize("profile", PROFILES)
+async def test_bootstrap_matches_the_legacy_flow(backend, client, profile):
+    legacy_id, legacy_profile, legacy_welcome = await legacy_flow(client, profile)
+
+    response = await client.post("/api/chat/bootstrap", json=profile)
+    assert response.status_code == 200
+    bootstrap = response.json()
+    session_id = bootstrap["session_id"]
+
+    # The same welcome and profile the client used to assemble from its calls
+    assert bootstrap["welcome"] == legacy_welcome
+    assert comparable(bootstrap["profile"]) == comparable(legacy_profile)
+
+    # And the same documents in the database
+    legacy_session, legacy_profile_doc, legacy_messages = await stored(backend, legacy_id)
+    session, profile_doc, messages = await stored(backend, session_id)
+    assert comparable(session) == comparable(legacy_session)
+    assert session["user_profile_id"] == profile_doc["id"]
+    assert comparable(profile_doc) == comparable(legacy_profile_doc)
+    assert [comparable(message) for message in messages] == [comparable(message) for message in legacy_messages]
+    assert session["last_message_at"] == messages[0]["timestamp"]
+
+async def test_a_bootstrapped_session_reads_back_like_any_other(backend, client):
+    bootstrap = (await client.post("/api/chat/bootstrap", json=PROFILES[0])).json()
+    session_id = bootstrap["session_id"]
+
+    loaded = (await client.get(f"/api/chat/session/{session_id}")).json()
+    assert loaded["profile"] == bootstrap["profile"]
+    assert loaded["session"]["message_count"] == 1
+    history = (await client.get(f"/api/chat/history/{session_id}")).json()["messages"]
+    assert [message["content"] for message in history] == [bootstrap["welcome"]["message"]]
+
+    # The cached session is the stored one: the first turn counts on top of the welcome
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "message": "Ho mal di testa"})
+    assert response.status_code == 200
+    assert (await backend.db.chat_sessions.find_one({"session_id": session_id}))["message_count"] == 3
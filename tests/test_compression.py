@@ -0,0 +1,135 @@
+import gzip
+
+import pytest
+
+import compression
+from compression import CompressionMiddleware, accepted_encodings
+
+pytestmark = pytest.mark.anyio
+
+LARGE = b"Conversazione recente: " * 200
+SMALL = b"ok"
+
+def asgi_app(body_parts, content_type=b"application/json", extra_headers=(), status=200):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type), *extra_headers]
+        if len(body_parts) == 1:
+            headers.append((b"content-length", str(len(body_parts[0])).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        for index, part in enumerate(body_parts):
+            await send({"type": "http.response.body", "body": part, "more_body": index < len(body_parts) - 1})
+    return app
+
+async def fetch(app, accept_encoding="gzip", minimum_size=1024):
+    # Raw ASGI messages, so the test sees the bytes on the wire
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": headers}
+    await CompressionMiddleware(app, minimum_size=minimum_size)(scope, receive, send)
+    start, bodies = sent[0], sent[1:]
+    assert start["type"] == "http.response.start"
+    return dict(start["headers"]), [message["body"] for message in bodies]
+
+@pytest.mark.parametrize("header, coding", [
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "gzip"),
+    ("deflate", None),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("*;q=0.5, gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+    ("GZIP;q=0.8", "gzip"),
+    ("gzip;q=bogus", None),
+])
+def test_negotiation_without_brotli(monkeypatch, header, coding):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert CompressionMiddleware(None).negotiate(header) == coding
+
+def test_brotli_is_preferred_when_installed(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    middleware = CompressionMiddleware(None)
+    assert middleware.negotiate("gzip, br") == "br"
+    assert middleware.negotiate("gzip, br;q=0.5") == "gzip"
+    assert middleware.negotiate("gzip") == "gzip"
+
+def test_accept_encoding_parsing():
+    assert accepted_encodings(" gzip ; q=0.5,br") == {"gzip": 0.5, "br": 1.0}
+
+async def test_large_bodies_are_gzipped(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    headers, bodies = await fetch(asgi_app([LARGE]))
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert gzip.decompress(b"".join(bodies)) == LARGE
+    assert len(b"".join(bodies)) < len(LARGE)
+
+async def test_bodies_under_the_minimum_size_are_sent_as_they_are():
+    headers, bodies = await fetch(asgi_app([SMALL]), minimum_size=1024)
+    assert b"content-encoding" not in headers
+    assert headers[b"content-length"] == b"2" and bodies == [SMALL]
+    assert headers[b"vary"] == b"Accept-Encoding"
+
+    headers, _ = await fetch(asgi_app([LARGE[:1024]]), minimum_size=1024)
+    assert headers[b"content-encoding"] == b"gzip"
+
+async def test_streamed_bodies_are_compressed_chunk_by_chunk(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    parts = [SMALL, LARGE, SMALL]
+    headers, bodies = await fetch(asgi_app(parts))
+
+    # Small chunks too: the total size is unknown up front
+    assert headers[b"content-encoding"] == b"gzip"
+    assert len(bodies) == 3
+    assert gzip.decompress(b"".join(bodies)) == b"".join(parts)
+
+async def test_event_streams_pass_through_unchanged():
+    parts = [b"event: chunk\ndata: {}\n\n" * 100, b"event: done\ndata: {}\n\n"]
+    headers, bodies = await fetch(asgi_app(parts, content_type=b"text/event-stream; charset=utf-8"))
+
+    assert b"content-encoding" not in headers
+    assert bodies == parts
+    assert headers[b"vary"] == b"Accept-Encoding"
+
+async def test_encoded_and_bodiless_responses_are_left_alone():
+    headers, bodies = await fetch(asgi_app([LARGE], extra_headers=[(b"content-encoding", b"identity")]))
+    assert headers[b"content-encoding"] == b"identity" and bodies == [LARGE]
+
+    headers, bodies = await fetch(asgi_app([b""], status=304))
+    assert b"content-encoding" not in headers and bodies == [b""]
+
+async def test_without_an_acceptable_coding_the_response_still_varies():
+    for accept_encoding in (None, "identity"):
+        headers, bodies = await fetch(asgi_app([LARGE]), accept_encoding=accept_encoding)
+        assert b"content-encoding" not in headers and bodies == [LARGE]
+        assert headers[b"vary"] == b"Accept-Encoding"
+
+async def test_an_existing_vary_header_is_kept():
+    headers, _ = await fetch(asgi_app([LARGE], extra_headers=[(b"vary", b"Accept-Encoding, Cookie")]))
+    assert headers[b"vary"] == b"Accept-Encoding, Cookie"
+
+async def test_the_api_compresses_history_but_not_event_streams(backend, client, llm):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    for _ in range(20):
+        await client.post("/api/chat/message", json={"session_id": session_id, "message": "Ho un leggero mal di gola"})
+
+    history = await client.get(f"/api/chat/history/{session_id}", headers={"Accept-Encoding": "gzip"})
+    assert history.headers["content-encoding"] == "gzip"
+    assert history.headers["vary"] == "Accept-Encoding"
+    assert len(history.json()["messages"]) == 40
+
+    stream = await client.post(
+        "/api/chat/message/stream", json={"session_id": session_id, "message": "Ho la tosse"},
+        headers={"Accept-Encoding": "gzip"}
+    )
+    assert "content-encoding" not in stream.headers
+    assert stream.text.rstrip().endswith("}") and "event: done" in stream.text
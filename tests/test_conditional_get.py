@@ -0,0 +1,57 @@
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def session_id(client):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    for _ in range(3):
+        response = await client.post("/api/chat/message", json={
+            "session_id": session_id, "message": "Ho un leggero mal di gola", "idempotency_key": str(uuid.uuid4())
+        })
+        assert response.status_code == 200
+    return session_id
+
+async def test_each_history_page_has_its_own_etag(client, session_id):
+    path = f"/api/chat/history/{session_id}"
+    first = await client.get(path, params={"limit": 2})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    assert (await client.get(path, params={"limit": 2}, headers={"If-None-Match": etag})).status_code == 304
+    variants = [
+        {"limit": 5},
+        {"limit": 2, "before": first.json()["next_before"]},
+        {"limit": 2, "fields": "content"}
+    ]
+    for params in variants:
+        response = await client.get(path, params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 200, params
+        assert response.headers["etag"] != etag
+
+    # The same field set in another order is the same representation
+    tagged = (await client.get(path, params={"fields": "content,message_type"})).headers["etag"]
+    response = await client.get(path, params={"fields": "message_type, content"}, headers={"If-None-Match": tagged})
+    assert response.status_code == 304
+
+async def test_validators_rely_on_the_etag_only(client, session_id):
+    path = f"/api/chat/history/{session_id}"
+    first = await client.get(path)
+    assert "last-modified" not in first.headers
+
+    response = await client.get(path, headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+
+    # A turn stored within the same second changes the tag
+    await client.post("/api/chat/message", json={
+        "session_id": session_id, "message": "Ho anche la tosse", "idempotency_key": str(uuid.uuid4())
+    })
+    assert (await client.get(path, headers={"If-None-Match": first.headers["etag"]})).status_code == 200
+
+async def test_unchanged_summary_is_not_modified(client, session_id):
+    path = f"/api/chat/summary/{session_id}"
+    first = await client.get(path)
+    assert "last-modified" not in first.headers
+    assert (await client.get(path, headers={"If-None-Match": first.headers["etag"]})).status_code == 304
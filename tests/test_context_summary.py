@@ -0,0 +1,31 @@
+import asyncio
+import uuid
+
+import pytest
+
+from prompt_builder import TEMPLATES
+
+pytestmark = pytest.mark.anyio
+
+@pytest.mark.parametrize("language", ["it", "en"])
+async def test_context_summary_is_requested_in_the_session_language(backend, client, llm, monkeypatch, language):
+    monkeypatch.setattr(backend, "SUMMARY_EVERY_MESSAGES", 2)
+    response = await client.post("/api/chat/bootstrap", json={
+        "eta": "31-50", "genere": "femmina", "sintomo_principale": "mal di gola", "language": language
+    })
+    session_id = response.json()["session_id"]
+    for message in ("first symptom", "second symptom", "third symptom"):
+        response = await client.post("/api/chat/message", json={
+            "session_id": session_id, "message": message, "idempotency_key": str(uuid.uuid4())
+        })
+        assert response.status_code == 200, response.text
+    await asyncio.gather(*backend.background_tasks)
+
+    template = TEMPLATES[language]
+    requests = "\n".join(text for system_message, text in llm.requests if system_message == template["summary_prompt"])
+    assert requests, "no summary was requested"
+    assert template["new_messages"].format(value=f"{template['assistant']}: ") in requests
+    assert f"{template['user']}: first symptom" in requests
+
+    session = await backend.db.chat_sessions.find_one({"session_id": session_id})
+    assert session["context_summary"] == llm.reply
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+import document_cache
+from document_cache import DocumentCache
+
+pytestmark = pytest.mark.anyio
+
+class Loader:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.version = 0
+        self.failing = False
+
+    def __call__(self, key):
+        async def load():
+            self.calls += 1
+            version = self.version  # What the database held when the read started
+            await asyncio.sleep(self.delay)
+            if self.failing:
+                raise RuntimeError("database unavailable")
+            return {"session_id": key, "version": version}
+        return load
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(document_cache.time, "monotonic", lambda: now[0])
+    return now
+
+async def test_entries_expire_after_the_ttl(clock):
+    cache, loader = DocumentCache(ttl=60), Loader()
+    await cache.get("a", loader("a"))
+    loader.version = 1
+
+    clock[0] += 59
+    assert (await cache.get("a", loader("a")))["version"] == 0
+    clock[0] += 2
+    assert (await cache.get("a", loader("a")))["version"] == 1
+    assert loader.calls == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+async def test_the_least_recently_used_entry_is_evicted_at_capacity(clock):
+    cache, loader = DocumentCache(max_size=2), Loader()
+    await cache.get("a", loader("a"))
+    await cache.get("b", loader("b"))
+    await cache.get("a", loader("a"))  # "b" is now the least recently used
+    await cache.get("c", loader("c"))
+
+    assert cache.stats()["size"] == 2
+    calls = loader.calls
+    await cache.get("a", loader("a"))
+    await cache.get("c", loader("c"))
+    assert loader.calls == calls
+    await cache.get("b", loader("b"))
+    assert loader.calls == calls + 1
+
+async def test_a_write_replaces_or_drops_the_cached_document():
+    cache, loader = DocumentCache(), Loader()
+    await cache.get("a", loader("a"))
+
+    cache.put("a", {"session_id": "a", "version": 5})
+    assert (await cache.get("a", loader("a")))["version"] == 5
+
+    cache.invalidate("a")
+    loader.version = 6
+    assert (await cache.get("a", loader("a")))["version"] == 6
+    assert loader.calls == 2
+
+async def test_a_write_during_a_load_wins_over_the_loaded_document():
+    cache, loader = DocumentCache(), Loader(delay=0.05)
+    read = asyncio.create_task(cache.get("a", loader("a")))
+    await asyncio.sleep(0.01)
+    cache.invalidate("a")
+    loader.version = 1
+    assert (await read)["version"] == 0
+
+    # The stale read was not stored
+    assert (await cache.get("a", loader("a")))["version"] == 1
+    assert loader.calls == 2
+
+async def test_concurrent_misses_share_one_loader_call():
+    cache, loader = DocumentCache(), Loader(delay=0.02)
+
+    docs = await asyncio.gather(*(cache.get("a", loader("a")) for _ in range(10)))
+
+    assert loader.calls == 1
+    assert all(doc == {"session_id": "a", "version": 0} for doc in docs)
+    # Each caller owns its copy
+    docs[0]["version"] = 99
+    assert (await cache.get("a", loader("a")))["version"] == 0
+
+async def test_a_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache, loader = DocumentCache(), Loader(delay=0.02)
+    loader.failing = True
+
+    results = await asyncio.gather(*(cache.get("a", loader("a")) for _ in range(3)), return_exceptions=True)
+
+    assert loader.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    loader.failing = False
+    assert (await cache.get("a", loader("a")))["version"] == 0
+
+async def test_missing_documents_are_cached_too():
+    cache, calls = DocumentCache(), []
+
+    async def missing():
+        calls.append(1)
+        return None
+
+    assert await cache.get("a", missing) is None
+    assert await cache.get("a", missing) is None
+    assert len(calls) == 1
+
+async def test_a_stored_turn_invalidates_the_cached_session(backend, client):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    before = (await backend.load_session(session_id))["message_count"]
+
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "message": "Ho la febbre"})
+    assert response.status_code == 200
+
+    assert (await backend.load_session(session_id))["message_count"] == before + 2
@@ -0,0 +1,94 @@
+import base64
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def session_id(client):
+    return (await client.post("/api/chat/session")).json()["session_id"]
+
+async def send(client, session_id, message="Ho un leggero mal di gola"):
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "message": message})
+    assert response.status_code == 200
+    return response.json()
+
+def timestamp(message):
+    # History is relaxed Extended JSON: {"$date": "...Z"} at millisecond precision
+    return datetime.fromisoformat(message["timestamp"]["$date"].removesuffix("Z"))
+
+async def all_pages(client, session_id, limit):
+    pages, before = [], None
+    while True:
+        params = {"limit": limit, **({"before": before} if before else {})}
+        page = (await client.get(f"/api/chat/history/{session_id}", params=params)).json()
+        pages.append(page)
+        if not page["has_more"]:
+            assert page["next_before"] is None
+            return pages
+        before = page["next_before"]
+
+async def test_rapid_turns_come_back_in_the_order_they_were_sent(backend, client, session_id):
+    for i in range(5):
+        await send(client, session_id, f"Messaggio {i}")
+
+    messages = (await client.get(f"/api/chat/history/{session_id}")).json()["messages"]
+    assert [message["message_type"] for message in messages] == ["user", "assistant"] * 5
+    assert [message["content"] for message in messages[::2]] == [f"Messaggio {i}" for i in range(5)]
+    timestamps = [timestamp(message) for message in messages]
+    assert timestamps == sorted(set(timestamps))
+
+async def test_a_question_after_a_reply_dated_ahead_still_sorts_after_it(backend, client, session_id):
+    # A reply stored a little ahead of this worker's clock (another worker's
+    # clock, or a reply bumped past its question's millisecond)
+    ahead = datetime.utcnow().replace(microsecond=0) + timedelta(seconds=5)
+    await backend.db.messages.insert_one({
+        "id": "z" * 8, "session_id": session_id, "message_type": "assistant", "content": "Risposta", "timestamp": ahead
+    })
+    await backend.db.chat_sessions.update_one({"session_id": session_id}, {"$set": {"last_message_at": ahead}})
+    backend.session_cache.invalidate(session_id)
+
+    await send(client, session_id)
+
+    messages = (await client.get(f"/api/chat/history/{session_id}")).json()["messages"]
+    assert [message["content"] for message in messages][:2] == ["Risposta", "Ho un leggero mal di gola"]
+    assert timestamp(messages[1]) == ahead + timedelta(milliseconds=1)
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 10])
+async def test_pages_cover_the_history_once_at_any_boundary(backend, client, session_id, limit):
+    for _ in range(2):
+        await send(client, session_id)
+
+    pages = await all_pages(client, session_id, limit)
+
+    # Newest page first; each page in chronological order
+    ids = [message["id"] for page in reversed(pages) for message in page["messages"]]
+    expected = await backend.db.messages.find({"session_id": session_id}).sort([("timestamp", 1), ("id", 1)]).to_list(None)
+    assert ids == [message["id"] for message in expected]
+    assert [len(page["messages"]) for page in pages] == [limit] * (4 // limit) + ([4 % limit] if 4 % limit else [])
+
+async def test_messages_sharing_a_timestamp_are_paged_by_id(backend, client, session_id):
+    same = datetime.utcnow().replace(microsecond=0)
+    ids = sorted(str(uuid.uuid4()) for _ in range(7))
+    await backend.db.messages.insert_many([
+        {"id": message_id, "session_id": session_id, "message_type": "user", "content": message_id, "timestamp": same}
+        for message_id in ids
+    ])
+
+    pages = await all_pages(client, session_id, 3)
+
+    assert [len(page["messages"]) for page in pages] == [3, 3, 1]
+    assert [message["id"] for page in reversed(pages) for message in page["messages"]] == ids
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"yesterday|abc").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|abc").decode(),
+])
+async def test_an_invalid_cursor_is_rejected(client, session_id, cursor):
+    response = await client.get(f"/api/chat/history/{session_id}", params={"before": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid history cursor"
@@ -0,0 +1,76 @@
+import asyncio
+import uuid
+
+import pytest
+
+from message_writer import MessageWriter
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE = "Ho un leggero mal di gola"
+
+@pytest.fixture(params=["direct", "write-behind"])
+async def writer_mode(request, backend, monkeypatch):
+    # The unique index of indexes.py, without its partial filter (mongomock
+    # has none); the session below holds no other keyless user message
+    await backend.db.messages.create_index(
+        [("session_id", 1), ("idempotency_key", 1), ("message_type", 1)], unique=True
+    )
+    if request.param == "write-behind":
+        writer = MessageWriter(backend.db, write_behind=True, on_flushed=backend.session_cache.invalidate)
+        monkeypatch.setattr(backend, "message_writer", writer)
+        writer.start()
+        yield request.param
+        await writer.close()
+    else:
+        yield request.param
+
+async def message_count(backend, session_id):
+    return (await backend.db.chat_sessions.find_one({"session_id": session_id}))["message_count"]
+
+async def test_a_turn_completed_by_another_worker_is_replayed_and_counted_once(backend, client, llm, writer_mode):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    before = await message_count(backend, session_id)
+    llm.latency = 0.05
+
+    # Two workers run the same keyed turn: no shared in-flight map, and both
+    # miss the stored reply before writing
+    key = str(uuid.uuid4())
+    first, second = await asyncio.gather(
+        backend.run_chat_turn(session_id, MESSAGE, key), backend.run_chat_turn(session_id, MESSAGE, key)
+    )
+
+    assert first["response"] == second["response"] == llm.reply
+    assert await message_count(backend, session_id) == before + 2
+    assert await backend.db.messages.count_documents({"session_id": session_id, "idempotency_key": key}) == 2
+
+async def test_a_key_sent_again_with_another_message_is_rejected(backend, client):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    before = await message_count(backend, session_id)
+    key = str(uuid.uuid4())
+
+    async def send(message):
+        return await client.post("/api/chat/message", json={"session_id": session_id, "message": message, "idempotency_key": key})
+
+    first = await send(MESSAGE)
+    assert first.status_code == 200
+    replayed = await send(MESSAGE)
+    assert replayed.status_code == 200 and replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.json()["response"] == first.json()["response"]
+
+    reused = await send("Ho la febbre alta")
+    assert reused.status_code == 422
+    assert await message_count(backend, session_id) == before + 2
+    assert await backend.db.messages.count_documents({"session_id": session_id, "idempotency_key": key}) == 2
+
+async def test_a_key_reused_while_its_turn_runs_is_rejected(backend, client, llm):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    llm.latency = 0.05
+    key = str(uuid.uuid4())
+
+    async def send(message):
+        return await client.post("/api/chat/message", json={"session_id": session_id, "message": message, "idempotency_key": key})
+
+    first, reused = await asyncio.gather(send(MESSAGE), send("Ho la febbre alta"))
+    assert first.status_code == 200
+    assert reused.status_code == 422
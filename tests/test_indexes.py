@@ -0,0 +1,173 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from indexes import INDEXES, ensure_indexes
+
+# Without a mongod the specs are still checked, through mongomock; plans
+# below need a real server
+EXPECTED_INDEXES = {
+    "messages": {
+        "session_timestamp_id": ([("session_id", 1), ("timestamp", 1), ("id", 1)], {}),
+        "session_idempotency_key": (
+            [("session_id", 1), ("idempotency_key", 1), ("message_type", 1)], {"unique": True}
+        ),
+        "archived_at_ttl": ([("archived_at", 1)], {"expireAfterSeconds": 86400}),
+    },
+    "message_buckets": {
+        "session_count": ([("session_id", 1), ("count", 1)], {}),
+        "session_last_timestamp": ([("session_id", 1), ("last_timestamp", 1)], {}),
+        "session_idempotency_keys": ([("session_id", 1), ("idempotency_keys", 1)], {"unique": True}),
+    },
+    "message_archives": {
+        "session_id_unique": ([("session_id", 1)], {"unique": True}),
+    },
+    "chat_sessions": {
+        "session_id_unique": ([("session_id", 1)], {"unique": True}),
+        "last_message_at": ([("last_message_at", 1)], {}),
+        "status_last_message_at": ([("status", 1), ("last_message_at", 1)], {}),
+    },
+    "user_profiles": {
+        "session_id_unique": ([("session_id", 1)], {"unique": True}),
+    },
+}
+
+def test_ensure_indexes_creates_the_expected_specs():
+    pytest.importorskip("mongomock_motor")
+    from mongomock_motor import AsyncMongoMockClient
+
+    db = AsyncMongoMockClient()[f"medagent_test_{uuid.uuid4().hex[:8]}"]
+
+    async def created():
+        await ensure_indexes(db)
+        # Running it again on an indexed database must not fail
+        await ensure_indexes(db)
+        return {collection: await db[collection].index_information() for collection in EXPECTED_INDEXES}
+
+    info = asyncio.run(created())
+    assert set(INDEXES) == set(EXPECTED_INDEXES)
+    for collection, expected in EXPECTED_INDEXES.items():
+        indexes = {name: spec for name, spec in info[collection].items() if name != "_id_"}
+        assert set(indexes) == set(expected), collection
+        for name, (keys, options) in expected.items():
+            assert list(indexes[name]["key"]) == keys, name
+            for option in ("unique", "expireAfterSeconds"):
+                assert indexes[name].get(option) == options.get(option), (name, option)
+
+@pytest.mark.parametrize("collection, name, partial", [
+    ("messages", "session_idempotency_key", {"idempotency_key": {"$type": "string"}}),
+    ("message_buckets", "session_idempotency_keys", {"idempotency_keys": {"$exists": True}}),
+])
+def test_idempotency_indexes_only_cover_keyed_documents(collection, name, partial):
+    # mongomock drops partial filters from index_information, so these are read off the model
+    model, = [model for model in INDEXES[collection] if model.document["name"] == name]
+    assert model.document["partialFilterExpression"] == partial
+
+def plan_stages(plan):
+    # Every stage of an explain() plan tree, classic or slot-based
+    plan = plan.get("queryPlan", plan)
+    stages = [plan]
+    for key in ("inputStage", "outerStage", "innerStage"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+def assert_index_scan(explained, index_name):
+    stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+    names = [stage["stage"] for stage in stages]
+    assert "COLLSCAN" not in names, names
+    # SORT_MERGE only merges branches already in index order
+    assert "SORT" not in names, names
+    assert {stage.get("indexName") for stage in stages if stage["stage"] == "IXSCAN"} == {index_name}, stages
+
+@pytest.fixture
+def indexed_db(mongo_db, mongo_url):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def ensure():
+        client = AsyncIOMotorClient(mongo_url)
+        await ensure_indexes(client[mongo_db.name])
+        client.close()
+
+    asyncio.run(ensure())
+
+    started = datetime.utcnow()
+    sessions = [str(uuid.uuid4()) for _ in range(20)]
+    mongo_db.messages.insert_many([
+        {
+            "id": str(uuid.uuid4()), "session_id": session_id, "message_type": ("user", "assistant")[i % 2],
+            "content": f"message {i}", "timestamp": started + timedelta(seconds=i)
+        }
+        for session_id in sessions for i in range(50)
+    ])
+    mongo_db.chat_sessions.insert_many([
+        {
+            "session_id": session_id, "status": ("active", "closed")[i % 2], "message_count": 50,
+            "last_message_at": started + timedelta(seconds=i)
+        }
+        for i, session_id in enumerate(sessions)
+    ])
+    mongo_db.user_profiles.insert_many([{"session_id": session_id} for session_id in sessions])
+    return mongo_db, sessions[0], started
+
+def test_history_page_uses_session_timestamp_index(indexed_db):
+    db, session_id, _ = indexed_db
+    explained = db.messages.find({"session_id": session_id}).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(101).explain()
+    assert_index_scan(explained, "session_timestamp_id")
+
+def test_history_keyset_page_uses_session_timestamp_index(indexed_db):
+    db, session_id, started = indexed_db
+    cursor = started + timedelta(seconds=25)
+    explained = db.messages.find({
+        "session_id": session_id,
+        "$or": [{"timestamp": {"$lt": cursor}}, {"timestamp": cursor, "id": {"$lt": "m"}}]
+    }).sort([("timestamp", -1), ("id", -1)]).limit(101).explain()
+    assert_index_scan(explained, "session_timestamp_id")
+
+def test_chat_context_uses_session_timestamp_index(indexed_db):
+    db, session_id, _ = indexed_db
+    explained = db.messages.find({"session_id": session_id}).sort("timestamp", -1).limit(3).explain()
+    assert_index_scan(explained, "session_timestamp_id")
+
+def test_summary_refresh_uses_session_timestamp_index(indexed_db):
+    db, session_id, started = indexed_db
+    explained = db.messages.find(
+        {"session_id": session_id, "timestamp": {"$gt": started}}
+    ).sort("timestamp", 1).explain()
+    assert_index_scan(explained, "session_timestamp_id")
+
+@pytest.mark.parametrize("collection", ["chat_sessions", "user_profiles"])
+def test_session_lookups_use_unique_index(indexed_db, collection):
+    db, session_id, _ = indexed_db
+    explained = db[collection].find({"session_id": session_id}).limit(1).explain()
+    assert_index_scan(explained, "session_id_unique")
+
+def test_archiver_candidates_use_an_index_per_branch(indexed_db):
+    db, _, started = indexed_db
+    explained = db.chat_sessions.find({
+        "$or": [{"status": "closed"}, {"last_message_at": {"$lt": started + timedelta(seconds=10)}}],
+        "message_count": {"$type": "number"},
+        "$expr": {"$gt": ["$message_count", {"$ifNull": ["$archived_count", 0]}]}
+    }, {"session_id": 1, "message_count": 1}).sort("last_message_at", 1).limit(100).explain()
+    stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+    names = [stage["stage"] for stage in stages]
+    assert "COLLSCAN" not in names and "SORT" not in names, names
+    assert {stage.get("indexName") for stage in stages if stage["stage"] == "IXSCAN"} == {
+        "status_last_message_at", "last_message_at"
+    }, stages
+
+def test_archive_marking_uses_session_timestamp_index(indexed_db):
+    db, session_id, _ = indexed_db
+    ids = [message["id"] for message in db.messages.find({"session_id": session_id}, {"id": 1}).limit(10)]
+    explained = db.command(
+        "explain", {"update": "messages", "updates": [
+            {"q": {"session_id": session_id, "id": {"$in": ids}}, "u": {"$set": {"archived_at": 1}}, "multi": True}
+        ]}, verbosity="queryPlanner"
+    )
+    assert_index_scan(explained, "session_timestamp_id")
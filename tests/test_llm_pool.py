@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+
+import pytest
+
+from tests.conftest import StubProvider
+from llm_pool import LlmClientPool
+
+pytestmark = pytest.mark.anyio
+
+async def checkout(pool, session_id, system_message="system", tier=None, hold=0.0):
+    async with pool.session_client(session_id, system_message, tier) as chat:
+        assert chat.session_id == session_id
+        chat.sent.append(session_id)
+        await asyncio.sleep(hold)
+        return chat
+
+async def test_sequential_requests_reuse_one_connection():
+    provider = StubProvider()
+    pool = LlmClientPool(provider.client)
+
+    clients = {id(await checkout(pool, str(uuid.uuid4()))) for _ in range(50)}
+
+    assert provider.connections == 1
+    assert len(clients) == 1
+    assert pool.stats() == {"created": 1, "reused": 49, "idle": 1}
+
+async def test_concurrent_requests_open_one_connection_per_concurrent_call():
+    provider = StubProvider()
+    pool = LlmClientPool(provider.client)
+
+    for _ in range(3):
+        await asyncio.gather(*(checkout(pool, str(uuid.uuid4()), hold=0.01) for _ in range(8)))
+
+    assert provider.connections == 8
+    assert pool.stats()["reused"] == 16
+
+async def test_session_state_does_not_leak_between_checkouts():
+    pool = LlmClientPool(StubProvider().client)
+
+    first = await checkout(pool, "session-a")
+    async with pool.session_client("session-b", "system") as chat:
+        assert chat is first
+        assert chat.session_id == "session-b"
+        # Instance state is back to how the factory configured it
+        assert chat.sent == []
+
+async def test_clients_are_kept_per_system_message_and_tier():
+    provider = StubProvider()
+    pool = LlmClientPool(provider.client)
+
+    for system_message, tier in [("it", "fast"), ("it", "full"), ("en", "fast"), ("it", "fast"), ("en", "fast")]:
+        chat = await checkout(pool, str(uuid.uuid4()), system_message, tier)
+        assert (chat.system_message, chat.tier) == (system_message, tier)
+
+    assert provider.connections == 3
+
+async def test_idle_clients_beyond_max_idle_are_dropped():
+    provider = StubProvider()
+    pool = LlmClientPool(provider.client, max_idle=2)
+
+    await asyncio.gather(*(checkout(pool, str(uuid.uuid4()), hold=0.01) for _ in range(5)))
+
+    assert pool.stats()["idle"] == 2
+    await asyncio.gather(*(checkout(pool, str(uuid.uuid4()), hold=0.01) for _ in range(5)))
+    assert provider.connections == 8
+
+async def test_chat_turns_share_pooled_connections(backend, client, llm):
+    sessions = [(await client.post("/api/chat/session")).json()["session_id"] for _ in range(3)]
+    for session_id in sessions:
+        for i in range(3):
+            response = await client.post("/api/chat/message", json={
+                "session_id": session_id, "message": f"Ho la tosse da {i + 1} giorni", "idempotency_key": str(uuid.uuid4())
+            })
+            assert response.status_code == 200, response.text
+
+    assert llm.calls == 9
+    assert llm.connections == 1
+    assert backend.llm_pool.stats()["reused"] == 8
@@ -0,0 +1,124 @@
+import asyncio
+import uuid
+
+import pytest
+
+from indexes import ensure_indexes
+from message_buckets import MessageBuckets
+from message_writer import DuplicateTurn, MessageWriter
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE = "Ho un leggero mal di gola"
+BUCKET_SIZE = 4
+
+@pytest.fixture(params=["direct", "write-behind"])
+async def buckets(request, backend, monkeypatch):
+    await ensure_indexes(backend.db)
+    buckets = MessageBuckets(backend.db, bucket_size=BUCKET_SIZE)
+    writer = MessageWriter(
+        backend.db, write_behind=request.param == "write-behind", buckets=buckets,
+        on_flushed=backend.session_cache.invalidate
+    )
+    monkeypatch.setattr(backend, "message_buckets", buckets)
+    monkeypatch.setattr(backend, "message_writer", writer)
+    writer.start()
+    yield buckets
+    await writer.close()
+
+@pytest.fixture
+async def session_id(client, buckets):
+    return (await client.post("/api/chat/session")).json()["session_id"]
+
+async def send(client, session_id, message=MESSAGE, key=None):
+    response = await client.post("/api/chat/message", json={
+        "session_id": session_id, "message": message, **({"idempotency_key": key} if key else {})
+    })
+    assert response.status_code in (200, 422)
+    return response
+
+async def stored_buckets(backend, session_id):
+    return await backend.db.message_buckets.find({"session_id": session_id}).sort("first_timestamp", 1).to_list(None)
+
+async def test_a_full_bucket_rolls_over_without_splitting_a_turn(backend, client, session_id):
+    for i in range(5):
+        await send(client, session_id, f"Messaggio {i}", str(uuid.uuid4()))
+
+    stored = await stored_buckets(backend, session_id)
+    assert [bucket["count"] for bucket in stored] == [4, 4, 2]
+    for bucket in stored:
+        assert bucket["count"] == len(bucket["messages"])
+        assert bucket["first_timestamp"] == bucket["messages"][0]["timestamp"]
+        assert bucket["last_timestamp"] == bucket["messages"][-1]["timestamp"]
+        assert len(bucket["idempotency_keys"]) == bucket["count"] // 2
+        # Both messages of a turn share a bucket
+        assert [message["message_type"] for message in bucket["messages"]] == ["user", "assistant"] * (bucket["count"] // 2)
+
+async def test_history_pages_read_across_buckets(backend, client, session_id):
+    # Keyed: mongomock ignores the partial filter on upserts, so a second
+    # keyless bucket would collide with the first on the unique index
+    for i in range(5):
+        await send(client, session_id, f"Messaggio {i}", str(uuid.uuid4()))
+
+    pages, before = [], None
+    while True:
+        params = {"limit": 3, **({"before": before} if before else {})}
+        page = (await client.get(f"/api/chat/history/{session_id}", params=params)).json()
+        pages.append(page["messages"])
+        before = page["next_before"]
+        if not page["has_more"]:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    messages = [message for page in reversed(pages) for message in page]
+    assert [message["content"] for message in messages[::2]] == [f"Messaggio {i}" for i in range(5)]
+    assert len({message["id"] for message in messages}) == 10
+
+    # The recent context of the next turn spans the last two buckets
+    history, _, _ = await backend.load_chat_context(session_id)
+    assert [message["id"] for message in history] == [message["id"] for message in messages][-len(history):]
+    assert len(history) == backend.CONTEXT_RECENT_MESSAGES - 1
+
+async def test_a_resent_key_replays_from_its_bucket(backend, client, llm, session_id):
+    key = str(uuid.uuid4())
+    first = await send(client, session_id, key=key)
+    # Roll the keyed turn into an older bucket
+    for _ in range(3):
+        await send(client, session_id, key=str(uuid.uuid4()))
+
+    replayed = await send(client, session_id, key=key)
+    reused = await send(client, session_id, "Ho la febbre alta", key=key)
+
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.json()["response"] == first.json()["response"]
+    assert reused.status_code == 422
+    assert llm.calls == 4
+    stored = await stored_buckets(backend, session_id)
+    assert sum(bucket["count"] for bucket in stored) == 8
+    assert [key in bucket.get("idempotency_keys", []) for bucket in stored] == [True, False]
+
+async def test_a_turn_stored_by_another_worker_is_replayed_once(backend, client, llm, session_id):
+    before = (await backend.db.chat_sessions.find_one({"session_id": session_id}))["message_count"]
+    llm.latency = 0.05
+    key = str(uuid.uuid4())
+
+    # Two workers: no shared in-flight map, and both miss the stored reply
+    first, second = await asyncio.gather(
+        backend.run_chat_turn(session_id, MESSAGE, key), backend.run_chat_turn(session_id, MESSAGE, key)
+    )
+
+    assert first["response"] == second["response"] == llm.reply
+    assert sum(bucket["count"] for bucket in await stored_buckets(backend, session_id)) == 2
+    assert (await backend.db.chat_sessions.find_one({"session_id": session_id}))["message_count"] == before + 2
+
+async def test_a_key_in_an_older_bucket_is_never_appended_again(backend, buckets, session_id):
+    turn = backend.Message(session_id=session_id, message_type="user", content=MESSAGE, idempotency_key="k").dict()
+    await backend.message_writer.write(session_id, [turn], {"$inc": {"message_count": 1}}, wait=True)
+    for _ in range(BUCKET_SIZE):
+        other = backend.Message(session_id=session_id, message_type="user", content="...").dict()
+        await backend.message_writer.write(session_id, [other], {"$inc": {"message_count": 1}}, wait=True)
+
+    again = dict(turn, id=str(uuid.uuid4()))
+    with pytest.raises(DuplicateTurn):
+        await backend.message_writer.write(session_id, [again], {"$inc": {"message_count": 1}}, wait=True)
+    assert sum(bucket["count"] for bucket in await stored_buckets(backend, session_id)) == BUCKET_SIZE + 1
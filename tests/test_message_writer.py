@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+
+from message_writer import MessageWriter
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()[f"test_{uuid.uuid4().hex}"]
+    await db.messages.create_index([("session_id", 1), ("idempotency_key", 1)], unique=True)
+    for session_id in ("a", "b"):
+        await db.chat_sessions.insert_one({"session_id": session_id, "message_count": 0})
+    return db
+
+def turn(session_id, key):
+    return [
+        {"id": str(uuid.uuid4()), "session_id": session_id, "message_type": "user", "idempotency_key": key},
+        {"id": str(uuid.uuid4()), "session_id": session_id, "message_type": "assistant", "idempotency_key": f"{key}:reply"}
+    ]
+
+COUNTERS = {"$inc": {"message_count": 2}}
+
+async def counts(db):
+    return {
+        session["session_id"]: session["message_count"]
+        async for session in db.chat_sessions.find({}, {"session_id": 1, "message_count": 1})
+    }
+
+async def test_a_duplicate_turn_does_not_keep_the_rest_of_the_batch_out(db):
+    flushed = []
+    writer = MessageWriter(db, write_behind=True, flush_interval=0.05, on_flushed=flushed.append)
+    writer.start()
+    await writer.write("a", turn("a", "k1"), COUNTERS)
+    await writer.write("a", turn("a", "k1"), COUNTERS)  # the same turn stored twice
+    await writer.write("b", turn("b", "k2"), COUNTERS)
+    await writer.close()
+
+    assert await counts(db) == {"a": 2, "b": 2}
+    assert await db.messages.count_documents({}) == 4
+    assert writer.duplicates == 1 and writer.dead_lettered == 0
+    assert sorted(flushed) == ["a", "b"]
+
+async def test_turns_that_keep_failing_are_dead_lettered_without_their_counters(db, monkeypatch):
+    collection = type(db.messages)
+    insert_many = collection.insert_many
+
+    async def unavailable(self, *args, **kwargs):
+        if self.name == "messages":
+            raise ConnectionError("no primary")
+        return await insert_many(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "insert_many", unavailable)
+    writer = MessageWriter(db, write_behind=True, max_retries=2, retry_delay=0)
+    writer.start()
+    await writer.write("a", turn("a", "k1"), COUNTERS)
+    await writer.close()
+
+    assert await counts(db) == {"a": 0, "b": 0}
+    assert writer.retried == 2 and writer.dead_lettered == 1
+    dead_letter = await db.message_dead_letters.find_one({"session_id": "a"})
+    assert [message["idempotency_key"] for message in dead_letter["messages"]] == ["k1", "k1:reply"]
+    assert dead_letter["session_update"] == {"inc": {"message_count": 2}}
+    assert "no primary" in dead_letter["error"]
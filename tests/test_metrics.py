@@ -0,0 +1,67 @@
+import re
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+async def scrape(client):
+    # {(name, labels): value}; the registry is process-wide, so tests compare
+    # scrapes taken before and after the requests they make
+    response = await client.get("/api/metrics")
+    assert response.status_code == 200
+    samples = {}
+    for line in response.text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[name, labels or ""] = float(value.replace("+Inf", "inf"))
+    return samples
+
+def delta(before, after, name, labels=""):
+    return after.get((name, labels), 0.0) - before.get((name, labels), 0.0)
+
+async def send(client, session_id):
+    return await client.post("/api/chat/message", json={
+        "session_id": session_id, "message": "Ho un leggero mal di gola", "idempotency_key": str(uuid.uuid4())
+    })
+
+async def test_llm_and_request_metrics_follow_the_stub(backend, client, llm):
+    llm.latency = 0.05
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+
+    before = await scrape(client)
+    assert (await send(client, session_id)).status_code == 200
+    after = await scrape(client)
+
+    call = 'operation="reply",outcome="ok"'
+    assert delta(before, after, "medagent_llm_call_duration_seconds_count", call) == 1
+    assert 0.05 <= delta(before, after, "medagent_llm_call_duration_seconds_sum", call) < 1
+    # 0.05 s falls in the le=0.05 bucket, not the one below
+    assert delta(before, after, "medagent_llm_call_duration_seconds_bucket", call + ',le="0.025"') == 0
+    assert delta(before, after, "medagent_llm_call_duration_seconds_bucket", call + ',le="0.1"') == 1
+    assert delta(before, after, "medagent_llm_response_chars_sum", 'operation="reply"') == len(llm.reply)
+    assert delta(before, after, "medagent_llm_prompt_tokens_count", 'operation="reply"') == 1
+    assert after["medagent_llm_calls_in_flight", 'operation="reply"'] == 0
+
+    request = 'method="POST",route="/api/chat/message",status="200"'
+    assert delta(before, after, "medagent_http_request_duration_seconds_count", request) == 1
+    assert delta(before, after, "medagent_http_request_duration_seconds_sum", request) >= 0.05
+
+    assert after["medagent_llm_pool", 'stat="created"'] == llm.connections == 1
+    assert after["medagent_llm_admission", 'stat="active"'] == 0
+
+async def test_failed_llm_calls_are_counted_with_their_fallback(backend, client, llm):
+    llm.failing = True
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+
+    before = await scrape(client)
+    assert (await send(client, session_id)).status_code == 200
+    after = await scrape(client)
+
+    assert delta(before, after, "medagent_llm_call_duration_seconds_count", 'operation="reply",outcome="error"') == llm.calls
+    assert delta(before, after, "medagent_llm_call_duration_seconds_count", 'operation="reply",outcome="ok"') == 0
+    assert delta(before, after, "medagent_llm_fallback_replies_total", 'reason="error"') == 1
+    assert after["medagent_llm_resilience", 'stat="failures"'] == 1
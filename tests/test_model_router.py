@@ -0,0 +1,92 @@
+import pytest
+
+from model_router import ModelRouter, ModelTier
+
+FAST = ModelTier("fast", "gemini", "gemini-2.0-flash-lite", 600)
+FULL = ModelTier("full", "gemini", "gemini-2.0-flash", 1500)
+
+def router(**kwargs):
+    return ModelRouter(fast=FAST, full=FULL, target_p95=2.0, **kwargs)
+
+@pytest.mark.parametrize("text, urgency, turn_count, tier", [
+    ("Ho la tosse", "low", 3, "fast"),
+    # Opening turns, urgent or long messages take the full tier
+    ("Ho la tosse", "low", 0, "full"),
+    ("Ho la febbre alta", "medium", 3, "full"),
+    ("Dolore toracico", "high", 3, "full"),
+    ("x" * 121, "low", 3, "full"),
+    ("x" * 120, "low", 3, "fast"),
+])
+def test_routing_decisions(text, urgency, turn_count, tier):
+    routing = router(fast_max_chars=120)
+    assert routing.route(text, urgency, turn_count).name == tier
+    assert routing.routed[tier] == 1
+
+def test_disabled_routing_always_takes_the_full_tier():
+    routing = router(enabled=False)
+    assert routing.route("Ho la tosse", "low", 3) is FULL
+
+def test_the_length_threshold_follows_the_p95_within_bounds():
+    routing = router(fast_max_chars=100, min_chars=40, max_chars=200, window=50, adapt_every=10)
+
+    for _ in range(50):
+        routing.observe("full", 3.0)
+    assert routing.fast_max_chars == 200
+    assert routing.route("x" * 150, "low", 3) is FAST
+    # Urgency never adapts
+    assert routing.route("x", "high", 3) is FULL
+
+    for _ in range(200):
+        routing.observe("fast", 0.5)
+    assert routing.fast_max_chars == 40
+    assert routing.stats()["fast_p95_seconds"] == 0.5
+
+@pytest.fixture
+def routing(backend, monkeypatch):
+    routing = router()
+    monkeypatch.setattr(backend, "model_router", routing)
+    return routing
+
+async def assistant_tiers(backend, session_id):
+    replies = await backend.db.messages.find(
+        {"session_id": session_id, "message_type": "assistant"}
+    ).sort("timestamp", 1).to_list(None)
+    return [reply["metadata"]["model_tier"] for reply in replies]
+
+@pytest.mark.anyio
+async def test_follow_ups_are_stored_with_their_tier(backend, client, llm, routing):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    for message in ["Ho la tosse", "Da ieri", "Ho la febbre alta"]:
+        assert (await client.post("/api/chat/message", json={"session_id": session_id, "message": message})).status_code == 200
+
+    assert await assistant_tiers(backend, session_id) == ["full", "fast", "full"]
+    assert routing.routed == {"fast": 1, "full": 2}
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/api/chat/message", "/api/chat/message/stream"])
+async def test_a_failing_fast_tier_is_retried_on_the_full_tier(backend, client, llm, routing, path):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    await client.post("/api/chat/message", json={"session_id": session_id, "message": "Ho la tosse"})
+    llm.failing_tiers = {"fast"}
+
+    response = await client.post(path, json={"session_id": session_id, "message": "Da ieri"})
+
+    assert response.status_code == 200
+    assert await assistant_tiers(backend, session_id) == ["full", "full"]
+    reply = (await backend.db.messages.find(
+        {"session_id": session_id, "message_type": "assistant"}
+    ).sort("timestamp", -1).to_list(1))[0]
+    assert reply["content"] == llm.reply and reply["metadata"]["fallback"] is None
+
+@pytest.mark.anyio
+async def test_the_template_is_used_once_the_full_tier_fails_too(backend, client, llm, routing):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    await client.post("/api/chat/message", json={"session_id": session_id, "message": "Ho la tosse"})
+    llm.failing_tiers = {"fast", "full"}
+    calls = llm.calls
+
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "message": "Da ieri"})
+
+    assert response.status_code == 200
+    assert response.json()["response"] == backend.FALLBACK_REPLIES["it"]["low"]
+    assert llm.calls == calls + 2
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+PROFILE = {"eta": "45", "genere": "F", "sintomo_principale": "tosse", "condizioni_note": ["asma"]}
+
+STARTED = datetime(2024, 1, 1)
+
+def history(count, words=12):
+    return [
+        {
+            "message_type": ("user", "assistant")[i % 2], "content": f"messaggio {i} " + "parola " * words,
+            "timestamp": STARTED + timedelta(seconds=i)
+        }
+        for i in range(count)
+    ]
+
+def test_everything_is_kept_when_it_fits():
+    messages = history(4)
+    built = PromptBuilder(token_budget=2000).build("Ho la tosse", messages, profile=PROFILE, summary="Tosse da tre giorni")
+
+    assert (built.history_messages, built.history_dropped) == (4, 0)
+    for message in messages:
+        assert message["content"] in built.prompt
+    assert built.prompt_tokens == estimate_tokens(built.prompt)
+
+@pytest.mark.parametrize("budget", [200, 300, 600, 1200])
+def test_a_long_history_stays_within_the_budget(budget):
+    built = PromptBuilder(token_budget=budget).build(
+        "Ho la tosse", history(200), profile=PROFILE, summary="Tosse da tre giorni", reserved_tokens=80
+    )
+
+    assert built.prompt_tokens <= budget
+    assert 0 < built.history_messages < 200
+    assert built.history_messages + built.history_dropped == 200
+
+def test_the_reserved_system_prompt_tokens_are_counted():
+    builder = PromptBuilder(token_budget=600)
+    without = builder.build("Ho la tosse", history(100))
+    reserved = builder.build("Ho la tosse", history(100), reserved_tokens=200)
+
+    assert reserved.history_messages < without.history_messages
+    assert reserved.prompt_tokens <= 600
+    assert reserved.prompt_tokens == estimate_tokens(reserved.prompt) + 200
+
+def test_the_oldest_history_is_dropped_first():
+    messages = history(50)
+    built = PromptBuilder(token_budget=400).build("Ho la tosse", messages)
+
+    # What survives is the newest messages, in order
+    kept = messages[built.history_dropped:]
+    assert built.history_dropped > 0
+    assert built.prompt.index(kept[0]["content"]) < built.prompt.index(kept[-1]["content"])
+    for message in messages[:built.history_dropped]:
+        assert f"{message['content']}\n" not in built.prompt
+
+def test_the_new_message_profile_and_summary_always_go_in():
+    builder = PromptBuilder(token_budget=40)
+    message = "Ho la tosse " + "e il raffreddore " * 20
+    built = builder.build(message, history(10), profile=PROFILE, summary="Tosse da tre giorni", reserved_tokens=30)
+
+    # Over budget on the fixed parts alone: only history is given up
+    assert built.history_messages == 0 and built.history_dropped == 10
+    assert built.prompt.endswith(message)
+    assert "asma" in built.prompt and "Tosse da tre giorni" in built.prompt
+
+def test_a_chat_turn_sends_the_system_prompt_and_the_latest_message(backend):
+    messages = history(300)
+    profile = dict(PROFILE, language="en")
+    turn = backend.build_chat_turn("s", "I have a cough", messages, {"message_count": 300}, profile)
+
+    assert turn.language == "en"
+    assert turn.prompt_tokens <= backend.PROMPT_TOKEN_BUDGET
+    assert turn.prompt.endswith("New user message: I have a cough")
+    assert turn.history_dropped > 0
+    assert messages[-1]["content"] in turn.prompt
+    # The system prompt is sent apart from the prompt, and its share of the
+    # budget is taken off before any history goes in
+    assert turn.prompt_tokens == estimate_tokens(turn.prompt) + backend.SYSTEM_PROMPT_TOKENS["en"]
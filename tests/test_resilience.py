@@ -0,0 +1,112 @@
+import asyncio
+import uuid
+
+import pytest
+
+from admission import AdmissionController
+from resilience import CircuitBreaker, ResilientCaller
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE = "Ho un leggero mal di gola"
+
+@pytest.fixture
+async def session_id(client):
+    return (await client.post("/api/chat/session")).json()["session_id"]
+
+async def send(client, session_id):
+    response = await client.post("/api/chat/message", json={
+        "session_id": session_id, "message": MESSAGE, "idempotency_key": str(uuid.uuid4())
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def stored_reply(backend, session_id):
+    return await backend.db.messages.find_one(
+        {"session_id": session_id, "message_type": "assistant", "content": {"$ne": None}},
+        sort=[("timestamp", -1)]
+    )
+
+def fallback_text(backend):
+    return backend.FALLBACK_REPLIES["it"][backend.triage.urgency(MESSAGE, "it")]
+
+async def test_a_call_past_its_deadline_gets_the_fallback_reply(backend, client, llm, session_id, monkeypatch):
+    monkeypatch.setattr(backend, "llm_resilience", ResilientCaller(CircuitBreaker(), attempt_timeout=0.05))
+    llm.latency = 1.0
+
+    reply = await send(client, session_id)
+
+    assert reply["response"] == fallback_text(backend)
+    assert (await stored_reply(backend, session_id))["metadata"]["fallback"] == "timeout"
+    assert backend.llm_resilience.timeouts == 1
+    assert backend.llm_admission.active == 0
+
+async def test_a_hedge_answers_for_a_slow_first_attempt(backend, client, llm, session_id, monkeypatch):
+    monkeypatch.setattr(backend, "llm_resilience", ResilientCaller(
+        CircuitBreaker(), attempt_timeout=1.0, hedging=True, hedge_min_delay=0.05
+    ))
+    monkeypatch.setattr(backend.llm_resilience, "hedge_delay", lambda: 0.05)
+    llm.latencies = [0.5, 0.0]
+
+    reply = await send(client, session_id)
+
+    assert reply["response"] == llm.reply
+    assert backend.llm_resilience.stats()["hedge_wins"] == 1
+    assert llm.max_in_flight == 2
+    assert backend.llm_admission.stats()["active"] == 0
+
+async def test_no_hedge_is_sent_without_a_free_admission_slot(backend, client, llm, session_id, monkeypatch):
+    monkeypatch.setattr(backend, "llm_admission", AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5))
+    monkeypatch.setattr(backend, "llm_resilience", ResilientCaller(
+        CircuitBreaker(), attempt_timeout=1.0, hedging=True, hedge_min_delay=0.05
+    ))
+    monkeypatch.setattr(backend.llm_resilience, "hedge_delay", lambda: 0.05)
+    llm.latency = 0.15
+
+    reply = await send(client, session_id)
+
+    assert reply["response"] == llm.reply
+    stats = backend.llm_resilience.stats()
+    assert (stats["hedged"], stats["hedges_skipped"]) == (0, 1)
+    assert llm.calls == 1
+
+async def test_the_hedge_slot_is_released_when_the_hedge_loses(backend, llm, monkeypatch):
+    admission = AdmissionController(max_concurrency=2, max_queue=4, queue_timeout=5)
+    caller = ResilientCaller(CircuitBreaker(), attempt_timeout=1.0, hedging=True, hedge_min_delay=0.05)
+    monkeypatch.setattr(caller, "hedge_delay", lambda: 0.05)
+    delays = [0.1, 0.5]
+
+    async def attempt():
+        await asyncio.sleep(delays.pop(0))
+        return "reply"
+
+    async with admission.slot():
+        assert await caller.call(attempt, acquire_hedge=admission.try_acquire) == "reply"
+        assert admission.active == 1
+    assert admission.active == 0 and admission.has_spare_capacity()
+
+async def test_the_circuit_opens_then_probes_and_closes(backend, client, llm, session_id, monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    monkeypatch.setattr(backend, "llm_resilience", ResilientCaller(breaker, attempt_timeout=1.0))
+    llm.failing = True
+
+    for _ in range(2):
+        assert (await send(client, session_id))["response"] == fallback_text(backend)
+    assert breaker.state == "open" and llm.calls == 2
+
+    # Open: answered with the fallback without calling the provider
+    assert (await send(client, session_id))["response"] == fallback_text(backend)
+    assert (await stored_reply(backend, session_id))["metadata"]["fallback"] == "circuit_open"
+    assert llm.calls == 2
+
+    # Half-open: a failed probe opens the circuit again
+    await asyncio.sleep(0.12)
+    await send(client, session_id)
+    assert llm.calls == 3 and breaker.state == "open"
+
+    # Half-open: a successful probe closes it
+    await asyncio.sleep(0.12)
+    llm.failing = False
+    assert (await send(client, session_id))["response"] == llm.reply
+    assert breaker.state == "closed"
+    assert backend.llm_resilience.stats()["short_circuited"] == 1
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from response_cache import ResponseCache
+
+def test_near_duplicates_match_within_scope_and_polarity():
+    cache = ResponseCache()
+    cache.put("it|adult", "Ho un forte mal di testa da stamattina", "reply", 2.0)
+
+    near = cache.get("it|adult", "ho forte mal di testa da stamattina")
+    assert near.match == "near" and near.response == "reply" and near.saved_seconds == 2.0
+    assert cache.get("en|adult", "ho forte mal di testa da stamattina") is None
+    assert cache.get("it|adult", "non ho forte mal di testa da stamattina") is None
+
+def test_removed_rows_are_reused_without_losing_the_moved_entries():
+    cache = ResponseCache(max_size=3)
+    texts = [
+        "ho la tosse secca da qualche giorno", "ho la febbre alta da qualche giorno",
+        "ho mal di gola forte da qualche giorno", "ho dolore alla schiena da qualche giorno"
+    ]
+    for index, text in enumerate(texts):
+        cache.put("scope", text, f"reply {index}", 1.0)
+
+    # The oldest entry was evicted; its row now holds the newest one
+    assert cache.stats()["size"] == 3
+    assert cache.get("scope", "ho la tosse secca") is None
+    for index, text in enumerate(texts[1:], 1):
+        near = cache.get("scope", text.replace("ho ", "io ho "))
+        assert near is not None and near.response == f"reply {index}"
@@ -0,0 +1,64 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+async def insert_legacy_session(db, **fields):
+    # Session and messages as written before the running counters existed
+    session_id = str(uuid.uuid4())
+    started = datetime.utcnow() - timedelta(hours=1)
+    await db.chat_sessions.insert_one(dict({
+        "id": str(uuid.uuid4()), "session_id": session_id, "start_time": started, "status": "active"
+    }, **fields))
+    await db.messages.insert_many([
+        {
+            "id": str(uuid.uuid4()), "session_id": session_id, "message_type": message_type, "content": "...",
+            "urgency_level": urgency, "next_questions": [], "timestamp": started + timedelta(minutes=i)
+        }
+        for i, (message_type, urgency) in enumerate([("user", None), ("assistant", "high"), ("user", None)])
+    ])
+    return session_id
+
+async def send(client, session_id, message="Ho un leggero mal di gola"):
+    return await client.post("/api/chat/message", json={
+        "session_id": session_id, "message": message, "idempotency_key": str(uuid.uuid4())
+    })
+
+@pytest.mark.parametrize("legacy_fields", [
+    {"message_count": {"$inc": 1}},  # the update document stored by the oldest code
+    {"message_count": 3},            # a number, but no per-type counters yet
+    {}
+], ids=["operator-document", "count-only", "no-counters"])
+async def test_legacy_sessions_are_repaired_before_the_first_new_turn(backend, client, legacy_fields):
+    session_id = await insert_legacy_session(backend.db, **legacy_fields)
+
+    response = await send(client, session_id)
+    assert response.status_code == 200, response.text
+
+    session = await backend.db.chat_sessions.find_one({"session_id": session_id})
+    assert (session["message_count"], session["user_count"], session["assistant_count"]) == (5, 3, 2)
+    assert session["max_urgency_rank"] == backend.URGENCY_RANK["high"]
+
+    summary = (await client.get(f"/api/chat/summary/{session_id}")).json()
+    assert summary["conversation_stats"]["total_messages"] == 5
+    assert summary["conversation_stats"]["max_urgency_level"] == "high"
+
+async def test_legacy_session_is_repaired_before_a_welcome_message(backend, client):
+    session_id = await insert_legacy_session(backend.db, message_count={"$inc": 1})
+
+    response = await client.post(f"/api/chat/welcome/{session_id}")
+    assert response.status_code == 200, response.text
+
+    session = await backend.db.chat_sessions.find_one({"session_id": session_id})
+    assert (session["message_count"], session["assistant_count"]) == (4, 2)
+
+async def test_counters_of_new_sessions_follow_each_turn(backend, client):
+    session_id = (await client.post("/api/chat/session")).json()["session_id"]
+    for _ in range(2):
+        assert (await send(client, session_id)).status_code == 200
+
+    session = await backend.db.chat_sessions.find_one({"session_id": session_id})
+    assert (session["message_count"], session["user_count"], session["assistant_count"]) == (4, 2, 2)
+    assert await backend.db.messages.count_documents({"session_id": session_id}) == 4
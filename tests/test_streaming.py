@@ -0,0 +1,87 @@
+import json
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+MESSAGE = "Ho un leggero mal di gola"
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+async def stream(client, session_id, message=MESSAGE, **extra):
+    response = await client.post("/api/chat/message/stream", json=dict(extra, session_id=session_id, message=message))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    return parse_events(response.text)
+
+@pytest.fixture
+async def session_id(client):
+    return (await client.post("/api/chat/session")).json()["session_id"]
+
+async def test_chunks_come_before_a_single_done(backend, client, llm, session_id):
+    events = await stream(client, session_id)
+
+    names = [name for name, _ in events]
+    assert names == ["chunk"] * (len(names) - 1) + ["done"] and len(names) > 1
+    assert "".join(data["text"] for name, data in events[:-1]) == llm.reply
+
+async def test_done_carries_the_classification_and_not_the_text(backend, client, llm, session_id):
+    done = (await stream(client, session_id))[-1][1]
+
+    assert "response" not in done
+    assert done["urgency_level"] in ("low", "medium", "high")
+    assert isinstance(done["next_questions"], list) and done["timestamp"]
+    stored = await backend.db.messages.find_one({"session_id": session_id, "message_type": "assistant"}, {"_id": 0})
+    assert stored["content"] == llm.reply and stored["urgency_level"] == done["urgency_level"]
+
+async def test_a_failure_before_the_first_chunk_streams_the_fallback(backend, client, llm, session_id):
+    llm.failing = True
+
+    events = await stream(client, session_id)
+
+    assert [name for name, _ in events] == ["chunk", "done"]
+    assert events[0][1]["text"] == backend.FALLBACK_REPLIES["it"][events[1][1]["urgency_level"]]
+
+async def test_a_failure_mid_stream_ends_with_an_error(backend, client, llm, session_id, monkeypatch):
+    async def broken_stream(chat, user_msg_obj):
+        yield "Capisco, "
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(backend, "stream_reply", broken_stream)
+    events = await stream(client, session_id)
+
+    assert [name for name, _ in events] == ["chunk", "error"]
+    assert "connection reset" in events[1][1]["detail"]
+    # Nothing half-written: the question is only stored with its reply
+    assert await backend.db.messages.count_documents({"session_id": session_id, "message_type": "user"}) == 0
+
+async def test_a_resent_key_replays_the_stored_reply(backend, client, llm, session_id):
+    key = str(uuid.uuid4())
+    await stream(client, session_id, idempotency_key=key)
+    stored = await backend.db.messages.find_one({"session_id": session_id, "message_type": "assistant"})
+
+    replayed = await stream(client, session_id, idempotency_key=key)
+    reused = await stream(client, session_id, "Ho la febbre alta", idempotency_key=key)
+
+    assert [name for name, _ in replayed] == ["done"]
+    assert replayed[0][1]["replayed"] is True and replayed[0][1]["response"] == llm.reply
+    assert replayed[0][1]["timestamp"] == stored["timestamp"].isoformat()
+    assert reused == [("error", {"status": 422, "detail": reused[0][1]["detail"]})]
+    assert llm.calls == 1
+    assert await backend.db.messages.count_documents({"session_id": session_id}) == 2
+
+async def test_the_key_header_is_honoured(backend, client, llm, session_id):
+    key = str(uuid.uuid4())
+    for _ in range(2):
+        response = await client.post(
+            "/api/chat/message/stream", json={"session_id": session_id, "message": MESSAGE},
+            headers={"Idempotency-Key": key}
+        )
+    assert [name for name, _ in parse_events(response.text)] == ["done"]
+    assert llm.calls == 1
@@ -0,0 +1,86 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from triage import TriageEngine
+
+RULES_PATH = Path(__file__).resolve().parent.parent / "backend" / "triage_rules.json"
+RULES = json.loads(RULES_PATH.read_text(encoding="utf-8"))
+
+@pytest.fixture(scope="module")
+def engine():
+    return TriageEngine.from_file(RULES_PATH)
+
+# The hard-coded checks the engine replaced, generalised to the rules file:
+# the first level, in file order, with a keyword anywhere in the text, and
+# the questions of the first follow-up rule with a keyword in the text
+
+def keyword_loop_urgency(text, spec):
+    text = text.lower()
+    for level, keywords in spec["urgency"].items():
+        if any(keyword.lower() in text for keyword in keywords):
+            return level
+    return spec.get("default_urgency", "low")
+
+def keyword_loop_follow_ups(text, spec):
+    text = text.lower()
+    for rule in spec.get("follow_ups", []):
+        if any(keyword.lower() in text for keyword in rule["keywords"]):
+            return rule["questions"]
+    return spec.get("default_follow_ups", [])
+
+def keywords(spec):
+    found = [keyword for level in spec["urgency"].values() for keyword in level]
+    return found + [keyword for rule in spec.get("follow_ups", []) for keyword in rule["keywords"]]
+
+def sample_texts(spec, count=400, seed=7):
+    # Keywords, their prefixes and extensions glued to letters or digits, so
+    # overlapping keywords, keywords inside longer words and keywords split
+    # across a boundary all come up
+    pieces = []
+    for keyword in keywords(spec):
+        pieces += [keyword, keyword.upper(), keyword[:-1], keyword[1:], keyword + "ic", "x" + keyword]
+    pieces += ["", "mal di testa", "a", "1", "ho", "headache", "è"]
+    separators = ["", " ", ", ", "-", ".", "\n"]
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        parts = rng.choices(pieces, k=rng.randint(1, 4))
+        text = parts[0]
+        for part in parts[1:]:
+            text += rng.choice(separators) + part
+        texts.append(text)
+    return texts
+
+HAND_PICKED = [
+    "",
+    # A shorter keyword inside a longer one of another level
+    "non preoccupante", "not concerning", "difficoltà respiratorie", "difficulty breathing",
+    "dolore toracico", "dolore intenso", "febbre alta", "high fever", "chest pain",
+    # Keywords inside longer words or numbers: the loop matched substrings
+    "traumatico", "11800", "mildew", "painful", "headache", "febbricola", "commonly",
+    # Cut short, or split by punctuation
+    "dolore toracic", "difficolt", "chest-pain", "febbre, alta", "118!", "(emorragia)",
+    # Several levels in one text
+    "lieve febbre alta con dolore toracico", "mild pain, then severe pain and poisoning",
+    "Ho un DOLORE INTENSO e la Febbre",
+]
+
+@pytest.mark.parametrize("language", sorted(RULES))
+def test_urgency_matches_the_keyword_loop(engine, language):
+    spec = RULES[language]
+    for text in HAND_PICKED + sample_texts(spec):
+        assert engine.urgency(text, language) == keyword_loop_urgency(text, spec), text
+
+@pytest.mark.parametrize("language", sorted(RULES))
+def test_follow_ups_match_the_keyword_loop(engine, language):
+    spec = RULES[language]
+    for text in HAND_PICKED + sample_texts(spec):
+        assert engine.follow_ups(text, language) == keyword_loop_follow_ups(text, spec), text
+
+def test_an_unknown_language_uses_the_default_rules(engine):
+    text = "dolore toracico"
+    assert engine.urgency(text, "fr") == engine.urgency(text, "it") == "high"
+    assert engine.follow_ups(text, None) == engine.follow_ups(text, "it")
@@ -0,0 +1,93 @@
+import uuid
+
+import pytest
+
+MESSAGE = "Ho un leggero mal di gola"
+
+@pytest.fixture
+def ws_client(backend):
+    # Not entered as a context manager, so the startup hooks stay off
+    # like they do for the HTTP client
+    from starlette.testclient import TestClient
+    return TestClient(backend.app)
+
+@pytest.fixture
+def session_id(ws_client):
+    return ws_client.post("/api/chat/session").json()["session_id"]
+
+def receive_turn(websocket):
+    # Events of one turn, up to and including its done or error event
+    events = []
+    while not events or events[-1]["type"] not in ("done", "error"):
+        events.append(websocket.receive_json())
+    return events
+
+def test_a_turn_streams_chunks_then_done(backend, ws_client, llm, session_id):
+    with ws_client.websocket_connect(f"/api/chat/ws/{session_id}") as websocket:
+        websocket.send_json({"message": MESSAGE, "idempotency_key": str(uuid.uuid4())})
+        events = receive_turn(websocket)
+
+    chunks = [event for event in events if event["type"] == "chunk"]
+    assert "".join(chunk["text"] for chunk in chunks) == llm.reply
+    done = events[-1]
+    assert done["type"] == "done" and "response" not in done
+    assert done["urgency_level"] in ("low", "medium", "high")
+
+@pytest.mark.parametrize("frame", [
+    "not json",
+    '{"text": "no message field"}',
+    '{"message": 5}',
+    '{"message": null}',
+    '{"message": "ok", "idempotency_key": 7}',
+    '["message"]'
+])
+def test_a_malformed_frame_gets_an_error_and_the_socket_stays_open(backend, ws_client, llm, session_id, frame):
+    with ws_client.websocket_connect(f"/api/chat/ws/{session_id}") as websocket:
+        websocket.send_text(frame)
+        error = websocket.receive_json()
+        assert error["type"] == "error" and error["status"] == 400
+
+        websocket.send_json({"message": MESSAGE})
+        assert receive_turn(websocket)[-1]["type"] == "done"
+    assert llm.calls == 1
+
+def test_a_resent_key_replays_the_stored_reply(backend, ws_client, llm, session_id):
+    key = str(uuid.uuid4())
+    with ws_client.websocket_connect(f"/api/chat/ws/{session_id}") as websocket:
+        websocket.send_json({"message": MESSAGE, "idempotency_key": key})
+        first = receive_turn(websocket)[-1]
+        websocket.send_json({"message": MESSAGE, "idempotency_key": key})
+        replayed = receive_turn(websocket)
+        websocket.send_json({"message": "Ho la febbre alta", "idempotency_key": key})
+        reused = receive_turn(websocket)
+
+    assert [event["type"] for event in replayed] == ["done"]
+    assert replayed[0]["replayed"] is True and replayed[0]["response"] == llm.reply
+    assert replayed[0]["urgency_level"] == first["urgency_level"]
+    assert reused[-1]["type"] == "error" and reused[-1]["status"] == 422
+    assert llm.calls == 1
+
+def test_a_failing_turn_reports_an_error_and_keeps_the_socket(backend, ws_client, llm, session_id, monkeypatch):
+    build_chat_turn = backend.build_chat_turn
+    failures = [RuntimeError("context unavailable")]
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return build_chat_turn(*args, **kwargs)
+
+    monkeypatch.setattr(backend, "build_chat_turn", flaky)
+    with ws_client.websocket_connect(f"/api/chat/ws/{session_id}") as websocket:
+        websocket.send_json({"message": MESSAGE})
+        error = websocket.receive_json()
+        assert error["type"] == "error" and error["status"] == 500
+
+        websocket.send_json({"message": MESSAGE})
+        assert receive_turn(websocket)[-1]["type"] == "done"
+
+def test_an_unknown_session_is_closed_with_4404(backend, ws_client):
+    from starlette.websockets import WebSocketDisconnect
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with ws_client.websocket_connect("/api/chat/ws/missing") as websocket:
+            websocket.receive_json()
+    assert closed.value.code == 4404